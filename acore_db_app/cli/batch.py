@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+``acoredb quest batch`` 的实现. 从 stdin 或文件中读取 NDJSON 格式的请求, 每处理完一个
+请求就立刻输出一行 NDJSON 格式的结果. 这样一次 SSM 调用就可以处理一整批 GM 请求.
+
+输入, 每行一个请求, ``locale`` 和 ``n`` 是可选的::
+
+    {"char": "mychar", "locale": "enUS", "n": 3}
+    {"char": "otherchar"}
+
+输出, 每行一个结果, 顺序跟输入一致::
+
+    {"char": "mychar", "locale": "enUS", "n": 3, "ok": true, "data": [...]}
+    {"char": "otherchar", "locale": "enUS", "n": 3, "ok": false, "error": "..."}
+
+注: 这个模块的顶部只能 import 标准库, 原因见 :mod:`acore_db_app.cli.daemon`.
+"""
+
+import typing as T
+import sys
+import json
+
+from .chunk import MAX_STDOUT_SIZE, FmtEnum, ChunkWriter, split_chunks, emit
+
+DEFAULT_LOCALE = "enUS"
+DEFAULT_N = 3
+
+T_FETCH = T.Callable[[str, str, int], T.Any]
+
+
+def parse_request(line: str) -> dict:
+    """
+    解析一行请求, 并填充默认值.
+    """
+    dct = json.loads(line)
+    return {
+        "char": dct["char"],
+        "locale": dct.get("locale", DEFAULT_LOCALE),
+        "n": int(dct.get("n", DEFAULT_N)),
+    }
+
+
+def iter_results(
+    lines: T.Iterable[str],
+    fetch: T_FETCH,
+) -> T.Iterable[dict]:
+    """
+    逐个处理请求, 每处理完一个就 yield 一个结果. 单个请求失败不会影响后面的请求.
+
+    :param lines: 请求, 每行一个 JSON.
+    :param fetch: 执行查询的函数, 参数是 ``(char, locale, n)``.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = parse_request(line)
+        except Exception as e:
+            yield {"request": line, "ok": False, "error": f"{e.__class__.__name__}: {e}"}
+            continue
+        try:
+            data = fetch(request["char"], request["locale"], request["n"])
+            yield {**request, "ok": True, "data": data}
+        except Exception as e:
+            yield {**request, "ok": False, "error": f"{e.__class__.__name__}: {e}"}
+
+
+def run_batch(
+    lines: T.Iterable[str],
+    fetch: T_FETCH,
+    fmt: str = FmtEnum.json,
+    stream: T.Optional[T.TextIO] = None,
+    max_size: int = MAX_STDOUT_SIZE,
+):
+    """
+    处理所有请求, 并把结果以 NDJSON 格式逐行写入 ``stream``, 默认是 stdout.
+
+    :param fmt: 如果是 ``gzip``, 则每处理完一个请求, 就把这个结果单独压缩分块后输出.
+        所有结果共享 ``max_size`` 的输出大小, 超出的部分会被暂存, 可以用
+        ``acoredb chunk`` 取回. 可以用 :func:`~acore_db_app.cli.chunk.group_chunks`
+        把输出按结果分组后再用 :func:`~acore_db_app.cli.chunk.join_chunks` 解码.
+        详见 :mod:`acore_db_app.cli.chunk`.
+    :param max_size: ``gzip`` 格式的最大输出大小.
+    """
+    if stream is None:
+        stream = sys.stdout
+    if fmt != FmtEnum.gzip:
+        for result in iter_results(lines=lines, fetch=fetch):
+            emit(result, fmt=fmt, stream=stream)
+        return
+    writer = ChunkWriter(stream=stream, max_size=max_size)
+    for result in iter_results(lines=lines, fetch=fetch):
+        writer.write(split_chunks(result))
+    writer.close()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+"""
+压缩, 分块的 CLI 输出格式.
+
+SSM Run Command 的 ``StandardOutputContent`` 最多只保留 24000 个字符, 超出的部分会被截断.
+当结果很大时 (例如 ``n`` 很大, 或者 batch 的结果), 我们会把 JSON 用 gzip 压缩并用 base64
+编码, 然后切成多个带有序号的 chunk, 每个 chunk 一行::
+
+    acdb-chunk ${key} ${index} ${total} ${crc32} ${data}
+
+一次调用只输出不超过 :data:`MAX_STDOUT_SIZE` 的 chunk, 包括 batch 中所有结果的 chunk.
+如果还有剩下的 chunk, 它们会被暂存在 diskcache 中, 并且在最后输出一行::
+
+    acdb-more ${key} ${start}
+
+SDK 可以用 ``acoredb chunk --key ${key} --start ${start}`` 取回剩下的部分 (它的输出也可能
+以 ``acdb-more`` 结尾), 然后用 :func:`join_chunks` 重新组装成原来的数据. batch 的输出
+先用 :func:`group_chunks` 按结果分组.
+
+注: 这个模块的顶部只能 import 标准库, 原因见 :mod:`acore_db_app.cli.daemon`. SDK 也会用到
+这个模块来解析 CLI 的输出.
+"""
+
+import typing as T
+import sys
+import enum
+import json
+import gzip
+import zlib
+import base64
+import hashlib
+import dataclasses
+
+CHUNK_PREFIX = "acdb-chunk"
+MORE_PREFIX = "acdb-more"
+MAX_STDOUT_SIZE = 24000
+# 为最后的 acdb-more 行预留的输出大小
+MORE_LINE_SIZE = 64
+CHUNK_SIZE = 4000
+CHUNK_CACHE_EXPIRE = 600
+
+
+class FmtEnum(str, enum.Enum):
+    """
+    CLI 的输出格式.
+    """
+
+    json = "json"
+    gzip = "gzip"
+
+
+@dataclasses.dataclass
+class Chunk:
+    """
+    压缩后的 payload 的一个片段.
+
+    :param key: payload 的唯一标识, 由 payload 的 hash 生成.
+    :param index: 片段的序号, 从 0 开始.
+    :param total: 片段的总数.
+    :param data: base64 编码的数据.
+    """
+
+    key: str
+    index: int
+    total: int
+    data: str
+
+    def to_line(self) -> str:
+        crc = zlib.crc32(self.data.encode("ascii"))
+        return f"{CHUNK_PREFIX} {self.key} {self.index} {self.total} {crc} {self.data}"
+
+    @classmethod
+    def from_line(cls, line: str) -> T.Optional["Chunk"]:
+        """
+        解析一行输出. 如果这一行不是 chunk 或者已经被截断了则返回 None.
+        """
+        parts = line.strip().split(" ")
+        if len(parts) != 6 or parts[0] != CHUNK_PREFIX:
+            return None
+        _, key, index, total, crc, data = parts
+        if zlib.crc32(data.encode("ascii")) != int(crc):
+            return None
+        return cls(key=key, index=int(index), total=int(total), data=data)
+
+
+def encode(obj: T.Any) -> str:
+    return base64.b64encode(
+        gzip.compress(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+    ).decode("ascii")
+
+
+def decode(payload: str) -> T.Any:
+    return json.loads(gzip.decompress(base64.b64decode(payload)).decode("utf-8"))
+
+
+def split_chunks(
+    obj: T.Any,
+    chunk_size: int = CHUNK_SIZE,
+) -> T.List[Chunk]:
+    payload = encode(obj)
+    # 加上前缀避免 fire 把纯数字的 key 解析成 int
+    key = "k" + hashlib.sha256(payload.encode("ascii")).hexdigest()[:16]
+    datas = [
+        payload[i : i + chunk_size] for i in range(0, len(payload), chunk_size)
+    ] or [""]
+    return [
+        Chunk(key=key, index=index, total=len(datas), data=data)
+        for index, data in enumerate(datas)
+    ]
+
+
+def parse_chunks(text: str) -> T.Dict[int, Chunk]:
+    """
+    从 CLI 的输出中解析出所有完整的 chunk, 返回 ``{index: chunk}``.
+    """
+    chunks = dict()
+    for line in text.splitlines():
+        chunk = Chunk.from_line(line)
+        if chunk is not None:
+            chunks[chunk.index] = chunk
+    return chunks
+
+
+def group_chunks(text: str) -> T.List[T.Dict[int, Chunk]]:
+    """
+    从包含多个 payload 的输出 (例如 ``acoredb quest batch --fmt gzip``) 中解析出所有
+    完整的 chunk, 按照 payload 分组, 顺序和输出中的顺序一致. 每个 payload 的 chunk
+    是连续输出的, 所以 key 变化或者 index 回到 0 就是一个新的 payload. 相同内容的
+    payload 的 key 是一样的, 所以不能只按 key 分组.
+    """
+    groups: T.List[T.Dict[int, Chunk]] = list()
+    key = None
+    for line in text.splitlines():
+        chunk = Chunk.from_line(line)
+        if chunk is None:
+            continue
+        if not groups or chunk.index == 0 or chunk.key != key:
+            groups.append(dict())
+        groups[-1][chunk.index] = chunk
+        key = chunk.key
+    return groups
+
+
+def first_missing_index(chunks: T.Dict[int, Chunk]) -> T.Optional[int]:
+    """
+    返回第一个缺失的 chunk 的序号, 如果所有 chunk 都齐了则返回 None.
+    """
+    if not chunks:
+        return 0
+    total = next(iter(chunks.values())).total
+    for index in range(total):
+        if index not in chunks:
+            return index
+    return None
+
+
+def join_chunks(chunks: T.Dict[int, Chunk]) -> T.Any:
+    """
+    把所有 chunk 重新组装成原来的数据.
+    """
+    index = first_missing_index(chunks)
+    if index is not None:
+        raise ValueError(f"chunk {index} is missing")
+    return decode("".join(chunks[i].data for i in range(len(chunks))))
+
+
+def _get_cache():
+    # 注: 原因见 acore_db_app.cli.main 中 import impl 的注释
+    from ..cache import cache
+
+    return cache
+
+
+def parse_more(text: str) -> T.Optional[T.Tuple[str, int]]:
+    """
+    解析输出中的 ``acdb-more ${key} ${start}`` 行, 如果没有则返回 None.
+    """
+    for line in text.splitlines():
+        parts = line.strip().split(" ")
+        if len(parts) == 3 and parts[0] == MORE_PREFIX:
+            return parts[1], int(parts[2])
+    return None
+
+
+def _write_lines(
+    lines: T.List[str],
+    key: str,
+    start: int,
+    max_size: int,
+    stream: T.TextIO,
+):
+    """
+    从 ``start`` 开始输出暂存的 chunk 行, 直到总大小超过 ``max_size`` 为止, 至少会输出
+    一行. 如果还有剩下的行, 最后输出 ``acdb-more ${key} ${next_index}``.
+    """
+    size = 0
+    index = start
+    while index < len(lines):
+        line = lines[index] + "\n"
+        if index > start and size + len(line) > max_size - MORE_LINE_SIZE:
+            break
+        stream.write(line)
+        size += len(line)
+        index += 1
+    if index < len(lines):
+        stream.write(f"{MORE_PREFIX} {key} {index}\n")
+    stream.flush()
+
+
+@dataclasses.dataclass
+class ChunkWriter:
+    """
+    把一个或多个 payload 的 chunk 写入 ``stream``, 所有 payload 共享 ``max_size`` 的
+    输出大小. 超出大小的 chunk 不会被输出, 而是在 :meth:`close` 时暂存到 diskcache 中,
+    并输出一行 ``acdb-more``. 之后的 payload 的 chunk 也都会被暂存, 这样输出的顺序不变.
+
+    :param stream: 输出的 stream.
+    :param max_size: 输出的最大字符数, 包括最后的 ``acdb-more`` 行.
+    """
+
+    stream: T.TextIO = dataclasses.field()
+    max_size: int = dataclasses.field(default=MAX_STDOUT_SIZE)
+    size: int = dataclasses.field(default=0)
+    remaining: T.List[str] = dataclasses.field(default_factory=list)
+
+    def write(self, chunks: T.List[Chunk]):
+        for chunk in chunks:
+            line = chunk.to_line()
+            if self.remaining or (
+                self.size
+                and self.size + len(line) + 1 > self.max_size - MORE_LINE_SIZE
+            ):
+                self.remaining.append(line)
+            else:
+                self.stream.write(line + "\n")
+                self.size += len(line) + 1
+        self.stream.flush()
+
+    def close(self):
+        if not self.remaining:
+            return
+        sha256 = hashlib.sha256("".join(self.remaining).encode("ascii"))
+        key = "k" + sha256.hexdigest()[:16]
+        _get_cache().set(
+            f"{CHUNK_PREFIX}-{key}",
+            self.remaining,
+            expire=CHUNK_CACHE_EXPIRE,
+        )
+        self.stream.write(f"{MORE_PREFIX} {key} 0\n")
+        self.stream.flush()
+
+
+def emit(
+    obj: T.Any,
+    fmt: str = FmtEnum.json,
+    stream: T.Optional[T.TextIO] = None,
+    max_size: int = MAX_STDOUT_SIZE,
+):
+    """
+    按照指定的格式输出结果.
+
+    :param obj: 需要输出的 JSON 友好的数据.
+    :param fmt: ``json`` 表示直接输出 JSON, ``gzip`` 表示输出压缩分块后的数据.
+    :param max_size: ``gzip`` 格式的最大输出大小, 详见 :class:`ChunkWriter`.
+    """
+    if stream is None:
+        stream = sys.stdout
+    if fmt == FmtEnum.json:
+        stream.write(json.dumps(obj, ensure_ascii=False))
+        stream.write("\n")
+        stream.flush()
+    elif fmt == FmtEnum.gzip:
+        writer = ChunkWriter(stream=stream, max_size=max_size)
+        writer.write(split_chunks(obj))
+        writer.close()
+    else:
+        raise ValueError(f"invalid fmt {fmt!r}, must be one of 'json', 'gzip'")
+
+
+def emit_remaining(
+    key: str,
+    start: int,
+    stream: T.Optional[T.TextIO] = None,
+    max_size: int = MAX_STDOUT_SIZE,
+):
+    """
+    输出被暂存在 diskcache 中的剩下的 chunk.
+    """
+    if stream is None:
+        stream = sys.stdout
+    lines = _get_cache().get(f"{CHUNK_PREFIX}-{key}")
+    if lines is None:
+        raise KeyError(f"chunk {key!r} not found or expired")
+    _write_lines(lines, key=key, start=start, max_size=max_size, stream=stream)
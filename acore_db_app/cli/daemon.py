@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+该模块实现了一个常驻内存的 ``acoredb`` daemon, 以及跟它通信的 client.
+
+每次通过 SSM Run Command 调用 ``acoredb`` 都要启动 Python 解释器, import SQLAlchemy 等依赖,
+读取 metadata 缓存, 获取数据库的连接信息, 然后建立新的数据库连接, 而真正的查询只需要几毫秒.
+``acoredb serve`` 会启动一个 daemon, 它会一直持有 :class:`~acore_db_app.orm.Orm` 对象,
+数据库连接池以及各种缓存, 并在一个 Unix socket 上监听请求. 当 daemon 运行时, CLI 会自动
+切换到 client 模式, 把请求转发给 daemon.
+
+通信协议: client 每次发送一行 JSON 请求 ``{"cmd": "...", "kwargs": {...}}``, daemon
+返回一行 JSON 响应 ``{"ok": true, "data": ...}`` 或 ``{"ok": false, "error": "..."}``.
+同一个连接可以连续发送多个请求.
+
+注: 这个模块的顶部只能 import 标准库. client 模式的意义就在于不用 import 那些重量级的依赖.
+
+Windows 上没有 Unix socket, 这时 daemon 无法启动, :func:`connect` 总是返回 None,
+CLI 会在当前进程中处理请求.
+"""
+
+import typing as T
+import os
+import json
+import socket
+import socketserver
+import threading
+from pathlib import Path
+
+from ..paths import path_daemon_socket
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from ..orm import Orm
+
+HAS_UNIX_SOCKET = hasattr(socket, "AF_UNIX")
+
+
+class DaemonError(Exception):
+    """
+    Raised when the daemon returns an error response.
+    """
+
+
+class DaemonState:
+    """
+    daemon 进程中被所有请求共享的状态. ``Orm`` 对象在第一次被需要时才会被创建, 这样
+    ``ping`` 之类的请求不需要连接数据库.
+
+    :param orm_factory: 一个创建 ``Orm`` 对象的函数, 默认使用 ``get_orm_from_ec2_inside``.
+    """
+
+    def __init__(
+        self,
+        orm_factory: T.Optional[T.Callable[[], "Orm"]] = None,
+    ):
+        self._orm_factory = orm_factory
+        self._orm: T.Optional["Orm"] = None
+        self._lock = threading.Lock()
+
+    @property
+    def orm(self) -> "Orm":
+        if self._orm is None:
+            with self._lock:
+                if self._orm is None:
+                    if self._orm_factory is None:
+                        from ..orm_getter import get_orm_from_ec2_inside
+
+                        self._orm = get_orm_from_ec2_inside(
+                            # daemon 会长期运行, 需要在使用连接前检查连接是否还有效
+                            engine_kwargs=dict(pool_pre_ping=True, pool_recycle=3600),
+                        )
+                    else:
+                        self._orm = self._orm_factory()
+        return self._orm
+
+
+def _handle_ping(state: DaemonState) -> str:
+    return "pong"
+
+
+def _handle_warmup(state: DaemonState) -> str:
+    import sqlalchemy as sa
+
+    with state.orm.engine.connect() as conn:
+        conn.execute(sa.text("SELECT 1"))
+    return "ok"
+
+
+def _handle_get_latest_n_quest(
+    state: DaemonState,
+    character: str,
+    locale: str,
+    n: int,
+) -> T.List[dict]:
+    from .impl import get_latest_n_quest_data
+
+    return get_latest_n_quest_data(
+        orm=state.orm,
+        character=character,
+        locale=locale,
+        n=n,
+    )
+
+
+handlers: T.Dict[str, T.Callable[..., T.Any]] = {
+    "ping": _handle_ping,
+    "warmup": _handle_warmup,
+    "get_latest_n_quest": _handle_get_latest_n_quest,
+}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "DaemonServer"
+
+    def _dispatch(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+            handler = handlers[request["cmd"]]
+            data = handler(self.server.state, **request.get("kwargs", {}))
+            return {"ok": True, "data": data}
+        except Exception as e:
+            return {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self._dispatch(line)
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+            self.wfile.write(b"\n")
+            self.wfile.flush()
+
+
+if HAS_UNIX_SOCKET:
+
+    class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(
+            self,
+            path_socket: Path,
+            state: DaemonState,
+        ):
+            self.state = state
+            super().__init__(str(path_socket), _RequestHandler)
+
+
+def _remove_stale_socket(path_socket: Path):
+    """
+    如果 socket 文件存在但没有 daemon 在监听 (例如上一个 daemon 被 kill -9 了),
+    就删除它. 如果已经有 daemon 在监听了则抛出异常.
+    """
+    if path_socket.exists():
+        client = connect(path_socket=path_socket)
+        if client is not None:
+            client.close()
+            raise DaemonError(f"daemon is already running at {path_socket}")
+        path_socket.unlink()
+
+
+def serve(
+    path_socket: Path = path_daemon_socket,
+    orm_factory: T.Optional[T.Callable[[], "Orm"]] = None,
+    ready: T.Optional[threading.Event] = None,
+):
+    """
+    启动 daemon 并一直运行, 直到进程被终止.
+
+    :param path_socket: Unix socket 文件的路径.
+    :param orm_factory: 见 :class:`DaemonState`.
+    :param ready: 可选参数, daemon 开始监听后会 set 这个 event, 用于测试.
+
+    :raises DaemonError: 当前平台不支持 Unix socket.
+    """
+    if not HAS_UNIX_SOCKET:  # pragma: no cover
+        raise DaemonError("the daemon requires Unix sockets, not available here")
+    path_socket = Path(path_socket)
+    _remove_stale_socket(path_socket)
+    state = DaemonState(orm_factory=orm_factory)
+    with DaemonServer(path_socket=path_socket, state=state) as server:
+        # 只允许同一个用户和组访问
+        os.chmod(str(path_socket), 0o660)
+        if ready is not None:
+            ready.set()
+        try:
+            server.serve_forever()
+        finally:
+            if path_socket.exists():
+                path_socket.unlink()
+
+
+class Client:
+    """
+    跟 daemon 通信的 client. 一个 client 对象对应一个 socket 连接, 可以发送多个请求.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._rfile = sock.makefile("rb")
+
+    def call(self, cmd: str, **kwargs) -> T.Any:
+        """
+        发送一个请求并等待结果.
+
+        :raises DaemonError: daemon 返回了错误.
+        """
+        request = json.dumps({"cmd": cmd, "kwargs": kwargs}, ensure_ascii=False)
+        self._sock.sendall(request.encode("utf-8") + b"\n")
+        line = self._rfile.readline()
+        if not line:
+            raise DaemonError("daemon closed the connection")
+        response = json.loads(line)
+        if response["ok"]:
+            return response["data"]
+        raise DaemonError(response["error"])
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def connect(
+    path_socket: Path = path_daemon_socket,
+    timeout: T.Optional[float] = None,
+) -> T.Optional[Client]:
+    """
+    尝试连接 daemon. 如果 daemon 没有运行, 或者当前平台不支持 Unix socket, 则返回 None.
+
+    :param timeout: socket 的超时时间, 默认不超时, 因为数据库查询可能会比较慢.
+    """
+    if not HAS_UNIX_SOCKET:  # pragma: no cover
+        return None
+    if not Path(path_socket).exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(path_socket))
+    except OSError:
+        sock.close()
+        return None
+    return Client(sock)
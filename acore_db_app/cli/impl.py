@@ -1,30 +1,71 @@
 # -*- coding: utf-8 -*-
 
 
-import json
+import typing as T
 import dataclasses
 
 from ..app import api as app
+from ..orm import Orm
 from ..orm_getter import get_orm_from_ec2_inside
 
+from .batch import run_batch
+from .chunk import FmtEnum, emit
 
-def get_latest_n_quest(
+
+def get_latest_n_quest_data(
+    orm: Orm,
     character: str,
     locale: str = app.LocaleEnum.enUS.value,
     n: int = 3,
-):
+) -> T.List[dict]:
+    """
+    返回 JSON 友好的任务数据. CLI 和 daemon 都使用这个函数.
+    """
     filtered_enriched_quest_data_list = app.quest.get_latest_n_quest_enriched_quest_data(
-        orm=get_orm_from_ec2_inside(),
+        orm=orm,
         character=character,
         locale=app.LocaleEnum[locale],
         n=n,
     )
-    print(
-        json.dumps(
-            [
-                dataclasses.asdict(enriched_quest_data)
-                for enriched_quest_data in filtered_enriched_quest_data_list
-            ],
-            ensure_ascii=False,
-        )
+    return [
+        dataclasses.asdict(enriched_quest_data)
+        for enriched_quest_data in filtered_enriched_quest_data_list
+    ]
+
+
+def get_latest_n_quest(
+    character: str,
+    locale: str = app.LocaleEnum.enUS.value,
+    n: int = 3,
+    fmt: str = FmtEnum.json,
+):
+    emit(
+        get_latest_n_quest_data(
+            orm=get_orm_from_ec2_inside(),
+            character=character,
+            locale=locale,
+            n=n,
+        ),
+        fmt=fmt,
     )
+
+
+def get_latest_n_quest_batch(
+    lines: T.Iterable[str],
+    fmt: str = FmtEnum.json,
+):
+    """
+    处理一批请求, 所有请求共享同一个 ``Orm`` 对象和数据库连接池.
+    详见 :mod:`acore_db_app.cli.batch`.
+    """
+    orm = get_orm_from_ec2_inside()
+
+    def fetch(character: str, locale: str, n: int) -> T.List[dict]:
+        return get_latest_n_quest_data(
+            orm=orm,
+            character=character,
+            locale=locale,
+            n=n,
+        )
+
+    run_batch(lines=lines, fetch=fetch, fmt=fmt)
@@ -2,11 +2,32 @@
 
 """
 Acore DB App CLI interface
+
+注: 每次通过 SSM 调用 CLI 都要付出 import 的成本, 所以本模块的顶部只 import 轻量级的模块,
+SQLAlchemy, ORM 等重量级的依赖都推迟到具体的命令里再 import. 可以用
+``acoredb --profile-startup`` 查看每个模块的 import 耗时.
 """
 
+import typing as T
+import sys
+import contextlib
+
 import fire
 
-from ..app.api import LocaleEnum
+from ..app.locale import LocaleEnum
+from .chunk import FmtEnum
+
+
+@contextlib.contextmanager
+def _open_input(path: str) -> T.Iterator[T.Iterable[str]]:
+    """
+    ``-`` 表示从 stdin 读取, 否则从文件读取.
+    """
+    if path == "-":
+        yield sys.stdin
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield f
 
 
 class Quest:
@@ -19,17 +40,39 @@ class Quest:
         char: str,
         locale: str = LocaleEnum.enUS.value,
         n: int = 3,
+        fmt: str = FmtEnum.json.value,
     ):
         """
         Get the online players and characters in world. Also, you can use this
          command to check whether server is online.
 
+        Use ``--fmt gzip`` to print the result as compressed chunks, see
+        :mod:`acore_db_app.cli.chunk`.
+
         Example::
 
             acoredb quest get_latest_n_quest --help
 
             acoredb quest get_latest_n_quest --char mychar --locale enUS --n 3
+
+            acoredb quest get_latest_n_quest --char mychar --n 100 --fmt gzip
         """
+        # 如果 daemon 正在运行, 则直接把请求转发给 daemon
+        from .chunk import emit
+        from .daemon import connect
+
+        client = connect()
+        if client is not None:
+            with client:
+                data = client.call(
+                    "get_latest_n_quest",
+                    character=char,
+                    locale=locale,
+                    n=n,
+                )
+            emit(data, fmt=fmt)
+            return
+
         # 注: 这段代码不能放在文件开头, 因为这段代码会 import cache. 如果我们放在文件开头,
         # 那么在 bootstrap 的时候是 root user 创建的 cache 数据库, 会导致普通用户没有权限
         # 使用
@@ -39,8 +82,55 @@ class Quest:
             character=char,
             locale=locale,
             n=n,
+            fmt=fmt,
         )
 
+    def batch(
+        self,
+        path: str = "-",
+        fmt: str = FmtEnum.json.value,
+    ):
+        """
+        Read many ``get_latest_n_quest`` requests (one JSON per line) from
+        a file or stdin, and print one JSON result per line as soon as each
+        request is done. See :mod:`acore_db_app.cli.batch` for the format.
+
+        With ``--fmt gzip``, each result is printed as its own group of
+        compressed chunks as soon as it is done. All the results share one
+        SSM output budget, the chunks beyond it are fetched with
+        ``acoredb chunk``.
+
+        Example::
+
+            acoredb quest batch --help
+
+            acoredb quest batch --path requests.ndjson
+
+            echo '{"char": "mychar", "locale": "enUS", "n": 3}' | acoredb quest batch
+        """
+        from .batch import run_batch
+        from .daemon import connect
+
+        with _open_input(path) as lines:
+            client = connect()
+            if client is not None:
+                with client:
+                    run_batch(
+                        lines=lines,
+                        fetch=lambda char, locale, n: client.call(
+                            "get_latest_n_quest",
+                            character=char,
+                            locale=locale,
+                            n=n,
+                        ),
+                        fmt=fmt,
+                    )
+                return
+
+            from .impl import get_latest_n_quest_batch
+
+            get_latest_n_quest_batch(lines=lines, fmt=fmt)
+
 
 class Command:
     """
@@ -58,6 +148,81 @@ class Command:
         """
         print("Hello acore db app user!")
 
+    def serve(self):
+        """
+        Start the acoredb daemon. It keeps the database connection pool and
+        caches warm and listens on a Unix socket. Other ``acoredb`` commands
+        automatically forward requests to it while it is running.
+
+        Example::
+
+            acoredb serve
+        """
+        from .daemon import serve
+
+        serve()
+
+    def warmup(self):
+        """
+        Pre-populate the credential cache, validate the metadata cache,
+        establish the database connection and warm up the world data tables
+        (and the daemon if it is running), then print the timing of each stage.
+        Suitable for a systemd unit or EC2 user data after server boot.
+
+        Example::
+
+            acoredb warmup
+        """
+        from .warmup import warmup
+
+        warmup()
+
+    def chunk(
+        self,
+        key: str,
+        start: int,
+    ):
+        """
+        Print the remaining compressed chunks of a previous ``--fmt gzip``
+        output that did not fit into one SSM command output.
+
+        Example::
+
+            acoredb chunk --key k0123456789abcdef --start 6
+        """
+        from .chunk import emit_remaining
+
+        emit_remaining(key=key, start=start)
+
+    def prefetch(
+        self,
+        version: T.Optional[str] = None,
+        max_workers: int = 4,
+    ):
+        """
+        Download all the data files of a release concurrently into the local
+        cache, e.g. to set up a new workstation or a CI cache. Optional files
+        that older releases do not have (``recipe.arrow``) are skipped.
+
+        Example::
+
+            acoredb prefetch --version 0.2.4
+        """
+        from ..update.common.download import prefetch
+
+        kwargs = dict(max_workers=max_workers)
+        if version is not None:
+            kwargs["version"] = str(version)
+        results = prefetch(**kwargs)
+        if any(isinstance(result, Exception) for result in results.values()):
+            sys.exit(1)
+
 
 def run():
+    # ``--profile-startup`` 是一个全局选项, 需要在交给 fire 处理之前拦截
+    if "--profile-startup" in sys.argv:
+        from .profile import profile_startup
+
+        profile_startup()
+        return
     fire.Fire(Command)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+``acoredb --profile-startup`` 的实现. 在一个子进程中用 ``python -X importtime``
+import CLI 用到的模块, 然后按照累计耗时从高到低打印每个模块的 import 耗时.
+
+在配置很低的 EC2 上, 每次 SSM 调用都要付出 CLI 启动的成本, 这个工具可以帮助我们找出
+那些应该被推迟 import 的模块.
+"""
+
+import typing as T
+import sys
+import subprocess
+import dataclasses
+
+
+@dataclasses.dataclass
+class ImportTime:
+    """
+    ``-X importtime`` 输出中的一行.
+
+    :param module: 模块名.
+    :param self_us: 模块自身的 import 耗时, 单位是微秒.
+    :param cumulative_us: 包含子模块的累计 import 耗时, 单位是微秒.
+    :param depth: 模块在 import 树中的深度, 0 表示被直接 import 的模块.
+    """
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(text: str) -> T.List[ImportTime]:
+    """
+    解析 ``-X importtime`` 输出到 stderr 的文本. 格式如下::
+
+        import time: self [us] | cumulative | imported package
+        import time:       304 |     328835 | acore_db_app.cli.main
+    """
+    import_time_list = list()
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        try:
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:  # the header line
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        import_time_list.append(
+            ImportTime(
+                module=name.strip(),
+                self_us=self_us,
+                cumulative_us=cumulative_us,
+                depth=depth,
+            )
+        )
+    return import_time_list
+
+
+def measure_import_time(module: str) -> T.List[ImportTime]:
+    """
+    在一个新的 Python 子进程中 import 指定的模块, 并返回每个模块的 import 耗时.
+    """
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if res.returncode != 0:
+        raise RuntimeError(f"failed to import {module!r}: {res.stderr}")
+    return parse_importtime(res.stderr)
+
+
+DEFAULT_MODULES = (
+    # 所有 acoredb 命令都要 import 的模块
+    "acore_db_app.cli.main",
+    # 没有 daemon 时, 查询数据库的命令需要 import 的模块
+    "acore_db_app.cli.impl",
+)
+
+
+def profile_startup(
+    modules: T.Iterable[str] = DEFAULT_MODULES,
+    top: int = 15,
+):
+    """
+    打印每个模块的 import 耗时报告.
+
+    :param modules: 需要测量的模块.
+    :param top: 每个模块只打印累计耗时最高的前 N 个子模块.
+    """
+    for module in modules:
+        import_time_list = measure_import_time(module)
+        total = sum(
+            import_time.cumulative_us
+            for import_time in import_time_list
+            if import_time.depth == 0
+        )
+        print(f"--- import {module}: {total / 1000:.1f} ms ---")
+        print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+        import_time_list.sort(key=lambda x: x.cumulative_us, reverse=True)
+        for import_time in import_time_list[:top]:
+            print(
+                f"{import_time.cumulative_us / 1000:>16.1f} "
+                f"{import_time.self_us / 1000:>10.1f}  "
+                f"{'  ' * import_time.depth}{import_time.module}"
+            )
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+``acoredb warmup`` 的实现.
+
+服务器刚启动后的第一个请求需要创建 diskcache 数据库, 通过 ``Server.from_ec2_inside``
+获取数据库的连接信息, 读取或 reflect metadata, 建立数据库连接, 而 MySQL 的 buffer pool
+也还是空的. 这个命令会依次执行这些步骤并打印每一步的耗时, 适合放在 systemd unit 或者
+EC2 user data 中, 使得第一个请求的延迟跟之后的请求一样.
+
+注: 请用跟平时运行 ``acoredb`` 相同的用户运行这个命令, 否则 diskcache 数据库的权限会
+有问题, 原因见 :mod:`acore_db_app.cli.main` 中 import impl 的注释.
+"""
+
+import typing as T
+import time
+import importlib
+import contextlib
+import dataclasses
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import sqlalchemy as sa
+    from ..orm import Orm
+
+# app 模块中用到的表, metadata 缓存中必须要有这些表
+REQUIRED_TABLES = [
+    "acore_characters.characters",
+    "acore_characters.character_queststatus",
+    "acore_world.quest_template",
+    "acore_world.quest_template_locale",
+    "acore_world.creature",
+    "acore_world.creature_queststarter",
+    "acore_world.creature_questender",
+]
+
+
+@dataclasses.dataclass
+class StageTiming:
+    """
+    warmup 中的一个步骤的耗时.
+
+    :param name: 步骤的名字.
+    :param elapsed: 耗时, 单位是秒.
+    :param ok: 是否成功.
+    :param error: 失败时的错误信息.
+    """
+
+    name: str
+    elapsed: float
+    ok: bool = True
+    error: T.Optional[str] = None
+
+
+class StageFailedError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _stage(name: str, timings: T.List[StageTiming]):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        timing = StageTiming(
+            name=name,
+            elapsed=time.perf_counter() - start,
+            ok=False,
+            error=f"{e.__class__.__name__}: {e}",
+        )
+        timings.append(timing)
+        print(f"{name:<20} {timing.elapsed:>8.3f}s  FAILED {timing.error}")
+        raise StageFailedError(name) from e
+    timing = StageTiming(name=name, elapsed=time.perf_counter() - start)
+    timings.append(timing)
+    print(f"{name:<20} {timing.elapsed:>8.3f}s")
+
+
+def _validate_metadata(orm: "Orm"):
+    """
+    如果 metadata 缓存中缺少需要的表 (例如缓存是在数据库升级前生成的), 则重新 reflect.
+    """
+    orm.ensure_tables(REQUIRED_TABLES)
+
+
+def _get_world_data_queries(orm: "Orm") -> T.List["sa.Select"]:
+    """
+    quest app 读取 world 数据库时用到的 column 和 join 条件 (也就是同样的索引), 但不限定
+    角色. 把它们的结果读一遍, 让查询真正会用到的数据页和索引页进入 MySQL 的 buffer pool.
+    ``SELECT COUNT(*)`` 只会扫描最小的索引, 起不到这个作用.
+    """
+    import sqlalchemy as sa
+
+    queries = [
+        sa.select(orm.t_quest_template.c.ID, orm.t_quest_template.c.LogTitle),
+        sa.select(
+            orm.t_quest_template_locale.c.ID,
+            orm.t_quest_template_locale.c.locale,
+            orm.t_quest_template_locale.c.Title,
+        ),
+    ]
+    for t_quest_npc in [orm.t_creature_queststarter, orm.t_creature_questender]:
+        t_creature = orm.t_creature.alias()
+        queries.append(
+            sa.select(
+                t_quest_npc.c.quest,
+                t_quest_npc.c.id,
+                t_creature.c.guid,
+                t_creature.c.position_x,
+                t_creature.c.position_y,
+                t_creature.c.position_z,
+                t_creature.c.map,
+            ).select_from(
+                t_quest_npc.join(t_creature, t_creature.c.id1 == t_quest_npc.c.id)
+            )
+        )
+    return queries
+
+
+def warmup() -> T.List[StageTiming]:
+    """
+    依次执行所有 warmup 步骤, 并打印每一步的耗时. 某一步失败后会停止并抛出异常.
+    """
+    timings: T.List[StageTiming] = list()
+    try:
+        with _stage("import", timings):
+            import sqlalchemy as sa
+            from ..orm_getter import (
+                get_orm_from_ec2_inside,
+                _get_db_info_from_ec2_inside,
+            )
+            importlib.import_module("..app.api", __package__)
+
+        with _stage("disk cache", timings):
+            from ..cache import cache
+
+            len(cache)
+
+        with _stage("db credential", timings):
+            _get_db_info_from_ec2_inside()
+
+        with _stage("metadata", timings):
+            # 数据库连接信息已经在上一步被缓存了
+            orm = get_orm_from_ec2_inside()
+            _validate_metadata(orm)
+
+        with _stage("connection", timings):
+            with orm.engine.connect() as conn:
+                conn.execute(sa.text("SELECT 1"))
+
+        with _stage("world data", timings):
+            # 把 quest app 用到的数据读一遍, 让它们进入 MySQL 的 buffer pool
+            with orm.engine.connect() as conn:
+                for stmt in _get_world_data_queries(orm):
+                    result = conn.execution_options(
+                        stream_results=True,
+                        yield_per=10000,
+                    ).execute(stmt)
+                    for _partition in result.partitions():
+                        pass
+
+        from .daemon import connect
+
+        client = connect()
+        if client is not None:
+            with _stage("daemon", timings):
+                with client:
+                    client.call("warmup")
+    finally:
+        total = sum(timing.elapsed for timing in timings)
+        print(f"{'total':<20} {total:>8.3f}s")
+    return timings
@@ -8,6 +8,7 @@
 所有的数据库 App 都要使用这个模块来构造 SQL query.
 """
 
+import typing as T
 import pickle
 
 import dataclasses
@@ -51,6 +52,23 @@ class Orm:
         else:
             self._metadata = self._reflect()
 
+    def ensure_tables(self, keys: T.Iterable[str]):
+        """
+        确保 metadata 中有这些表. 如果缓存中缺少某些表 (例如缓存是在数据库升级前生成的),
+        则重新 reflect 并更新缓存.
+
+        :param keys: ``${database}.${table}`` 格式的表名.
+
+        :raises KeyError: 重新 reflect 之后数据库中仍然没有这些表.
+        """
+        keys = list(keys)
+        missing = [key for key in keys if key not in self._metadata.tables]
+        if missing:
+            self._metadata = self._reflect()
+            missing = [key for key in keys if key not in self._metadata.tables]
+            if missing:
+                raise KeyError(f"tables not found in database: {missing}")
+
     @cached_property
     def t_account(self) -> sa.Table:
         return self._metadata.tables["acore_auth.account"]
@@ -5,6 +5,8 @@
 对象的实例.
 """
 
+import typing as T
+
 from boto_session_manager import BotoSesManager
 from acore_db_ssh_tunnel.api import create_engine
 from acore_server.api import Server
@@ -26,10 +28,17 @@ def _get_db_info_from_ec2_inside() -> dict:
     }
 
 
-def get_orm_from_ec2_inside() -> Orm:
+def get_orm_from_ec2_inside(
+    engine_kwargs: T.Optional[dict] = None,
+) -> Orm:
     """
     从 EC2 实例内部获取数据库信息, 并创建 ORM 对象的实例.
+
+    :param engine_kwargs: 额外传给 ``sqlalchemy.create_engine`` 的参数, 例如常驻内存的
+        daemon 会需要 ``pool_pre_ping``, ``pool_recycle`` 来保证连接池长期可用.
     """
+    if engine_kwargs is None:
+        engine_kwargs = {}
     db_info = _get_db_info_from_ec2_inside()
     engine = create_engine(
         host=db_info["db_host"],
@@ -37,6 +46,7 @@ def get_orm_from_ec2_inside() -> Orm:
         username=db_info["db_username"],
         password=db_info["db_password"],
         db_name="acore_auth",
+        **engine_kwargs,
     )
     return Orm(engine=engine)
 
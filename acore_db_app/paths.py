@@ -36,6 +36,9 @@ path_sqlalchemy_engine_json = dir_project_root.joinpath("sqlalchemy_engine.json"
 # diskcache.Cache location
 dir_disk_cache = dir_project_root / ".disk-cache"
 
+# acoredb daemon unix socket location
+path_daemon_socket = dir_project_root / "acoredb.sock"
+
 # ------------------------------------------------------------------------------
 # GUI Related
 # ------------------------------------------------------------------------------
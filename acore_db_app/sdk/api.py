@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from . import quest
+from . import transport
+from . import coalesce
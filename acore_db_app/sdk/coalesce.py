@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+SDK 的客户端缓存以及请求合并.
+
+在 GUI 中双击 Search, 或者多个工具同时查询同一个角色时, 会发出多个完全一样的 SSM 请求,
+而每个请求都需要好几秒. :class:`RequestCache` 会:
+
+1. 把结果缓存一段很短的时间 (TTL), 在这段时间内相同的请求直接返回缓存的结果.
+2. 如果相同的请求正在进行中, 后来的请求不会发出新的请求, 而是等待正在进行的请求完成,
+    然后共享它的结果 (或者异常).
+"""
+
+import typing as T
+import time
+import threading
+import concurrent.futures
+
+T_KEY = T.Hashable
+
+
+class RequestCache:
+    """
+    一个带有 TTL 的, 线程安全的请求缓存.
+
+    :param ttl: 结果的缓存秒数. 设为 0 则只合并正在进行中的请求, 不缓存结果.
+    :param max_size: 最多缓存多少个结果, 超过后清除最早的结果.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 10.0,
+        max_size: int = 1000,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._results: T.Dict[T_KEY, T.Tuple[float, T.Any]] = dict()
+        self._in_flight: T.Dict[T_KEY, concurrent.futures.Future] = dict()
+
+    def _get_cached(self, key: T_KEY, now: float) -> T.Tuple[bool, T.Any]:
+        try:
+            expire_at, value = self._results[key]
+        except KeyError:
+            return False, None
+        if expire_at <= now:
+            del self._results[key]
+            return False, None
+        return True, value
+
+    def _set_cached(self, key: T_KEY, value: T.Any, now: float):
+        if self.ttl <= 0:
+            return
+        if len(self._results) >= self.max_size:
+            # dict 是按插入顺序排列的, 删除最早插入的
+            del self._results[next(iter(self._results))]
+        self._results[key] = (now + self.ttl, value)
+
+    def get_or_call(
+        self,
+        key: T_KEY,
+        func: T.Callable[[], T.Any],
+    ) -> T.Any:
+        """
+        返回缓存的结果; 如果有相同的请求正在进行, 则等待它的结果; 否则调用 ``func``.
+        ``func`` 抛出的异常会传给所有等待的调用者, 但不会被缓存.
+        """
+        with self._lock:
+            hit, value = self._get_cached(key, time.monotonic())
+            if hit:
+                return value
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            value = func()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._set_cached(key, value, time.monotonic())
+            del self._in_flight[key]
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
@@ -1,13 +1,44 @@
 # -*- coding: utf-8 -*-
 
 import typing as T
-import json
+import dataclasses
+import concurrent.futures
 
 from boto_session_manager import BotoSesManager
-from acore_paths.api import path_acore_db_app_cli
-import aws_ssm_run_command.api as aws_ssm_run_command
 
 from ..app.api import quest
+from ..cli.chunk import FmtEnum
+from .transport import (
+    AdaptivePoller,
+    BaseTransport,
+    BaseCliTransport,
+    SsmTransport,
+    run_cli_on_instances,
+)
+from .coalesce import RequestCache
+
+# get_latest_n_request 的结果的缓存, 见 :mod:`acore_db_app.sdk.coalesce`
+request_cache = RequestCache(ttl=10)
+
+
+def get_latest_n_quest_via_transport(
+    transport: BaseTransport,
+    character: str,
+    locale: str,
+    n: int,
+) -> T.List[quest.EnrichedQuestData]:
+    """
+    通过指定的 transport 获取角色最新的 n 个任务的详细信息. 可以用
+    :func:`~acore_db_app.sdk.transport.select_transport` 自动选择最快的 transport.
+    """
+    return [
+        quest.EnrichedQuestData(**dct)
+        for dct in transport.get_latest_n_quest(
+            character=character,
+            locale=locale,
+            n=n,
+        )
+    ]
 
 
 def get_latest_n_request(
@@ -16,21 +47,180 @@ def get_latest_n_request(
     character: str,
     locale: str,
     n: int,
+    fmt: str = FmtEnum.json.value,
+    poller: T.Optional[AdaptivePoller] = None,
+    use_cache: bool = True,
 ) -> T.List[quest.EnrichedQuestData]:
-    command_invocations = aws_ssm_run_command.better_boto.run_shell_script_sync(
+    """
+    通过 SSM Run Command 获取角色最新的 n 个任务的详细信息.
+
+    :param fmt: CLI 的输出格式. 当 ``n`` 很大, 结果可能超过 SSM 的输出大小限制时,
+        建议使用 ``gzip``. 它要求服务器上的 ``acoredb`` 版本支持 ``--fmt`` 参数.
+    :param poller: SSM command 的轮询策略, 默认使用 :class:`AdaptivePoller` 的默认值.
+    :param use_cache: 是否使用 :data:`request_cache`. 相同的 (instance_id, character,
+        locale, n) 在 TTL 内会直接返回缓存的结果, 正在进行中的相同请求会被合并成一个
+        SSM 调用.
+    """
+
+    def func() -> T.List[quest.EnrichedQuestData]:
+        transport = SsmTransport(
+            ssm_client=bsm.ssm_client,
+            instance_id=instance_id,
+            poller=AdaptivePoller() if poller is None else poller,
+            fmt=fmt,
+        )
+        return get_latest_n_quest_via_transport(
+            transport=transport,
+            character=character,
+            locale=locale,
+            n=n,
+        )
+
+    if not use_cache:
+        return func()
+    # 角色名在数据库中是大小写不敏感的, 见 app.quest._normalize_character
+    key = (instance_id, character.lower(), locale, n)
+    # 返回一个新的 list, 避免调用者修改缓存中的 list
+    return list(request_cache.get_or_call(key, func))
+
+
+@dataclasses.dataclass
+class FanOutResult:
+    """
+    fan-out 查询中的一个结果.
+
+    :param instance_id: EC2 instance id.
+    :param character: 角色名.
+    :param data: 查询成功时的结果.
+    :param error: 查询失败时的异常.
+    """
+
+    instance_id: str
+    character: str
+    data: T.Optional[T.List[quest.EnrichedQuestData]] = None
+    error: T.Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def iter_latest_n_request_across_instances(
+    bsm: BotoSesManager,
+    instance_ids: T.List[str],
+    character: str,
+    locale: str,
+    n: int,
+    fmt: str = FmtEnum.json.value,
+    poller: T.Optional[AdaptivePoller] = None,
+) -> T.Iterator[FanOutResult]:
+    """
+    用一个 SSM command 在多个服务器 (realm) 上查询同一个角色, 按照完成的顺序 yield 结果.
+    总耗时大约等于最慢的服务器的耗时, 而不是所有服务器的耗时之和.
+    """
+    poller = AdaptivePoller() if poller is None else poller
+    args = BaseCliTransport.get_latest_n_quest_args(character, locale, n, fmt)
+    for instance_id, stdout in run_cli_on_instances(
         ssm_client=bsm.ssm_client,
-        commands=[
-            (
-                f"{path_acore_db_app_cli} "
-                f"quest get-latest-n-quest --char {character} --locale {locale} --n {n}"
-            ),
-        ],
-        instance_ids=instance_id,
-        delays=1,
-        timeout=10,
+        instance_ids=instance_ids,
+        args=args,
+        poller=poller,
+    ):
+        result = FanOutResult(instance_id=instance_id, character=character)
+        if isinstance(stdout, Exception):
+            result.error = stdout
+        else:
+            # 如果有缺失的 chunk, 则单独去这台服务器上取回
+            transport = SsmTransport(
+                ssm_client=bsm.ssm_client,
+                instance_id=instance_id,
+                poller=poller,
+                fmt=fmt,
+            )
+            try:
+                result.data = [
+                    quest.EnrichedQuestData(**dct)
+                    for dct in transport.read_output(stdout)
+                ]
+            except Exception as e:
+                result.error = e
+        yield result
+
+
+def iter_latest_n_request_for_characters(
+    bsm: BotoSesManager,
+    instance_id: str,
+    characters: T.List[str],
+    locale: str,
+    n: int,
+    max_workers: int = 8,
+    **kwargs,
+) -> T.Iterator[FanOutResult]:
+    """
+    在一个有界的线程池中并发地查询多个角色, 按照完成的顺序 yield 结果.
+
+    :param max_workers: 最多同时进行多少个 SSM 调用.
+    :param kwargs: 其他传给 :func:`get_latest_n_request` 的参数.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_character = {
+            executor.submit(
+                get_latest_n_request,
+                bsm=bsm,
+                instance_id=instance_id,
+                character=character,
+                locale=locale,
+                n=n,
+                **kwargs,
+            ): character
+            for character in characters
+        }
+        for future in concurrent.futures.as_completed(future_to_character):
+            result = FanOutResult(
+                instance_id=instance_id,
+                character=future_to_character[future],
+            )
+            try:
+                result.data = future.result()
+            except Exception as e:
+                result.error = e
+            yield result
+
+
+def get_latest_n_request_batch(
+    bsm: BotoSesManager,
+    instance_id: str,
+    characters: T.List[str],
+    locale: str,
+    n: int,
+    fmt: str = FmtEnum.gzip.value,
+    poller: T.Optional[AdaptivePoller] = None,
+) -> T.List[FanOutResult]:
+    """
+    用一个 SSM 调用 (``acoredb quest batch``) 查询同一个服务器上的多个角色, 结果的顺序
+    跟 ``characters`` 一致. 超出 SSM 输出大小限制的结果会用 ``acoredb chunk`` 取回.
+
+    :param fmt: CLI 的输出格式, 默认是 ``gzip``, 因为一批结果很容易超过 SSM 的输出
+        大小限制.
+    """
+    transport = SsmTransport(
+        ssm_client=bsm.ssm_client,
+        instance_id=instance_id,
+        poller=AdaptivePoller() if poller is None else poller,
+        fmt=fmt,
     )
-    enriched_quest_data_list = [
-        quest.EnrichedQuestData(**dct)
-        for dct in json.loads(command_invocations[0].StandardOutputContent)
+    requests = [
+        {"char": character, "locale": locale, "n": n} for character in characters
     ]
-    return enriched_quest_data_list
+    results = list()
+    for character, dct in zip(
+        characters,
+        transport.get_latest_n_quest_batch(requests),
+    ):
+        result = FanOutResult(instance_id=instance_id, character=character)
+        if dct["ok"]:
+            result.data = [quest.EnrichedQuestData(**d) for d in dct["data"]]
+        else:
+            result.error = RuntimeError(dct["error"])
+        results.append(result)
+    return results
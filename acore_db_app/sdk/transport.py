@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+
+"""
+SDK 执行数据库 App 请求的 transport 层.
+
+所有的 transport 都实现了 :class:`BaseTransport` 的接口, SDK 的业务逻辑只依赖这个接口.
+目前有这几种实现:
+
+- :class:`SsmTransport`: 通过 SSM Run Command 调用 EC2 上的 ``acoredb`` CLI. 它不使用
+    ``run_shell_script_sync`` 固定 1 秒一次的轮询, 而是用 :class:`AdaptivePoller`: 开始时
+    轮询间隔很短, 然后指数增加, 遇到终止状态立刻返回, 超过总的 deadline 则报错.
+- :class:`SubprocessTransport`: 在本地的子进程中调用 ``acoredb`` CLI. 适用于在 EC2 上
+    运行 SDK, 或者离线做 benchmark.
+- :class:`DirectDbTransport`: 直接在当前进程中调用 :mod:`acore_db_app.app` 查询数据库.
+    当 SSH tunnel 已经打开时, 它比 SSM 快一个数量级.
+
+:func:`select_transport` 会自动选择当前可用的最快的 transport.
+"""
+
+import typing as T
+import abc
+import sys
+import json
+import time
+import shlex
+import socket
+import functools
+import subprocess
+import dataclasses
+from pathlib import Path
+from urllib.request import Request, urlopen
+
+from acore_paths.api import path_acore_db_app_cli
+import aws_ssm_run_command.api as aws_ssm_run_command
+
+from ..cli.chunk import (
+    FmtEnum,
+    parse_chunks,
+    group_chunks,
+    parse_more,
+    join_chunks,
+)
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
+    from mypy_boto3_ssm.client import SSMClient
+    from ..orm import Orm
+
+better_boto = aws_ssm_run_command.better_boto
+CommandInvocation = better_boto.CommandInvocation
+CommandInvocationStatusEnum = better_boto.CommandInvocationStatusEnum
+RunCommandError = aws_ssm_run_command.exc.RunCommandError
+
+TERMINAL_FAILED_STATUS = {
+    CommandInvocationStatusEnum.Cancelled.value,
+    CommandInvocationStatusEnum.TimedOut.value,
+    CommandInvocationStatusEnum.Failed.value,
+    CommandInvocationStatusEnum.Cancelling.value,
+}
+
+
+@dataclasses.dataclass
+class AdaptivePoller:
+    """
+    指数退避的轮询策略.
+
+    :param initial_delay: 第一次轮询前等待的秒数.
+    :param backoff: 每次轮询后等待时间的倍数.
+    :param max_delay: 两次轮询之间最多等待的秒数.
+    :param timeout: 总的 deadline, 超过这个时间则放弃.
+    """
+
+    initial_delay: float = 0.1
+    backoff: float = 1.5
+    max_delay: float = 1.0
+    timeout: float = 30.0
+
+    def iter_delays(self) -> T.Iterator[float]:
+        """
+        不断 yield 下一次轮询前需要 sleep 的秒数, 直到超过 deadline.
+        """
+        deadline = time.monotonic() + self.timeout
+        delay = self.initial_delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield min(delay, remaining)
+            delay = min(delay * self.backoff, self.max_delay)
+
+
+def _is_invocation_not_ready(e: Exception) -> bool:
+    # send_command 之后马上调用 get_command_invocation 可能会因为 invocation 还没有
+    # 被创建而报错, 这种情况等同于 Pending
+    return e.__class__.__name__ == "InvocationDoesNotExist"
+
+
+def wait_command_invocation(
+    ssm_client: "SSMClient",
+    command_id: str,
+    instance_id: str,
+    poller: AdaptivePoller,
+) -> CommandInvocation:
+    """
+    按照 ``poller`` 的策略轮询 command invocation 的状态, 直到成功.
+
+    :raises RunCommandError: command 失败, 超时或被取消.
+    :raises TimeoutError: 超过 ``poller.timeout`` 仍没有结束.
+    """
+    for delay in poller.iter_delays():
+        time.sleep(delay)
+        try:
+            command_invocation = CommandInvocation.get(
+                ssm_client=ssm_client,
+                command_id=command_id,
+                instance_id=instance_id,
+            )
+        except Exception as e:
+            if _is_invocation_not_ready(e):
+                continue
+            raise
+        if command_invocation.Status == CommandInvocationStatusEnum.Success.value:
+            return command_invocation
+        if command_invocation.Status in TERMINAL_FAILED_STATUS:
+            raise RunCommandError.from_command_invocation(command_invocation)
+    raise TimeoutError(
+        f"command {command_id!r} on {instance_id!r} did not finish "
+        f"in {poller.timeout} seconds"
+    )
+
+
+def iter_command_invocations(
+    ssm_client: "SSMClient",
+    command_id: str,
+    instance_ids: T.List[str],
+    poller: AdaptivePoller,
+) -> T.Iterator[T.Tuple[str, T.Union[CommandInvocation, Exception]]]:
+    """
+    同时轮询一个 command 在多个 EC2 上的 invocation, 每当有一个 invocation 结束,
+    就立刻 yield ``(instance_id, command_invocation)``. 如果失败则 yield
+    ``(instance_id, RunCommandError)``, 超过 deadline 仍未结束的 yield
+    ``(instance_id, TimeoutError)``.
+    """
+    pending = list(instance_ids)
+    for delay in poller.iter_delays():
+        time.sleep(delay)
+        for instance_id in list(pending):
+            try:
+                command_invocation = CommandInvocation.get(
+                    ssm_client=ssm_client,
+                    command_id=command_id,
+                    instance_id=instance_id,
+                )
+            except Exception as e:
+                if _is_invocation_not_ready(e):
+                    continue
+                raise
+            if command_invocation.Status == CommandInvocationStatusEnum.Success.value:
+                pending.remove(instance_id)
+                yield instance_id, command_invocation
+            elif command_invocation.Status in TERMINAL_FAILED_STATUS:
+                pending.remove(instance_id)
+                yield instance_id, RunCommandError.from_command_invocation(
+                    command_invocation
+                )
+        if not pending:
+            return
+    for instance_id in pending:
+        yield instance_id, TimeoutError(
+            f"command {command_id!r} on {instance_id!r} did not finish "
+            f"in {poller.timeout} seconds"
+        )
+
+
+def run_cli_on_instances(
+    ssm_client: "SSMClient",
+    instance_ids: T.List[str],
+    args: str,
+    poller: T.Optional[AdaptivePoller] = None,
+    cli_path: str = str(path_acore_db_app_cli),
+) -> T.Iterator[T.Tuple[str, T.Union[str, Exception]]]:
+    """
+    用一个 SSM command 在多个 EC2 上运行 ``acoredb ${args}``, 按照完成的顺序 yield
+    ``(instance_id, stdout)``, 失败的 yield ``(instance_id, exception)``. 总耗时大约等于
+    最慢的那台服务器的耗时.
+    """
+    command = better_boto.run_shell_script_async(
+        ssm_client=ssm_client,
+        commands=[f"{cli_path} {args}"],
+        instance_ids=list(instance_ids),
+    )
+    for instance_id, result in iter_command_invocations(
+        ssm_client=ssm_client,
+        command_id=command.CommandId,
+        instance_ids=list(instance_ids),
+        poller=AdaptivePoller() if poller is None else poller,
+    ):
+        if isinstance(result, Exception):
+            yield instance_id, result
+        else:
+            yield instance_id, result.StandardOutputContent
+
+
+class BaseTransport(abc.ABC):
+    """
+    所有 transport 的基类.
+    """
+
+    @abc.abstractmethod
+    def get_latest_n_quest(
+        self,
+        character: str,
+        locale: str,
+        n: int,
+    ) -> T.List[dict]:
+        """
+        返回 JSON 友好的任务数据, 格式跟 ``acoredb quest get-latest-n-quest`` 的输出一致.
+        """
+        raise NotImplementedError
+
+
+class BaseCliTransport(BaseTransport):
+    """
+    通过 ``acoredb`` CLI 执行请求的 transport 的基类. 子类只需要实现 :meth:`run_cli`.
+
+    子类需要有一个 ``fmt`` 属性, 表示 CLI 的输出格式, 详见 :mod:`acore_db_app.cli.chunk`.
+    """
+
+    fmt: str = FmtEnum.json.value
+
+    @abc.abstractmethod
+    def run_cli(self, args: str, input: T.Optional[str] = None) -> str:
+        """
+        运行 ``acoredb ${args}`` 并返回 stdout.
+
+        :param input: 如果指定了, 则作为 CLI 的 stdin, 例如 ``acoredb quest batch``
+            的请求.
+        """
+        raise NotImplementedError
+
+    def fetch_remaining(self, stdout: str) -> str:
+        """
+        如果 ``gzip`` 格式的输出以 ``acdb-more`` 结尾 (超出了 SSM 输出大小的限制),
+        则不断调用 ``acoredb chunk`` 取回剩下的 chunk, 返回所有的输出.
+        """
+        texts = [stdout]
+        more = parse_more(stdout)
+        while more is not None:
+            key, start = more
+            texts.append(self.run_cli(f"chunk --key {key} --start {start}"))
+            more = parse_more(texts[-1])
+            if more is not None and more[1] <= start:
+                raise ValueError(f"failed to fetch chunk {start} of {key!r}")
+        return "\n".join(texts)
+
+    def read_output(self, stdout: str) -> T.Any:
+        """
+        解析 CLI 的输出. 如果是 ``gzip`` 格式, 则先用 :meth:`fetch_remaining` 取回
+        剩下的 chunk.
+        """
+        if self.fmt == FmtEnum.json:
+            return json.loads(stdout)
+        chunks = parse_chunks(self.fetch_remaining(stdout))
+        if not chunks:
+            raise ValueError(f"no chunk found in the output: {stdout!r}")
+        return join_chunks(chunks)
+
+    def read_batch_output(self, stdout: str) -> T.List[dict]:
+        """
+        解析 ``acoredb quest batch`` 的输出, 返回每个请求的结果, 顺序跟请求一致.
+        """
+        if self.fmt == FmtEnum.json:
+            return [json.loads(line) for line in stdout.splitlines() if line.strip()]
+        return [
+            join_chunks(chunks)
+            for chunks in group_chunks(self.fetch_remaining(stdout))
+        ]
+
+    @staticmethod
+    def get_latest_n_quest_args(
+        character: str,
+        locale: str,
+        n: int,
+        fmt: str = FmtEnum.json.value,
+    ) -> str:
+        args = f"quest get-latest-n-quest --char {character} --locale {locale} --n {n}"
+        # 默认格式不加 --fmt 参数, 以兼容旧版本的 acoredb
+        if fmt != FmtEnum.json:
+            args = f"{args} --fmt {fmt}"
+        return args
+
+    def get_latest_n_quest(
+        self,
+        character: str,
+        locale: str,
+        n: int,
+    ) -> T.List[dict]:
+        args = self.get_latest_n_quest_args(character, locale, n, self.fmt)
+        return self.read_output(self.run_cli(args))
+
+    def get_latest_n_quest_batch(self, requests: T.List[dict]) -> T.List[dict]:
+        """
+        用一次 ``acoredb quest batch`` 调用处理多个请求, 请求和结果的格式见
+        :mod:`acore_db_app.cli.batch`.
+        """
+        args = "quest batch"
+        if self.fmt != FmtEnum.json:
+            args = f"{args} --fmt {self.fmt}"
+        input = "".join(json.dumps(request) + "\n" for request in requests)
+        return self.read_batch_output(self.run_cli(args, input=input))
+
+
+@dataclasses.dataclass
+class SsmTransport(BaseCliTransport):
+    """
+    通过 SSM Run Command 在 EC2 上运行 CLI.
+
+    :param ssm_client: ``boto3.client("ssm")``, 也可以是实现了 ``send_command`` 和
+        ``get_command_invocation`` 的 fake 对象.
+    :param instance_id: EC2 instance id.
+    :param poller: 轮询策略.
+    :param cli_path: EC2 上 ``acoredb`` 的路径.
+    :param fmt: CLI 的输出格式. 当结果可能超过 SSM 的输出大小限制时, 建议使用 ``gzip``.
+        它要求服务器上的 ``acoredb`` 版本支持 ``--fmt`` 参数.
+    """
+
+    ssm_client: "SSMClient" = dataclasses.field()
+    instance_id: str = dataclasses.field()
+    poller: AdaptivePoller = dataclasses.field(default_factory=AdaptivePoller)
+    cli_path: str = dataclasses.field(default=str(path_acore_db_app_cli))
+    fmt: str = dataclasses.field(default=FmtEnum.json.value)
+
+    def run_cli(self, args: str, input: T.Optional[str] = None) -> str:
+        script = f"{self.cli_path} {args}"
+        if input is not None:
+            # printf 不会像某些 shell 的 echo 一样解释反斜杠
+            script = f"printf '%s' {shlex.quote(input)} | {script}"
+        command = better_boto.run_shell_script_async(
+            ssm_client=self.ssm_client,
+            commands=[script],
+            instance_ids=[self.instance_id],
+        )
+        command_invocation = wait_command_invocation(
+            ssm_client=self.ssm_client,
+            command_id=command.CommandId,
+            instance_id=self.instance_id,
+            poller=self.poller,
+        )
+        return command_invocation.StandardOutputContent
+
+
+# 在当前 Python 环境中运行 acoredb CLI 的命令, 不依赖 console script 是否被安装
+DEFAULT_LOCAL_CLI = [
+    sys.executable,
+    "-c",
+    "from acore_db_app.cli.main import run; run()",
+]
+
+
+@dataclasses.dataclass
+class SubprocessTransport(BaseCliTransport):
+    """
+    在本地的子进程中运行 CLI.
+
+    :param cli: 运行 ``acoredb`` 的命令, 默认使用当前的 Python 解释器.
+    :param timeout: 子进程的超时秒数.
+    :param fmt: CLI 的输出格式.
+    """
+
+    cli: T.List[str] = dataclasses.field(default_factory=lambda: list(DEFAULT_LOCAL_CLI))
+    timeout: float = dataclasses.field(default=30.0)
+    fmt: str = dataclasses.field(default=FmtEnum.json.value)
+
+    def run_cli(self, args: str, input: T.Optional[str] = None) -> str:
+        res = subprocess.run(
+            [*self.cli, *shlex.split(args)],
+            input=input,
+            capture_output=True,
+            text=True,
+            timeout=self.timeout,
+        )
+        if res.returncode != 0:
+            raise RuntimeError(
+                f"acoredb {args!r} failed with return code {res.returncode}, "
+                f"error: {res.stderr!r}"
+            )
+        return res.stdout
+
+
+@dataclasses.dataclass
+class DirectDbTransport(BaseTransport):
+    """
+    直接在当前进程中查询数据库, 例如通过 :func:`~acore_db_app.orm_getter.get_orm_for_ssh_tunnel`
+    创建的 ``Orm``.
+
+    :param orm: ``Orm`` 对象.
+    """
+
+    orm: "Orm" = dataclasses.field()
+
+    def get_latest_n_quest(
+        self,
+        character: str,
+        locale: str,
+        n: int,
+    ) -> T.List[dict]:
+        from ..cli.impl import get_latest_n_quest_data
+
+        return get_latest_n_quest_data(
+            orm=self.orm,
+            character=character,
+            locale=locale,
+            n=n,
+        )
+
+
+def is_port_open(host: str, port: int, timeout: float = 0.2) -> bool:
+    """
+    检查 TCP 端口是否在监听, 用于判断 SSH tunnel 是否已经打开.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+EC2_METADATA_URL = "http://169.254.169.254/latest"
+
+
+@functools.lru_cache(maxsize=1)
+def get_local_instance_id(timeout: float = 0.2) -> T.Optional[str]:
+    """
+    通过 EC2 instance metadata service (IMDSv2) 获取本机的 EC2 instance id,
+    如果不在 EC2 上运行则返回 None. 结果会被缓存.
+    """
+    try:
+        request = Request(
+            f"{EC2_METADATA_URL}/api/token",
+            method="PUT",
+            headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
+        )
+        with urlopen(request, timeout=timeout) as response:
+            token = response.read().decode("utf-8")
+        request = Request(
+            f"{EC2_METADATA_URL}/meta-data/instance-id",
+            headers={"X-aws-ec2-metadata-token": token},
+        )
+        with urlopen(request, timeout=timeout) as response:
+            return response.read().decode("utf-8").strip()
+    except OSError:
+        return None
+
+
+def select_transport(
+    bsm: "BotoSesManager",
+    instance_id: str,
+    server_id: T.Optional[str] = None,
+    local_cli_path: T.Optional[Path] = Path(path_acore_db_app_cli),
+    poller: T.Optional[AdaptivePoller] = None,
+    fmt: str = FmtEnum.json.value,
+) -> BaseTransport:
+    """
+    按照速度从快到慢, 选择第一个可用的 transport:
+
+    1. 指定了 ``server_id`` 且本地 3306 端口上有 SSH tunnel: :class:`DirectDbTransport`.
+    2. 本机上有 ``acoredb`` CLI, 并且本机就是 ``instance_id`` (也就是 SDK 运行在目标 EC2
+        上): :class:`SubprocessTransport`. 如果本机是另一台服务器, 本地的 CLI 查询的是
+        另一个数据库, 所以不能使用.
+    3. 其他情况: :class:`SsmTransport`.
+
+    :param bsm: BotoSesManager 对象.
+    :param instance_id: EC2 instance id, 用于 SSM.
+    :param server_id: 服务器 ID, 用于获取 SSH tunnel 的数据库连接信息.
+        Example: ``${env_name}-${server_name}``.
+    :param local_cli_path: 本机上 ``acoredb`` 的路径, 设为 None 则不使用本地的 CLI.
+    :param poller: 见 :class:`SsmTransport`.
+    :param fmt: 见 :class:`SsmTransport`.
+    """
+    if server_id is not None and is_port_open("127.0.0.1", 3306):
+        from ..orm_getter import get_orm_for_ssh_tunnel
+
+        return DirectDbTransport(orm=get_orm_for_ssh_tunnel(bsm=bsm, server_id=server_id))
+    if (
+        local_cli_path is not None
+        and Path(local_cli_path).exists()
+        and get_local_instance_id() == instance_id
+    ):
+        return SubprocessTransport(cli=[str(local_cli_path)], fmt=fmt)
+    return SsmTransport(
+        ssm_client=bsm.ssm_client,
+        instance_id=instance_id,
+        poller=AdaptivePoller() if poller is None else poller,
+        fmt=fmt,
+    )
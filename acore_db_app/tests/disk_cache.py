@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+"""
+用临时目录中的 diskcache 代替项目目录中的 ``.disk-cache``, 避免测试修改它.
+"""
+
+from pathlib import Path
+
+import diskcache
+
+
+def use_tmp_cache(monkeypatch, dir_cache: Path) -> diskcache.Cache:
+    """
+    把 :data:`acore_db_app.cache.cache` 替换为 ``dir_cache`` 中的 diskcache. 在函数中
+    ``from ..cache import cache`` 的代码 (例如 :mod:`acore_db_app.cli.chunk`) 会拿到
+    替换后的对象.
+
+    :param monkeypatch: pytest 的 ``monkeypatch`` fixture, 测试结束后会还原.
+    """
+    from .. import cache as cache_module
+
+    cache = diskcache.Cache(str(dir_cache))
+    monkeypatch.setattr(cache_module, "cache", cache)
+    return cache
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+一个在本地运行的 fake SSM client, 用来在没有 AWS 的情况下测试 SDK.
+
+它实现了 ``send_command`` 和 ``get_command_invocation`` 两个 API. ``send_command`` 会在
+后台线程中把命令交给 ``handler`` 执行, 执行完成前 ``get_command_invocation`` 返回
+``InProgress``. 默认的 handler 会在本地 shell 中运行命令.
+"""
+
+import typing as T
+import time
+import uuid
+import threading
+import subprocess
+import dataclasses
+
+T_HANDLER = T.Callable[[str, str], T.Tuple[int, str, str]]
+
+
+def run_in_local_shell(instance_id: str, command: str) -> T.Tuple[int, str, str]:
+    res = subprocess.run(command, shell=True, capture_output=True, text=True)
+    return res.returncode, res.stdout, res.stderr
+
+
+class InvocationDoesNotExist(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class FakeSsmClient:
+    """
+    :param handler: 执行命令的函数, 参数是 ``(instance_id, command)``, 返回
+        ``(exit_code, stdout, stderr)``.
+    :param latency: 模拟 SSM agent 收到命令前的延迟秒数.
+    """
+
+    handler: T_HANDLER = dataclasses.field(default=run_in_local_shell)
+    latency: float = dataclasses.field(default=0.0)
+    invocations: T.Dict[T.Tuple[str, str], dict] = dataclasses.field(
+        default_factory=dict
+    )
+    send_command_count: int = dataclasses.field(default=0)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def _run(self, command_id: str, instance_id: str, commands: T.List[str]):
+        time.sleep(self.latency)
+        key = (command_id, instance_id)
+        with self._lock:
+            self.invocations[key]["Status"] = "InProgress"
+        exit_code, stdout, stderr = self.handler(instance_id, "\n".join(commands))
+        with self._lock:
+            self.invocations[key].update(
+                Status="Success" if exit_code == 0 else "Failed",
+                ResponseCode=exit_code,
+                StandardOutputContent=stdout,
+                StandardErrorContent=stderr,
+            )
+
+    def send_command(self, **kwargs) -> dict:
+        command_id = str(uuid.uuid4())
+        instance_ids = kwargs["InstanceIds"]
+        commands = kwargs["Parameters"]["commands"]
+        with self._lock:
+            self.send_command_count += 1
+            for instance_id in instance_ids:
+                self.invocations[(command_id, instance_id)] = {
+                    "CommandId": command_id,
+                    "InstanceId": instance_id,
+                    "Status": "Pending",
+                }
+        for instance_id in instance_ids:
+            threading.Thread(
+                target=self._run,
+                args=(command_id, instance_id, commands),
+                daemon=True,
+            ).start()
+        return {"Command": {"CommandId": command_id, "InstanceIds": instance_ids}}
+
+    def get_command_invocation(self, CommandId: str, InstanceId: str) -> dict:
+        with self._lock:
+            try:
+                return dict(self.invocations[(CommandId, InstanceId)])
+            except KeyError:
+                raise InvocationDoesNotExist(f"{CommandId} {InstanceId}")
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+"""
+用内存中的 sqlite 数据库代替 MySQL, 用来在没有数据库的情况下测试.
+"""
+
+import typing as T
+
+import sqlalchemy as sa
+
+# azerothcore 的三个数据库 (在 sqlite 中是 schema)
+SCHEMAS = ("acore_auth", "acore_characters", "acore_world")
+
+
+def make_sqlite_engine(
+    metadata: T.Optional[sa.MetaData] = None,
+    rows: T.Optional[T.Dict[sa.Table, T.List[dict]]] = None,
+    schemas: T.Iterable[str] = (),
+) -> sa.Engine:
+    """
+    创建一个内存中的 sqlite 数据库. 所有连接共享同一个底层连接, 否则每个连接都会
+    看到一个新的空数据库.
+
+    :param metadata: 如果指定了, 则创建其中所有的表.
+    :param rows: 需要插入的数据, {table: list of dict}.
+    :param schemas: 用 ``ATTACH DATABASE`` 创建的 schema, 例如 :data:`SCHEMAS`,
+        这样 ``acore_world.quest_template`` 之类的表名也可以在 sqlite 中使用.
+    """
+    engine = sa.create_engine("sqlite://", poolclass=sa.pool.StaticPool)
+    with engine.begin() as conn:
+        for schema in schemas:
+            conn.exec_driver_sql(f"ATTACH DATABASE ':memory:' AS {schema}")
+        if metadata is not None:
+            metadata.create_all(conn)
+        for table, records in (rows or {}).items():
+            conn.execute(table.insert(), records)
+    return engine
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from .download import download_file
+from .download import download_and_decompress_file
 from .download import FileEnum
+from .download import prefetch
+from .blob_store import BlobStore
 from . import craft_spell_recipe_api as craft_spell_recipe
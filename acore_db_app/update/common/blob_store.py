@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""
+下载的数据文件的本地缓存, 按照内容 (SHA-256) 存储.
+
+目录结构::
+
+    ${dir_root}/
+        blobs/
+            ab/
+                ab12...  # 文件内容, 文件名是它的 SHA-256
+        ${version}/
+            .manifest.json  # {file_name: sha256}
+            Spell.csv.gz  # 指向 blob 的 hard link
+            ...
+
+不同版本中内容相同的文件只会保存一份, 也只会下载一次. :meth:`BlobStore.evict` 按照
+最后使用时间删除旧版本的目录, 然后删除不再被任何版本的 manifest 引用的 blob, 从而限制
+磁盘占用. 文件系统不支持 hard link 时文件会被复制, 所以不能用 link 的数量判断 blob 是否
+还被引用.
+"""
+
+import typing as T
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import contextlib
+import dataclasses
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_NAME = ".manifest.json"
+LOCK_NAME = ".lock"
+
+# 同一个进程中的多个线程 (例如 prefetch 的线程池) 会同时更新同一个 manifest
+_manifest_lock = threading.Lock()
+# 添加 blob 和删除 blob 不能同时进行
+_store_lock = threading.Lock()
+
+
+def sha256_file(path: Path, chunk_size: int = CHUNK_SIZE) -> str:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _link(src: Path, dst: Path):
+    """
+    创建 hard link, 如果文件系统不支持则复制文件.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path):
+    """
+    用一个 lock 文件在多个进程之间互斥.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a+b") as f:
+        if os.name == "nt":  # pragma: no cover
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@dataclasses.dataclass
+class BlobStore:
+    """
+    :param dir_root: 缓存的根目录, 每个版本的文件在 ``${dir_root}/${version}/`` 下.
+    """
+
+    dir_root: Path = dataclasses.field()
+
+    @property
+    def dir_blobs(self) -> Path:
+        return self.dir_root.joinpath("blobs")
+
+    def get_blob_path(self, sha256: str) -> Path:
+        sha256 = sha256.lower()
+        return self.dir_blobs.joinpath(sha256[:2], sha256)
+
+    def get_version_dir(self, version: str) -> Path:
+        return self.dir_root.joinpath(version)
+
+    def get_manifest_path(self, version: str) -> Path:
+        return self.get_version_dir(version).joinpath(MANIFEST_NAME)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        整个 blob store 的锁, 在多个线程和进程之间互斥. 添加和删除 blob 时需要持有它,
+        否则 :meth:`evict` 可能会删除一个正在被 link 的 blob.
+        """
+        with _store_lock, _file_lock(self.dir_root.joinpath(LOCK_NAME)):
+            yield
+
+    def read_manifest(self, version: str) -> T.Dict[str, str]:
+        """
+        读取某个版本的 manifest, {file_name: sha256}.
+        """
+        try:
+            return json.loads(self.get_manifest_path(version).read_text())
+        except FileNotFoundError:
+            return {}
+
+    def record(self, version: str, file_name: str, sha256: str):
+        """
+        在某个版本的 manifest 中记录一个文件. 读取, 修改, 写入的过程在线程锁和文件锁
+        中进行, 并且先写入临时文件再重命名, 所以并发的调用不会丢失记录, 也不会读到
+        写了一半的 manifest.
+        """
+        path_manifest = self.get_manifest_path(version)
+        path_lock = path_manifest.with_name(path_manifest.name + ".lock")
+        with _manifest_lock, _file_lock(path_lock):
+            manifest = self.read_manifest(version)
+            manifest[file_name] = sha256
+            path_tmp = path_manifest.with_name(
+                f"{path_manifest.name}.{os.getpid()}.tmp"
+            )
+            path_tmp.write_text(json.dumps(manifest, indent=4, sort_keys=True))
+            os.replace(path_tmp, path_manifest)
+
+    def touch(self, version: str):
+        """
+        更新某个版本的最后使用时间, 用于 :meth:`evict`.
+        """
+        path_manifest = self.get_manifest_path(version)
+        if path_manifest.exists():
+            os.utime(path_manifest)
+
+    def add(self, path: Path, sha256: T.Optional[str] = None) -> str:
+        """
+        把 ``path`` 的内容放入 blob store, 然后把 ``path`` 替换为指向 blob 的 hard link.
+        如果相同内容的 blob 已经存在, 则直接复用.
+
+        :return: 文件的 SHA-256.
+        """
+        if sha256 is None:
+            sha256 = sha256_file(path)
+        path_blob = self.get_blob_path(sha256)
+        with self.lock():
+            if path_blob.exists():
+                path.unlink()
+            else:
+                path_blob.parent.mkdir(parents=True, exist_ok=True)
+                path.replace(path_blob)
+            _link(path_blob, path)
+        return sha256
+
+    def link(self, sha256: str, path: Path) -> bool:
+        """
+        如果 blob 存在, 则把它 link 到 ``path`` 并返回 True, 否则返回 False.
+        """
+        path_blob = self.get_blob_path(sha256)
+        with self.lock():
+            if not path_blob.exists():
+                return False
+            _link(path_blob, path)
+        return True
+
+    def _iter_version_dirs(self) -> T.List[Path]:
+        if not self.dir_root.exists():
+            return []
+        return [
+            p
+            for p in self.dir_root.iterdir()
+            if p.is_dir() and p.name != self.dir_blobs.name
+        ]
+
+    def _last_used(self, dir_version: Path) -> float:
+        path_manifest = dir_version.joinpath(MANIFEST_NAME)
+        if path_manifest.exists():
+            return path_manifest.stat().st_mtime
+        return dir_version.stat().st_mtime
+
+    def get_total_size(self) -> int:
+        """
+        缓存占用的总字节数, hard link 只计算一次.
+        """
+        seen = set()
+        total = 0
+        for dirpath, _, filenames in os.walk(self.dir_root):
+            for filename in filenames:
+                stat = os.stat(os.path.join(dirpath, filename))
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_size
+        return total
+
+    def get_referenced_blobs(self) -> T.Set[str]:
+        """
+        所有版本的 manifest 中引用的 blob 的 SHA-256.
+        """
+        return {
+            sha256.lower()
+            for dir_version in self._iter_version_dirs()
+            for sha256 in self.read_manifest(dir_version.name).values()
+        }
+
+    def _remove_orphan_blobs(self) -> T.List[Path]:
+        removed = list()
+        if not self.dir_blobs.exists():
+            return removed
+        referenced = self.get_referenced_blobs()
+        for path_blob in self.dir_blobs.glob("*/*"):
+            if path_blob.name not in referenced:
+                path_blob.unlink()
+                removed.append(path_blob)
+        return removed
+
+    def remove_orphan_blobs(self) -> T.List[Path]:
+        """
+        删除不再被任何版本的 manifest 引用的 blob.
+        """
+        with self.lock():
+            return self._remove_orphan_blobs()
+
+    def evict(
+        self,
+        max_bytes: T.Optional[int] = None,
+        max_age: T.Optional[float] = None,
+        keep: T.Iterable[str] = (),
+    ) -> T.List[Path]:
+        """
+        删除旧版本的目录以及不再被引用的 blob.
+
+        :param max_bytes: 删除最久没有使用的版本, 直到总大小不超过这个值.
+        :param max_age: 删除超过这么多秒没有使用的版本.
+        :param keep: 不会被删除的版本, 例如当前版本.
+        :return: 被删除的版本目录.
+        """
+        keep = set(keep)
+        with self.lock():
+            dir_versions = sorted(
+                [p for p in self._iter_version_dirs() if p.name not in keep],
+                key=self._last_used,
+            )
+            removed = list()
+            now = time.time()
+            for dir_version in dir_versions:
+                too_old = (
+                    max_age is not None
+                    and now - self._last_used(dir_version) > max_age
+                )
+                too_big = (
+                    max_bytes is not None and self.get_total_size() > max_bytes
+                )
+                if not (too_old or too_big):
+                    continue
+                shutil.rmtree(dir_version)
+                self._remove_orphan_blobs()
+                removed.append(dir_version)
+            self._remove_orphan_blobs()
+        return removed
@@ -12,14 +12,37 @@ Ref:
 import typing as T
 import gzip
 import json
+import shutil
+import threading
 import dataclasses
 from pathlib import Path
-from collections import Counter
+from urllib.error import HTTPError
 
 import polars as pl
 
 from ..._version import __version__
-from ..common.api import download_file
+from .download import download_file, download_and_decompress_file, FileEnum
+from .dbc import DbcFile
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from polars.type_aliases import PolarsDataType
+
+
+# Spell.dbc 中每个技能最多有 8 个施法材料, 分别是材料 ID 和数量的 column
+REAGENT_ID_COLS = [str(i) for i in range(53, 61)]
+REAGENT_COUNT_COLS = [str(i) for i in range(61, 69)]
+# 我们只关注需要 1 - 6 种材料的配方
+MAX_REAGENT = 6
+
+
+def write_ipc_atomic(df: pl.DataFrame, path_arrow: Path):
+    """
+    把 DataFrame 写入一个不压缩的 Arrow IPC 文件. 先写入临时文件再重命名, 这样正在被
+    memory map 的旧文件不会被修改.
+    """
+    path_part = path_arrow.with_name(path_arrow.name + ".part")
+    df.write_ipc(str(path_part), compression="uncompressed")
+    path_part.replace(path_arrow)
 
 
 @dataclasses.dataclass
@@ -91,150 +114,431 @@ class Recipe:
         ]
 
     @classmethod
-    def to_dataframe(
+    def dump_ipc(
         cls,
         recipes: T.List["Recipe"],
+        path_arrow: Path,
+    ):
+        """
+        Dump recipes to an uncompressed Arrow IPC (``.arrow``) file, in the
+        :meth:`to_dataframe` format. 不压缩是为了能用 memory map 直接读取.
+        """
+        write_ipc_atomic(cls.to_dataframe(recipes), path_arrow)
+
+    @classmethod
+    def load_dataframe(
+        cls,
+        path_arrow: Path,
     ) -> pl.DataFrame:
         """
-        将 Recipe 对象转换为 Polars 的 DataFrame 对象, 以便于和数据库中的表做 JOIN.
+        Memory map an Arrow IPC file created by :meth:`dump_ipc` as a
+        :meth:`to_dataframe` format DataFrame, 不需要解析 JSON 也不需要创建 Python 对象.
+        """
+        return pl.read_ipc(str(path_arrow), memory_map=True)
+
+    @classmethod
+    def from_reagent_dataframe(
+        cls,
+        df: pl.DataFrame,
+    ) -> T.List["Recipe"]:
+        """
+        从 :func:`extract_recipe_reagent` 格式的长表 (每行一个材料) 创建 Recipe 对象.
+        """
+        df = df.group_by("id", maintain_order=True).agg(
+            pl.col("count").first(),
+            pl.col("reagent_id"),
+            pl.col("reagent_count"),
+        )
+        return [
+            cls(
+                id=id,
+                count=count,
+                reagents=[
+                    Reagent(id=reagent_id, count=reagent_count)
+                    for reagent_id, reagent_count in zip(reagent_ids, reagent_counts)
+                ],
+            )
+            for id, count, reagent_ids, reagent_counts in df.iter_rows()
+        ]
+
+    @classmethod
+    def to_reagent_dataframe(
+        cls,
+        recipes: T.List["Recipe"],
+    ) -> pl.DataFrame:
+        """
+        将 Recipe 对象转换为 :func:`extract_recipe_reagent` 格式的长表 (每行一个材料).
+        一次遍历把数据填入每个 column 的数组中, 而不是逐行创建 DataFrame.
         """
-        n = 14  # 2 for id and count, 2 * 6 = 12 for reagents
-        rows = list()
+        ids, counts, reagent_ids, reagent_counts = [], [], [], []
         for recipe in recipes:
-            row = [recipe.id, recipe.count]
             for reagent in recipe.reagents:
-                row.append(reagent.id)
-                row.append(reagent.count)
-            row.extend([None] * (n - len(row)))
-            rows.append(row)
-        schema = {
-            "id": int,
-            "count": int,
-            "reagent_id_1": int,
-            "reagent_count_1": int,
-            "reagent_id_2": int,
-            "reagent_count_2": int,
-            "reagent_id_3": int,
-            "reagent_count_3": int,
-            "reagent_id_4": int,
-            "reagent_count_4": int,
-            "reagent_id_5": int,
-            "reagent_count_5": int,
-            "reagent_id_6": int,
-            "reagent_count_6": int,
-        }
-        df = pl.DataFrame(rows, schema=schema)
-        return df
+                ids.append(recipe.id)
+                counts.append(recipe.count)
+                reagent_ids.append(reagent.id)
+                reagent_counts.append(reagent.count)
+        return pl.DataFrame(
+            {
+                "id": ids,
+                "count": counts,
+                "reagent_id": reagent_ids,
+                "reagent_count": reagent_counts,
+            },
+            schema=RECIPE_REAGENT_SCHEMA,
+        )
+
+    @classmethod
+    def to_dataframe(
+        cls,
+        recipes: T.List["Recipe"],
+        n_reagent: T.Optional[int] = None,
+    ) -> pl.DataFrame:
+        """
+        将 Recipe 对象转换为 Polars 的 DataFrame 对象, 以便于和数据库中的表做 JOIN.
+        格式见 :func:`to_wide_dataframe`.
+        """
+        return to_wide_dataframe(cls.to_reagent_dataframe(recipes), n_reagent=n_reagent)
 
 
-def extract_recipe(
-    path_spell_csv_gz: T.Optional[Path] = None,
-) -> T.List[Recipe]:
+RECIPE_REAGENT_SCHEMA: T.Dict[str, "PolarsDataType"] = {
+    "id": pl.Int64,
+    "count": pl.Int64,
+    "reagent_id": pl.Int64,
+    "reagent_count": pl.Int64,
+}
+
+
+def to_wide_dataframe(
+    df_reagent: pl.DataFrame,
+    n_reagent: T.Optional[int] = None,
+) -> pl.DataFrame:
     """
+    把 :func:`extract_recipe_reagent` 格式的长表转换成每个配方一行的宽表, 列为
+    ``id``, ``count``, 以及 ``reagent_id_1``, ``reagent_count_1``, ... ``reagent_id_N``,
+    ``reagent_count_N``. 材料不足 N 个的配方用 null 补齐.
+
+    :param n_reagent: 材料 column 的对数 N, 默认为 :data:`MAX_REAGENT` 和配方中最多的
+        材料数量之间的较大值. 如果指定的值小于配方中最多的材料数量, 则抛出 ``ValueError``,
+        而不是悄悄地丢掉材料.
+    """
+    df = df_reagent.group_by("id", maintain_order=True).agg(
+        pl.col("count").first(),
+        pl.col("reagent_id"),
+        pl.col("reagent_count"),
+    )
+    max_reagent = df.select(pl.col("reagent_id").list.len().max()).item() or 0
+    if n_reagent is None:
+        n_reagent = max(MAX_REAGENT, max_reagent)
+    elif n_reagent < max_reagent:
+        raise ValueError(
+            f"n_reagent = {n_reagent} is less than "
+            f"the max number of reagents {max_reagent}"
+        )
+    columns = [pl.col("id"), pl.col("count")]
+    for ith in range(n_reagent):
+        columns.append(
+            pl.col("reagent_id")
+            .list.get(ith, null_on_oob=True)
+            .alias(f"reagent_id_{ith + 1}")
+        )
+        columns.append(
+            pl.col("reagent_count")
+            .list.get(ith, null_on_oob=True)
+            .alias(f"reagent_count_{ith + 1}")
+        )
+    return df.select(columns)
+
+
+def to_long_dataframe(df_wide: pl.DataFrame) -> pl.DataFrame:
+    """
+    :func:`to_wide_dataframe` 的逆操作, 把宽表转换回 :func:`extract_recipe_reagent`
+    格式的长表.
+    """
+    n_reagent = sum(col.startswith("reagent_id_") for col in df_wide.columns)
+    df_recipe = df_wide.with_row_index("recipe")
+    return (
+        pl.concat(
+            [
+                df_recipe.select(
+                    "recipe",
+                    "id",
+                    "count",
+                    pl.lit(ith).alias("slot"),
+                    pl.col(f"reagent_id_{ith}").alias("reagent_id"),
+                    pl.col(f"reagent_count_{ith}").alias("reagent_count"),
+                )
+                for ith in range(1, 1 + n_reagent)
+            ]
+        )
+        .filter(pl.col("reagent_id").is_not_null())
+        .sort("recipe", "slot")
+        .select(
+            [pl.col(col).cast(dtype) for col, dtype in RECIPE_REAGENT_SCHEMA.items()]
+        )
+    )
+
+
+# 提取配方时用到的 column 以及它们的数据类型. 其他两百多个 column 完全不需要解析.
+SPELL_SCHEMA: T.Dict[str, "PolarsDataType"] = {
+    # 效果的类型
+    "72": pl.Int64,
+    # EffectDieSides, EffectBasePoints
+    "75": pl.Int64,
+    "81": pl.Int64,
+    # 造出的物品 ID
+    "108": pl.Int64,
+    # 其他造出的物品
+    "109": pl.Int64,
+    "110": pl.Int64,
+    **{col: pl.Int64 for col in REAGENT_ID_COLS},
+    **{col: pl.Int64 for col in REAGENT_COUNT_COLS},
+}
+# MyDbcEditor 导出的 CSV 中, 这些 column 是 ``0x0`` 这样的十六进制字符串
+SPELL_CSV_HEX_COLS = {"109", "110"}
+
+
+def decompress_spell_csv(path_spell_csv_gz: Path) -> Path:
+    """
+    把 Spell.csv.gz 解压到同目录下的 Spell.csv, 如果已经解压过则直接返回.
+    Polars 的 lazy scan 不支持 gzip 文件, 所以需要先解压.
+
+    这个函数只用于用户自己指定的文件, 下载的 Spell.csv.gz 由
+    :func:`~acore_db_app.update.common.download.download_and_decompress_file`
+    解压到 blob store 中.
+    """
+    path_spell_csv = path_spell_csv_gz.with_suffix("")
+    if (
+        path_spell_csv.exists()
+        and path_spell_csv.stat().st_mtime >= path_spell_csv_gz.stat().st_mtime
+    ):
+        return path_spell_csv
+    # 先写入临时文件再重命名, 避免中断后留下不完整的文件
+    path_part = path_spell_csv.with_name(path_spell_csv.name + ".part")
+    with gzip.open(path_spell_csv_gz, "rb") as f_in:
+        with path_part.open("wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+    path_part.replace(path_spell_csv)
+    return path_spell_csv
+
+
+def scan_spell_csv(path_spell_csv: Path) -> pl.LazyFrame:
+    """
+    Lazy 读取 Spell.csv 文件, 如果是 Spell.csv.gz 则先用 :func:`decompress_spell_csv`
+    解压. column 重命名为从 1 开始的序号, 并且只保留 :data:`SPELL_SCHEMA` 中的
+    column. 十六进制的 column 会被转换为整数, 这样结果跟 :func:`read_spell_dbc` 一致.
+
+    ``infer_schema_length=0`` 会把所有 column 当作字符串, 从而跳过类型推断, 然后我们只对
+    用到的 column 做类型转换. 由于 projection pushdown, 其他 column 不会被解析.
+    """
+    path_spell_csv = Path(path_spell_csv)
+    if path_spell_csv.suffix == ".gz":
+        path_spell_csv = decompress_spell_csv(path_spell_csv)
+    return pl.scan_csv(
+        str(path_spell_csv),
+        infer_schema_length=0,
+        with_column_names=lambda columns: [
+            str(i) for i in range(1, 1 + len(columns))
+        ],
+    ).select(
+        [
+            (
+                pl.col(col).str.strip_prefix("0x").str.to_integer(base=16).cast(dtype)
+                if col in SPELL_CSV_HEX_COLS
+                else pl.col(col).cast(dtype)
+            )
+            for col, dtype in SPELL_SCHEMA.items()
+        ],
+    )
+
+
+def read_spell_dbc(path_spell_dbc: Path) -> pl.DataFrame:
+    """
+    直接从二进制的 Spell.dbc 文件中读取 :data:`SPELL_SCHEMA` 中的 column, column
+    名字跟 :func:`scan_spell_csv` 一致 (从 1 开始的序号). 不需要用 MyDbcEditor 转换成 CSV.
+    """
+    dbc_file = DbcFile.open(path_spell_dbc)
+    df = dbc_file.to_dataframe(
+        columns={col: int(col) - 1 for col in SPELL_SCHEMA},
+    )
+    return df.select(
+        [pl.col(col).cast(dtype) for col, dtype in SPELL_SCHEMA.items()],
+    )
+
+
+def extract_recipe_reagent(
+    df_spell: T.Union[pl.DataFrame, pl.LazyFrame],
+) -> pl.DataFrame:
+    """
+    从 Spell 表中提取配方数据, 返回一个每行一个材料的长表, 列为:
+
+    - id: 造出的物品的 ID
+    - count: 造出的物品的数量
+    - reagent_id: 材料的 ID
+    - reagent_count: 材料的数量
+
+    同一个配方的材料按照在 Spell.dbc 中的顺序排列. 整个过程都是 Polars 表达式,
+    不会在 Python 中逐行循环.
+
     Spell.dbc 中的 column 的定义: https://wowdev.wiki/DB/Spell#3.3.5.12340
 
     - col 75: 是 EffectDieSides, 也就是说这是一个几个面的色子 (N 个面就是说能丢出来的数在 1-N 之间),
     - col 81: 是 EffectBasePoints, 这就是 DNF 规则下丢色子的意思.
         例如 (EffectBasePoints, EffectDieSides) 分别是 (49, 26), 那么丢出来的随机数就是 (50, 75) 之间的一个.
     """
-    if path_spell_csv_gz is None:
-        path_spell_csv_gz = download_file(
-            file_name="Spell.csv.gz",
-            version=__version__,
+    df_recipe = df_spell.filter(
+        (
+            # 效果的类型是创建物品
+            (pl.col("72") == 24)
+            # 生产出来的物品的数量是确定的
+            & (pl.col("75") == 1)
+            # 生产出来的物品只有一种
+            & (pl.col("109") == 0)
+            & (pl.col("110") == 0)
         )
+    ).select(
+        # 用行号作为配方的唯一标识, 同时用于保持原来的顺序
+        pl.int_range(0, pl.len()).alias("recipe"),
+        # 造出的物品 ID
+        pl.col("108").alias("id"),
+        # 造出的物品的数量
+        (pl.col("75") + pl.col("81")).alias("count"),
+        *REAGENT_ID_COLS,
+        *REAGENT_COUNT_COLS,
+    )
+    # 过滤后的数据量很小, 在这里 collect, 避免下面的 8 个 select 各自扫描一遍文件
+    if isinstance(df_recipe, pl.LazyFrame):
+        df_recipe = df_recipe.collect()
+
+    # 把 8 对 (材料 ID, 材料数量) 的 column 转换成长表, 每行一个材料
+    df_reagent = pl.concat(
+        [
+            df_recipe.select(
+                "recipe",
+                "id",
+                "count",
+                pl.lit(ith).alias("slot"),
+                pl.col(id_col).alias("reagent_id"),
+                pl.col(count_col).alias("reagent_count"),
+            )
+            for ith, (id_col, count_col) in enumerate(
+                zip(REAGENT_ID_COLS, REAGENT_COUNT_COLS),
+                start=1,
+            )
+        ]
+    )
 
-    df_spell = pl.read_csv(
-        str(path_spell_csv_gz),
-        # separator=",",
-        # CSV 的读取引擎需要扫描一定数量的数据才能做出数据类型推理, 这里我们设定扫描全部数据后再做推理.
-        infer_schema_length=99999,
+    df_reagent = (
+        df_reagent.filter(pl.col("reagent_id") != 0)
+        .filter(pl.len().over("recipe") <= MAX_REAGENT)
+        # 我们只关注只有一个配方的物品
+        .filter(pl.col("recipe").n_unique().over("id") == 1)
+        .sort("recipe", "slot")
+        .select("id", "count", "reagent_id", "reagent_count")
     )
+    return df_reagent
 
-    df_spell.columns = [str(i) for i in range(1, 1 + len(df_spell.columns))]
-
-    _wanted_cols = [
-        # 施法材料
-        53,
-        54,
-        55,
-        56,
-        57,
-        58,
-        59,
-        60,
-        61,
-        62,
-        63,
-        64,
-        65,
-        66,
-        67,
-        68,
-        # 造出的物品的数量
-        75,
-        81,
-        # 造出的物品 ID
-        108,
-    ]
 
-    reagent_item_id_list = [53, 54, 55, 56, 57, 58, 59, 60]
-    reagent_item_id_list = [str(i) for i in reagent_item_id_list]
-    reagent_item_count_list = [61, 62, 63, 64, 65, 66, 67, 68]
-    reagent_item_count_list = [str(i) for i in reagent_item_count_list]
+def extract_recipe_dataframe(
+    path_spell_csv_gz: T.Optional[Path] = None,
+    path_spell_dbc: T.Optional[Path] = None,
+) -> pl.DataFrame:
+    """
+    从 Spell.csv.gz 中提取配方数据, 返回 :func:`extract_recipe_reagent` 格式的长表.
+
+    :param path_spell_dbc: 如果指定了, 则直接读取游戏客户端中的 Spell.dbc 文件.
+    """
+    if path_spell_dbc is not None:
+        return extract_recipe_reagent(read_spell_dbc(path_spell_dbc))
+    if path_spell_csv_gz is None:
+        path_spell_csv = download_and_decompress_file(
+            file_name=FileEnum.spell_csv_gz.value,
+            version=__version__,
+        )
+    else:
+        path_spell_csv = path_spell_csv_gz
+    return extract_recipe_reagent(scan_spell_csv(path_spell_csv))
 
-    wanted_cols = [str(i) for i in _wanted_cols]
 
-    df_spell_subset = (
-        df_spell.filter(
-            (
-                # 效果的类型是创建物品
-                (pl.col("72") == 24)
-                # 生产出来的物品的数量是确定的
-                & (pl.col("75") == 1)
-                # 生产出来的物品只有一种
-                & (pl.col("109") == "0x0")
-                & (pl.col("110") == "0x0")
-                # pl.col(df_spell.columns[0]).is_in([8366, 56475, 53901]), # for debug only, 用于定位特殊的 row
-            )
+def extract_recipe(
+    path_spell_csv_gz: T.Optional[Path] = None,
+    path_spell_dbc: T.Optional[Path] = None,
+) -> T.List[Recipe]:
+    """
+    从 Spell.csv.gz (或 Spell.dbc) 中提取配方数据, 返回 :class:`Recipe` 对象的列表.
+    """
+    return Recipe.from_reagent_dataframe(
+        extract_recipe_dataframe(
+            path_spell_csv_gz=path_spell_csv_gz,
+            path_spell_dbc=path_spell_dbc,
         )
-        .select(wanted_cols)
-        .limit(99999)
     )
 
-    recipe_list: T.List[Recipe] = list()
-    for record in df_spell_subset.to_dicts():
-        reagents = list()
-
-        # 从 record 中提取跟 Reagent 相关的数据
-        for col1, col2 in zip(reagent_item_id_list, reagent_item_count_list):
-            reagent_id, reagent_count = record[col1], record[col2]
-            if reagent_id != 0:
-                reagents.append(Reagent(id=reagent_id, count=reagent_count))
-
-        # 对 reagent 数据进行处理, 创建对象
-        if 1 <= len(reagents) <= 6:
-            recipe = Recipe(
-                id=record["108"],
-                count=record["75"] + record["81"],
-                reagents=reagents,
-            )
-            recipe_list.append(recipe)
 
-    # 我们只关注只有一个配方的物品
-    counter = Counter([recipe.id for recipe in recipe_list])
-    single_spell_recipe_set = {k for k, v in counter.items() if v == 1}
-    single_spell_recipe_list = [
-        recipe for recipe in recipe_list if recipe.id in single_spell_recipe_set
-    ]
-    return single_spell_recipe_list
+def get_recipe_arrow_path() -> Path:
+    """
+    获得 recipe.arrow 文件的路径. 老的 release 中没有这个文件, 这时会从 recipe.json.gz
+    在本地转换一份.
+    """
+    try:
+        return download_file(file_name=FileEnum.recipe_arrow.value)
+    except HTTPError as e:
+        if e.code != 404:  # pragma: no cover
+            raise
+    path_json_gz = download_file(file_name=FileEnum.recipe_json_gz.value)
+    path_arrow = path_json_gz.with_name(FileEnum.recipe_arrow.value)
+    Recipe.dump_ipc(Recipe.load_many(path_json_gz), path_arrow)
+    return path_arrow
+
+
+# 进程级别的缓存, key 是 (函数名, 版本, 文件路径, 文件修改时间), 文件被更新后会自动失效
+_memo: T.Dict[T.Tuple[str, str, str, int], T.Any] = dict()
+_memo_lock = threading.Lock()
+
+
+def _memoize(name: str, path: Path, load: T.Callable[[Path], T.Any]) -> T.Any:
+    key = (name, __version__, str(path), path.stat().st_mtime_ns)
+    with _memo_lock:
+        try:
+            return _memo[key]
+        except KeyError:
+            pass
+        # 删除同一个函数的旧版本的缓存
+        for old_key in [k for k in _memo if k[0] == name]:
+            del _memo[old_key]
+        value = load(path)
+        _memo[key] = value
+        return value
+
+
+def clear_cache():
+    """
+    清除 :func:`get_dataframe`, :func:`get_recipe_list` 和
+    :func:`~acore_db_app.update.common.recipe_index.get_recipe_index` 的进程级别的缓存.
+    """
+    with _memo_lock:
+        _memo.clear()
 
 
 def get_dataframe() -> pl.DataFrame:
-    path = download_file(file_name="recipe.json.gz")
-    recipe_list = Recipe.load_many(path)
-    return Recipe.to_dataframe(recipe_list)
+    """
+    获得 :meth:`Recipe.to_dataframe` 格式的配方数据. 同一个进程中的重复调用会直接返回
+    缓存的结果 (clone 是零拷贝的, 调用者修改返回值不会影响缓存).
+    """
+    return _memoize(
+        "get_dataframe", get_recipe_arrow_path(), Recipe.load_dataframe
+    ).clone()
 
 
 def get_recipe_list() -> T.List[Recipe]:
-    path = download_file(file_name="recipe.json.gz")
-    return Recipe.load_many(path)
+    """
+    获得所有的配方. 同一个进程中的重复调用会直接使用缓存的结果, 但返回的是 Recipe 对象
+    的副本, 调用者修改返回值不会影响缓存.
+    """
+    path = download_file(file_name=FileEnum.recipe_json_gz.value)
+    return [
+        dataclasses.replace(
+            recipe,
+            reagents=[dataclasses.replace(reagent) for reagent in recipe.reagents],
+        )
+        for recipe in _memoize("get_recipe_list", path, Recipe.load_many)
+    ]
@@ -2,3 +2,5 @@
 
 from .craft_spell_recipe import get_dataframe
 from .craft_spell_recipe import get_recipe_list
+from .recipe_index import RecipeIndex
+from .recipe_index import get_recipe_index
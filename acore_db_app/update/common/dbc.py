@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+一个最小的 WDBC (WotLK 3.3.5 的 ``*.dbc``) 文件读取器.
+
+DBC 文件的结构:
+
+- 20 字节的 header: magic ``WDBC``, record_count, field_count, record_size,
+    string_block_size, 都是 little endian 的 uint32.
+- record_count 条定长的 record, 每条 record_size 字节, 每个 field 4 字节.
+- string block, record 中的字符串 field 是指向 string block 的 offset.
+
+我们用 ``numpy.memmap`` 把整个文件映射到内存, 每个 field 都是一个跨步 (strided) 的
+numpy 数组, 不需要复制数据, 也不需要像 CSV 那样解析文本.
+
+Ref:
+
+- https://wowdev.wiki/DBC
+"""
+
+import typing as T
+import struct
+import dataclasses
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+MAGIC = b"WDBC"
+HEADER_SIZE = 20
+FIELD_SIZE = 4
+
+
+class DbcFormatError(ValueError):
+    """
+    Raised when the file is not a valid WDBC file.
+    """
+
+
+@dataclasses.dataclass
+class DbcFile:
+    """
+    一个被 memory map 的 DBC 文件.
+
+    :param path: DBC 文件的路径.
+    :param record_count: record 的数量.
+    :param field_count: 每个 record 的 field 数量.
+    :param record_size: 每个 record 的字节数.
+    :param string_block_size: string block 的字节数.
+    """
+
+    path: Path = dataclasses.field()
+    record_count: int = dataclasses.field()
+    field_count: int = dataclasses.field()
+    record_size: int = dataclasses.field()
+    string_block_size: int = dataclasses.field()
+    _buffer: np.memmap = dataclasses.field(repr=False)
+
+    @classmethod
+    def open(cls, path: T.Union[str, Path]) -> "DbcFile":
+        """
+        打开并 memory map 一个 DBC 文件.
+
+        :raises DbcFormatError: 文件不是合法的 WDBC 文件.
+        """
+        path = Path(path)
+        with path.open("rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:4] != MAGIC:
+            raise DbcFormatError(f"{path} is not a WDBC file")
+        record_count, field_count, record_size, string_block_size = struct.unpack(
+            "<4I", header[4:]
+        )
+        expected_size = HEADER_SIZE + record_count * record_size + string_block_size
+        if path.stat().st_size < expected_size:
+            raise DbcFormatError(
+                f"{path} is truncated, expected at least {expected_size} bytes"
+            )
+        return cls(
+            path=path,
+            record_count=record_count,
+            field_count=field_count,
+            record_size=record_size,
+            string_block_size=string_block_size,
+            _buffer=np.memmap(path, dtype=np.uint8, mode="r"),
+        )
+
+    def column(self, index: int, dtype: str = "<i4") -> np.ndarray:
+        """
+        返回第 ``index`` 个 field (从 0 开始) 的所有值. 返回的是一个指向 memory map
+        的跨步 view, 不会复制数据.
+
+        :param dtype: 4 字节的 numpy dtype, 例如 ``<i4``, ``<u4``, ``<f4``.
+        """
+        if not (0 <= index < self.field_count):
+            raise IndexError(f"field index {index} out of range")
+        return np.ndarray(
+            shape=(self.record_count,),
+            dtype=np.dtype(dtype),
+            buffer=self._buffer,
+            offset=HEADER_SIZE + index * FIELD_SIZE,
+            strides=(self.record_size,),
+        )
+
+    def string(self, offset: int) -> str:
+        """
+        读取 string block 中指定 offset 的以 ``\\0`` 结尾的字符串.
+        """
+        start = HEADER_SIZE + self.record_count * self.record_size + offset
+        block = self._buffer[start : start + self.string_block_size - offset]
+        end = int(np.argmax(block == 0)) if len(block) else 0
+        return bytes(block[:end]).decode("utf-8")
+
+    def to_dataframe(
+        self,
+        columns: T.Dict[str, int],
+        dtype: str = "<i4",
+    ) -> pl.DataFrame:
+        """
+        把指定的 field 转换成 Polars DataFrame.
+
+        :param columns: column 名字到 field index (从 0 开始) 的映射.
+        """
+        return pl.DataFrame(
+            {name: self.column(index, dtype) for name, index in columns.items()}
+        )
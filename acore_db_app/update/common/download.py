@@ -2,16 +2,41 @@
 
 """
 这个模块负责从 GitHub release 上下载数据文件.
+
+下载是流式的, 先写入 ``${file_name}.part`` 临时文件, 校验 SHA-256 后再重命名为最终的
+文件, 所以最终路径上的文件一定是完整的. 如果下载中断了, 下次会用 HTTP Range 请求从
+``.part`` 文件的末尾继续下载. 每个 release 中的 ``sha256sums.txt`` (``sha256sum``
+命令的输出格式) 记录了所有文件的 SHA-256, 老的 release 中没有这个文件, 这时不做校验.
+
+下载的文件按照内容保存在 :class:`~acore_db_app.update.common.blob_store.BlobStore` 中,
+不同版本中相同的文件只会下载和保存一次. 每次真正下载了文件之后, 如果缓存的总大小超过了
+:data:`MAX_CACHE_BYTES`, 则删除最久没有使用的其他版本.
 """
 
+import typing as T
+import gzip
 import enum
+import shutil
+import concurrent.futures
 from pathlib import Path
-from urllib.request import urlopen
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
 from ..._version import __version__
+from ...logger import logger
+from .blob_store import CHUNK_SIZE, sha256_file, BlobStore
 
 dir_tmp = Path.home().joinpath("tmp", "acore_db_app")
 
+# 下载缓存的大小上限, 超过时会删除最久没有使用的版本, 当前版本不会被删除
+MAX_CACHE_BYTES = 1024**3
+
+
+class ChecksumError(ValueError):
+    """
+    Raised when the SHA-256 of the downloaded file does not match the manifest.
+    """
+
 
 def get_download_url(file_name: str, version: str = __version__) -> str:
     return (
@@ -24,20 +49,147 @@ def get_download_path(file_name: str, version: str = __version__) -> Path:
     return dir_tmp.joinpath(version, file_name)
 
 
+def download(
+    url: str,
+    path: Path,
+    sha256: T.Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    timeout: float = 60,
+) -> Path:
+    """
+    流式下载 ``url`` 到 ``path``. 如果 ``path`` 已经存在则不会重复下载.
+
+    :param sha256: 文件的 SHA-256, 如果指定了, 则在重命名之前校验.
+
+    :raises ConnectionError: 连接提前断开, 临时文件会被保留, 下次调用时继续下载.
+    :raises ChecksumError: 下载的文件的 SHA-256 不对, 临时文件会被删除.
+    """
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path_part = path.with_name(path.name + ".part")
+    offset = path_part.stat().st_size if path_part.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    try:
+        with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+            # 如果服务器不支持 Range 请求, 会返回 200 和完整的内容, 这时从头开始写
+            mode = "ab" if response.status == 206 else "wb"
+            content_length = response.headers.get("Content-Length")
+            with path_part.open(mode) as f:
+                start = f.tell()
+                shutil.copyfileobj(response, f, chunk_size)
+                received = f.tell() - start
+            # 连接提前断开时 response 不一定会抛出异常, 保留 .part 文件以便下次继续下载
+            if content_length is not None and received != int(content_length):
+                raise ConnectionError(
+                    f"incomplete download from {url}: "
+                    f"got {received} of {content_length} bytes"
+                )
+    except HTTPError as e:
+        # 416 说明 .part 文件已经是完整的了, 只是上次没来得及重命名
+        if not (offset and e.code == 416):
+            raise
+    if sha256 is not None:
+        actual = sha256_file(path_part, chunk_size=chunk_size)
+        if actual != sha256.lower():
+            path_part.unlink()
+            raise ChecksumError(
+                f"sha256 mismatch for {url}: expected {sha256}, got {actual}"
+            )
+    path_part.replace(path)
+    return path
+
+
+def parse_manifest(text: str) -> T.Dict[str, str]:
+    """
+    解析 ``sha256sum`` 命令的输出, 返回 {file_name: sha256}.
+    """
+    manifest = dict()
+    for line in text.splitlines():
+        if line.strip():
+            sha256, file_name = line.split(maxsplit=1)
+            manifest[file_name.lstrip("*")] = sha256
+    return manifest
+
+
+def make_manifest(paths: T.Iterable[Path]) -> str:
+    """
+    生成 ``sha256sums.txt`` 的内容, 用于在发布 release 时一起上传.
+    """
+    return "".join(f"{sha256_file(path)}  {path.name}\n" for path in paths)
+
+
+def get_manifest(version: str = __version__) -> T.Dict[str, str]:
+    """
+    下载并解析指定 release 的 ``sha256sums.txt``, 如果这个 release 没有则返回空字典.
+    """
+    file_name = FileEnum.manifest.value
+    try:
+        path = download(
+            url=get_download_url(file_name=file_name, version=version),
+            path=get_download_path(file_name=file_name, version=version),
+        )
+    except HTTPError as e:
+        if e.code == 404:
+            return {}
+        raise  # pragma: no cover
+    return parse_manifest(path.read_text())
+
+
+def get_blob_store() -> BlobStore:
+    return BlobStore(dir_root=dir_tmp)
+
+
 def download_file(file_name: str, version: str = __version__) -> Path:
     """
     尝试下载文件. 如果文件已经存在, 则不会重复下载 (因为 release 是 immutable 的),
-    如果存在了, 内容就肯定是一样的.
+    如果存在了, 内容就肯定是一样的. 如果其他版本中已经有了内容相同的文件 (根据
+    manifest 中的 SHA-256 判断), 也不会重复下载. 下载之后会把缓存的大小限制在
+    :data:`MAX_CACHE_BYTES` 以内.
     """
-    url = get_download_url(file_name=file_name, version=version)
     path = get_download_path(file_name=file_name, version=version)
-    if path.exists() is False:
-        with urlopen(url) as response:
-            try:
-                path.write_bytes(response.read())
-            except FileNotFoundError:
-                path.parent.mkdir(parents=True)
-                path.write_bytes(response.read())
+    blob_store = get_blob_store()
+    if path.exists():
+        blob_store.touch(version)
+        return path
+    sha256 = get_manifest(version=version).get(file_name)
+    downloaded = sha256 is None or blob_store.link(sha256, path) is False
+    if downloaded:
+        download(
+            url=get_download_url(file_name=file_name, version=version),
+            path=path,
+            sha256=sha256,
+        )
+        sha256 = blob_store.add(path, sha256=sha256)
+    blob_store.record(version, file_name, sha256)
+    if downloaded:
+        blob_store.evict(max_bytes=MAX_CACHE_BYTES, keep=[version])
+    return path
+
+
+def download_and_decompress_file(file_name: str, version: str = __version__) -> Path:
+    """
+    下载 ``file_name`` 这个 gzip 文件, 并解压到同一个版本的目录中 (去掉 ``.gz`` 后缀),
+    如果已经解压过则直接返回. 解压后的文件和下载的文件一样被放入 blob store 并记录在
+    这个版本的 manifest 中, 所以 :meth:`BlobStore.evict` 会统计和清理它.
+    """
+    path = get_download_path(file_name=file_name, version=version).with_suffix("")
+    blob_store = get_blob_store()
+    if path.exists():
+        blob_store.touch(version)
+        return path
+    path_gz = download_file(file_name=file_name, version=version)
+    path_part = path.with_name(path.name + ".part")
+    # 上次中断时留下的 .part 可能已经是指向 blob 的 hard link, 不能直接覆盖写入
+    if path_part.exists():
+        path_part.unlink()
+    with gzip.open(path_gz, "rb") as f_in:
+        with path_part.open("wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+    sha256 = blob_store.add(path_part)
+    path_part.replace(path)
+    blob_store.record(version, path.name, sha256)
+    blob_store.evict(max_bytes=MAX_CACHE_BYTES, keep=[version])
     return path
 
 
@@ -49,9 +201,76 @@ class FileEnum(str, enum.Enum):
         See:
         - :func:`acore_db_app.update.common.craft_spell_recipe.extract_recipe`:
         - :meth:`acore_db_app.update.common.craft_spell_recipe.Recipe.dump_many`:
+    - recipe_arrow: the same recipes as ``recipe_json_gz``, in the
+        :meth:`acore_db_app.update.common.craft_spell_recipe.Recipe.to_dataframe`
+        format, stored as uncompressed Arrow IPC so it can be memory mapped. See
+        :meth:`acore_db_app.update.common.craft_spell_recipe.Recipe.dump_ipc`
     - final_price_table_tsv: this file is generated by https://github.com/MacHu-GWU/acore_db_app-project/blob/main/db_update/cpi/debug_cpi.py,
         See :meth:`acore_db_app.update.projects.cpi.CpiWorkflow.generate_final_price_table`
+    - manifest: the SHA-256 of all the other files in the release, generated by
+        :func:`make_manifest`.
     """
     spell_csv_gz = "Spell.csv.gz"
     recipe_json_gz = "recipe.json.gz"
+    recipe_arrow = "recipe.arrow"
     final_price_table_tsv = "final-price-table.tsv"
+    manifest = "sha256sums.txt"
+
+
+# 老的 release 中没有这些文件, 用到它们的代码会 fallback 到其他文件
+OPTIONAL_FILE_NAMES = {
+    FileEnum.recipe_arrow.value,
+}
+
+
+def prefetch(
+    version: str = __version__,
+    file_names: T.Optional[T.List[str]] = None,
+    max_workers: int = 4,
+) -> T.Dict[str, T.Optional[T.Union[Path, Exception]]]:
+    """
+    用一个有界的线程池并发地下载一个 release 中的所有文件, 并打印进度.
+
+    :param file_names: 要下载的文件, 默认是 :class:`FileEnum` 中的所有文件.
+    :return: {file_name: 下载后的路径或者异常}. 某个文件下载失败不会影响其他文件.
+        release 中没有的 :data:`OPTIONAL_FILE_NAMES` 会被跳过, 值为 None.
+    """
+    if file_names is None:
+        file_names = [
+            file_enum.value
+            for file_enum in FileEnum
+            if file_enum is not FileEnum.manifest
+        ]
+    # 先下载 manifest, 避免每个线程都去下载它
+    get_manifest(version=version)
+    results = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_file_name = {
+            executor.submit(download_file, file_name=file_name, version=version): (
+                file_name
+            )
+            for file_name in file_names
+        }
+        for ith, future in enumerate(
+            concurrent.futures.as_completed(future_to_file_name),
+            start=1,
+        ):
+            file_name = future_to_file_name[future]
+            progress = f"[{ith}/{len(file_names)}]"
+            try:
+                path = future.result()
+            except HTTPError as e:
+                if e.code == 404 and file_name in OPTIONAL_FILE_NAMES:
+                    logger.info(f"{progress} skip {file_name}, not in this release")
+                    results[file_name] = None
+                else:
+                    logger.info(f"{progress} failed to download {file_name}: {e!r}")
+                    results[file_name] = e
+            except Exception as e:
+                logger.info(f"{progress} failed to download {file_name}: {e!r}")
+                results[file_name] = e
+            else:
+                size = path.stat().st_size
+                logger.info(f"{progress} {file_name} ({size} bytes): file://{path}")
+                results[file_name] = path
+    return results
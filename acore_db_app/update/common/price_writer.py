@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+把计算好的物品价格批量写回 ``item_template`` 表的 ``BuyPrice``, ``SellPrice`` 两列.
+
+写回分为三步:
+
+1. :func:`read_prices` 读取表中当前的价格, :func:`diff_prices` 找到价格真正有变化的物品.
+2. :func:`render_patch` 把这些变化渲染成 SQL 文件, 便于在写入之前 review, 同时也可以
+    生成用于回滚的 SQL 文件.
+3. :func:`write_back` 把新的价格按照 ``chunk_size`` 分块用 ``executemany`` 插入一个临时
+    表, 然后用一条 ``UPDATE ... JOIN`` 语句更新这一块物品. 每一块是一个单独的事务,
+    所以同一时间只有一块的 row 被锁住, 并且只有价格不一样的 row 才会被更新.
+"""
+
+import polars as pl
+import sqlalchemy as sa
+
+from .sql_loader import read_dataframe
+
+DEFAULT_CHUNK_SIZE = 5000
+
+TEMP_TABLE_NAME = "tmp_item_price"
+
+PRICE_COLUMNS = ["BuyPrice", "SellPrice"]
+
+
+def read_prices(conn: sa.Connection, table: sa.Table) -> pl.DataFrame:
+    """
+    读取表中所有物品当前的价格, ``entry``, ``BuyPrice``, ``SellPrice`` 三列.
+    """
+    return read_dataframe(
+        conn=conn,
+        stmt=sa.select(table.c.entry, *[table.c[name] for name in PRICE_COLUMNS]),
+    )
+
+
+def diff_prices(
+    df_current: pl.DataFrame,
+    df_new: pl.DataFrame,
+) -> pl.DataFrame:
+    """
+    找到价格有变化的物品. 表中不存在的物品会被忽略.
+
+    :param df_current: :func:`read_prices` 的结果.
+    :param df_new: 新的价格, ``entry``, ``BuyPrice``, ``SellPrice`` 三列.
+    :return: ``entry``, ``BuyPrice``, ``SellPrice``, ``BuyPrice_old``,
+        ``SellPrice_old`` 五列, 按照 ``entry`` 排序.
+    """
+    columns = ["entry"] + PRICE_COLUMNS
+    return (
+        df_new.select(pl.col(name).cast(pl.Int64) for name in columns)
+        .join(
+            df_current.select(pl.col(name).cast(pl.Int64) for name in columns),
+            on="entry",
+            how="inner",
+            suffix="_old",
+        )
+        .filter(
+            pl.any_horizontal(
+                pl.col(name).ne_missing(pl.col(f"{name}_old"))
+                for name in PRICE_COLUMNS
+            )
+        )
+        .sort("entry")
+    )
+
+
+def _get_table_name(table: sa.Table) -> str:
+    if table.schema is None:
+        return table.name
+    return f"{table.schema}.{table.name}"
+
+
+def render_patch(
+    df_changed: pl.DataFrame,
+    table: sa.Table,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    rollback: bool = False,
+) -> str:
+    """
+    把 :func:`diff_prices` 的结果渲染成 SQL 文件, 每 ``chunk_size`` 个 UPDATE 语句是
+    一个事务, 和 :func:`write_back` 一致.
+
+    :param rollback: 如果为 True, 则生成把价格改回原来的值的 SQL.
+    """
+    table_name = _get_table_name(table)
+    old, new = ("", "_old") if rollback else ("_old", "")
+    lines = [f"-- update price of {df_changed.shape[0]} items in {table_name}"]
+    for df_chunk in df_changed.iter_slices(chunk_size):
+        lines.append("START TRANSACTION;")
+        for row in df_chunk.iter_rows(named=True):
+            assignments = ", ".join(
+                f"{name} = {row[name + new]}" for name in PRICE_COLUMNS
+            )
+            comment = ", ".join(
+                f"{name} {row[name + old]} -> {row[name + new]}"
+                for name in PRICE_COLUMNS
+            )
+            lines.append(
+                f"UPDATE {table_name} SET {assignments} "
+                f"WHERE entry = {row['entry']}; -- {comment}"
+            )
+        lines.append("COMMIT;")
+    return "\n".join(lines) + "\n"
+
+
+def make_temp_table(table: sa.Table) -> sa.Table:
+    """
+    创建用于 :func:`write_back` 的临时表的定义, 和 ``table`` 在同一个 schema 中.
+    """
+    return sa.Table(
+        TEMP_TABLE_NAME,
+        sa.MetaData(),
+        sa.Column("entry", sa.Integer, primary_key=True, autoincrement=False),
+        *[sa.Column(name, sa.BigInteger) for name in PRICE_COLUMNS],
+        schema=table.schema,
+        prefixes=["TEMPORARY"],
+    )
+
+
+def make_update_statement(table: sa.Table, t_tmp: sa.Table) -> sa.Update:
+    """
+    用临时表中的价格更新 ``table`` 的语句, 只更新价格不一样的 row. 在 MySQL 中会被
+    渲染为多表 UPDATE (``UPDATE item_template, tmp_item_price SET ... WHERE ...``),
+    也就是 ``UPDATE ... JOIN``.
+    """
+    return (
+        sa.update(table)
+        .where(
+            table.c.entry == t_tmp.c.entry,
+            sa.or_(*[table.c[name] != t_tmp.c[name] for name in PRICE_COLUMNS]),
+        )
+        .values({name: t_tmp.c[name] for name in PRICE_COLUMNS})
+    )
+
+
+def make_drop_temp_table_sql(t_tmp: sa.Table, dialect: sa.Dialect) -> str:
+    """
+    删除临时表的 SQL. 在 MySQL 中使用 ``DROP TEMPORARY TABLE``, 这样即使名字写错了也不会
+    删除真正的表. 连接池中的连接会被复用, 上一次异常退出时留下的临时表也会被删除.
+    """
+    temporary = "TEMPORARY " if dialect.name == "mysql" else ""
+    name = dialect.identifier_preparer.format_table(t_tmp)
+    return f"DROP {temporary}TABLE IF EXISTS {name}"
+
+
+def write_back(
+    conn: sa.Connection,
+    table: sa.Table,
+    df_changed: pl.DataFrame,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    把 :func:`diff_prices` 的结果写回 ``table``. 每一块数据在一个单独的事务中先插入
+    临时表再 ``UPDATE ... JOIN``, 每一块结束后都会 commit.
+
+    :return: 被更新的 row 的数量. 如果在 diff 之后价格被其他人改成了一样的值, 这些
+        row 不会被更新, 也不会被计入.
+    """
+    t_tmp = make_temp_table(table)
+    stmt = make_update_statement(table, t_tmp)
+    drop_sql = make_drop_temp_table_sql(t_tmp, conn.dialect)
+    conn.exec_driver_sql(drop_sql)
+    t_tmp.create(conn)
+    conn.commit()
+    n_row = 0
+    try:
+        for df_chunk in df_changed.iter_slices(chunk_size):
+            conn.execute(
+                sa.insert(t_tmp),
+                df_chunk.select(["entry"] + PRICE_COLUMNS).to_dicts(),
+            )
+            n_row += conn.execute(stmt).rowcount
+            conn.execute(sa.delete(t_tmp))
+            conn.commit()
+    finally:
+        conn.rollback()
+        conn.exec_driver_sql(drop_sql)
+        conn.commit()
+    return n_row
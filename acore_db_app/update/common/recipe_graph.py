@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+"""
+根据配方的依赖关系计算物品的价格.
+
+把每个配方看成一张有向图中的边 (材料 -> 造出的物品), 用 Kahn 算法按照拓扑顺序一层一层地
+计算价格: 第 0 层是所有材料的价格都已知的物品, 第 1 层是材料只依赖第 0 层 (以及已知价格)
+的物品, 以此类推. 每个物品和每条边只会被处理一次, 并且支持任意深度的配方链.
+
+:func:`propagate_prices` 用 Polars 实现了这个算法, 每一层只是一次 join 和一次 group by.
+:func:`propagate_prices_incremental` 在上一次计算结果 (:class:`PriceSnapshot`) 的基础上,
+只重新计算价格或配方有变化的物品以及 (直接或间接) 用它们做材料的物品.
+
+有两种物品的价格无法计算, 它们会被明确地报告出来:
+
+- 用到了没有价格, 也无法制造的材料的物品 (以及依赖它们的物品).
+- 在循环配方中的物品 (例如 A 可以用 B 制造, B 也可以用 A 制造, 并且两者都没有已知价格),
+    以及依赖它们的物品.
+"""
+
+import typing as T
+import json
+import dataclasses
+from pathlib import Path
+
+import polars as pl
+
+
+def find_cycles(
+    nodes: T.Set[int],
+    successors: T.Dict[int, T.List[int]],
+) -> T.List[T.List[int]]:
+    """
+    用 (非递归的) Tarjan 算法找到 ``nodes`` 中所有的强连通分量, 返回其中的循环
+    (多于一个节点, 或者有自环的强连通分量).
+    """
+    index: T.Dict[int, int] = dict()
+    lowlink: T.Dict[int, int] = dict()
+    stack: T.List[int] = list()
+    on_stack: T.Set[int] = set()
+    cycles: T.List[T.List[int]] = list()
+
+    def visit(node: int):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+
+    for root in sorted(nodes):
+        if root in index:
+            continue
+        visit(root)
+        work = [(root, iter(successors.get(root, [])))]
+        while work:
+            node, successor_iter = work[-1]
+            for successor in successor_iter:
+                if successor not in nodes:
+                    continue
+                if successor not in index:
+                    visit(successor)
+                    work.append((successor, iter(successors.get(successor, []))))
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = list()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in successors.get(node, []):
+                        cycles.append(sorted(component))
+    return cycles
+
+
+def topological_levels(
+    reagents: T.Dict[int, T.Iterable[int]],
+    nodes: T.Set[int],
+) -> T.Tuple[T.List[T.List[int]], T.List[T.List[int]], T.Set[int]]:
+    """
+    用 Kahn 算法把 ``nodes`` 按照拓扑顺序分层. 第 0 层的物品不依赖 ``nodes`` 中的任何
+    物品, 第 n 层的物品只依赖前 n - 1 层的物品.
+
+    :param reagents: 物品 ID -> 材料 ID 的列表.
+    :param nodes: 需要排序的物品, 不在其中的材料被视为已知.
+    :return: (levels, cycles, remaining), remaining 是因为在循环中或者依赖循环而
+        无法排序的物品.
+    """
+    # 只有同样需要排序的材料才是图中的边
+    dependents: T.Dict[int, T.List[int]] = {id: [] for id in nodes}
+    in_degree = {id: 0 for id in nodes}
+    for id in nodes:
+        for reagent_id in reagents[id]:
+            if reagent_id in nodes:
+                dependents[reagent_id].append(id)
+                in_degree[id] += 1
+
+    levels = list()
+    level = sorted(id for id, degree in in_degree.items() if degree == 0)
+    while level:
+        levels.append(level)
+        next_level = list()
+        for id in level:
+            for dependent in dependents[id]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    next_level.append(dependent)
+        level = sorted(next_level)
+
+    remaining = {id for id, degree in in_degree.items() if degree > 0}
+    cycles = find_cycles(remaining, dependents)
+    return levels, cycles, remaining
+
+
+@dataclasses.dataclass
+class PricePropagation:
+    """
+    :func:`propagate_prices` 的结果.
+
+    :param df_price: ``id``, ``price`` 两列, 包括已知的价格和计算出来的价格.
+    :param levels: 需要计算价格的物品按照拓扑顺序的分层, 同一层中的物品互相不依赖.
+        不包括因为循环而无法排序的物品.
+    :param cycles: 循环配方, 每个循环是一个物品 ID 的列表.
+    :param unresolvable: 有配方但是无法计算价格的物品.
+    :param recomputed: 增量计算时被重新计算的物品, None 表示全部重新计算.
+    """
+
+    df_price: pl.DataFrame = dataclasses.field()
+    levels: T.List[T.List[int]] = dataclasses.field()
+    cycles: T.List[T.List[int]] = dataclasses.field()
+    unresolvable: T.List[int] = dataclasses.field()
+    recomputed: T.Optional[T.List[int]] = dataclasses.field(default=None)
+
+
+def propagate_prices(
+    df_price: pl.DataFrame,
+    df_edge: pl.DataFrame,
+    apply_markup: bool = False,
+) -> PricePropagation:
+    """
+    计算所有能计算的物品的价格. 物品的价格 = sum(材料价格 * 材料数量) / 造出的物品数量.
+    按照拓扑顺序一层一层地把材料的价格 join 到配方上, 然后按物品分组求和再除以
+    ``product_count``. 每一层只是一次 join 和一次 group by, Python 中只处理图的结构.
+    已知价格的物品即使有配方也不会重新计算.
+
+    :param df_price: ``id``, ``price`` 两列, 未知价格为 null. 如果 ``apply_markup``
+        为 True, 还需要 ``markup`` 列.
+    :param df_edge: 配方的长表, 每行一个材料, 列为 ``id``, ``product_count``,
+        ``reagent_id``, ``reagent_count``.
+    :param apply_markup: 是否把计算出来的价格乘以物品的 ``markup`` (增值). 乘过之后的
+        价格会继续被用于计算下一层的物品. 已知的价格不受影响.
+    """
+    df_known = df_price.filter(pl.col("price").is_not_null()).select(
+        "id", pl.col("price").cast(pl.Float64)
+    )
+    known = set(df_known["id"].to_list())
+
+    reagents: T.Dict[int, T.List[int]] = dict()
+    for id, reagent_ids in df_edge.group_by("id").agg("reagent_id").iter_rows():
+        if id not in known:
+            reagents[id] = reagent_ids
+    levels, cycles, remaining = topological_levels(reagents, set(reagents))
+
+    df_edge = df_edge.filter(pl.col("id").is_in(list(reagents)))
+    if apply_markup:
+        df_edge = df_edge.join(
+            df_price.select("id", "markup"),
+            on="id",
+            how="left",
+            coalesce=True,
+        ).with_columns(pl.col("markup").fill_null(1))
+    else:
+        df_edge = df_edge.with_columns(pl.lit(1).alias("markup"))
+
+    price_frames = [df_known]
+    for level in levels:
+        df_level = (
+            df_edge.filter(pl.col("id").is_in(level))
+            .join(
+                pl.concat(price_frames).rename(
+                    {"id": "reagent_id", "price": "reagent_price"}
+                ),
+                on="reagent_id",
+                how="left",
+                coalesce=True,
+            )
+            .group_by("id")
+            .agg(
+                (
+                    (pl.col("reagent_price") * pl.col("reagent_count")).sum()
+                    / pl.col("product_count").first()
+                    * pl.col("markup").first()
+                ).alias("price"),
+                pl.col("reagent_price").null_count().alias("n_missing"),
+            )
+            .filter(pl.col("n_missing") == 0)
+            .select("id", pl.col("price").cast(pl.Float64))
+        )
+        price_frames.append(df_level)
+
+    df_result = pl.concat(price_frames)
+    resolved = set(df_result["id"].to_list())
+    return PricePropagation(
+        df_price=df_result,
+        levels=levels,
+        cycles=cycles,
+        unresolvable=sorted(set(reagents).difference(resolved)),
+    )
+
+
+@dataclasses.dataclass
+class PriceSnapshot:
+    """
+    一次价格计算的输入和结果, 用于下一次的增量计算.
+
+    :param df_price: :func:`propagate_prices` 的 ``df_price`` 参数.
+    :param df_edge: :func:`propagate_prices` 的 ``df_edge`` 参数.
+    :param df_result: 计算结果, ``id``, ``price`` 两列.
+    :param apply_markup: :func:`propagate_prices` 的 ``apply_markup`` 参数.
+    """
+
+    df_price: pl.DataFrame = dataclasses.field()
+    df_edge: pl.DataFrame = dataclasses.field()
+    df_result: pl.DataFrame = dataclasses.field()
+    apply_markup: bool = dataclasses.field()
+
+    _FRAMES = ("df_price", "df_edge", "df_result")
+    _META = "snapshot.json"
+
+    def dump(self, dir_snapshot: Path):
+        """
+        把 snapshot 保存到 ``dir_snapshot`` 目录下. ``snapshot.json`` 最后写入,
+        所以它存在就说明其他文件是完整的.
+        """
+        dir_snapshot.mkdir(parents=True, exist_ok=True)
+        path_meta = dir_snapshot.joinpath(self._META)
+        if path_meta.exists():
+            path_meta.unlink()
+        for name in self._FRAMES:
+            path = dir_snapshot.joinpath(f"{name}.parquet")
+            path_part = path.with_name(path.name + ".part")
+            getattr(self, name).write_parquet(str(path_part))
+            path_part.replace(path)
+        path_meta.write_text(json.dumps({"apply_markup": self.apply_markup}))
+
+    @classmethod
+    def load(cls, dir_snapshot: Path) -> T.Optional["PriceSnapshot"]:
+        """
+        读取 :meth:`dump` 保存的 snapshot, 如果不存在或者不完整则返回 None.
+        """
+        path_meta = dir_snapshot.joinpath(cls._META)
+        if not path_meta.exists():
+            return None
+        meta = json.loads(path_meta.read_text())
+        return cls(
+            apply_markup=meta["apply_markup"],
+            **{
+                name: pl.read_parquet(str(dir_snapshot.joinpath(f"{name}.parquet")))
+                for name in cls._FRAMES
+            },
+        )
+
+
+def diff_prices(
+    df_price_old: pl.DataFrame,
+    df_price_new: pl.DataFrame,
+    df_edge_old: pl.DataFrame,
+    df_edge_new: pl.DataFrame,
+    apply_markup: bool = False,
+) -> T.Set[int]:
+    """
+    找到两次计算之间输入有变化的物品: 新增或删除的物品, 价格 (以及 ``apply_markup``
+    时的 ``markup``) 变化了的物品, 以及配方变化了的物品.
+    """
+    columns = ["price", "markup"] if apply_markup else ["price"]
+
+    def select(df: pl.DataFrame) -> pl.DataFrame:
+        return df.select(
+            pl.col("id").cast(pl.Int64),
+            *[pl.col(column).cast(pl.Float64) for column in columns],
+            # 用来判断物品是否只在一边存在
+            pl.lit(True).alias("exists"),
+        )
+
+    df_diff = select(df_price_new).join(
+        select(df_price_old),
+        on="id",
+        how="full",
+        suffix="_old",
+        coalesce=True,
+    )
+    changed = set(
+        df_diff.filter(
+            pl.any_horizontal(
+                pl.col(f"{column}_old").ne_missing(pl.col(column))
+                for column in columns + ["exists"]
+            )
+        )["id"].to_list()
+    )
+
+    def select_edge(df: pl.DataFrame) -> pl.DataFrame:
+        return df.select(
+            pl.col(column).cast(pl.Float64)
+            for column in ["id", "product_count", "reagent_id", "reagent_count"]
+        )
+
+    df_edge_old, df_edge_new = select_edge(df_edge_old), select_edge(df_edge_new)
+    for df_left, df_right in [(df_edge_old, df_edge_new), (df_edge_new, df_edge_old)]:
+        df_anti = df_left.join(df_right, on=df_left.columns, how="anti")
+        changed.update(int(id) for id in df_anti["id"].to_list())
+    return changed
+
+
+def find_dependents(
+    df_edge: pl.DataFrame,
+    ids: T.Iterable[int],
+) -> T.Set[int]:
+    """
+    沿着反向的配方图找到 ``ids`` 以及所有直接或间接用它们做材料的物品.
+    """
+    dependents: T.Dict[int, T.List[int]] = dict()
+    for reagent_id, product_ids in (
+        df_edge.group_by("reagent_id").agg(pl.col("id").unique()).iter_rows()
+    ):
+        dependents[reagent_id] = product_ids
+    found = set(ids)
+    stack = list(found)
+    while stack:
+        for product_id in dependents.get(stack.pop(), []):
+            if product_id not in found:
+                found.add(product_id)
+                stack.append(product_id)
+    return found
+
+
+def propagate_prices_incremental(
+    snapshot: PriceSnapshot,
+    df_price: pl.DataFrame,
+    df_edge: pl.DataFrame,
+    apply_markup: bool = False,
+) -> PricePropagation:
+    """
+    :func:`propagate_prices` 的增量版本. 和上一次计算的输入 ``snapshot`` 做对比,
+    只重新计算受影响的物品 (见 :func:`diff_prices` 和 :func:`find_dependents`),
+    其他物品直接使用上一次的结果. 结果和用 :func:`propagate_prices` 全部重新计算
+    是一样的, 不过 ``levels`` 和 ``cycles`` 只包括被重新计算的物品.
+
+    如果 ``apply_markup`` 和上一次不一样, 则全部重新计算.
+    """
+    if snapshot.apply_markup != apply_markup:
+        return propagate_prices(
+            df_price=df_price,
+            df_edge=df_edge,
+            apply_markup=apply_markup,
+        )
+
+    changed = diff_prices(
+        df_price_old=snapshot.df_price,
+        df_price_new=df_price,
+        df_edge_old=snapshot.df_edge,
+        df_edge_new=df_edge,
+        apply_markup=apply_markup,
+    )
+    affected = find_dependents(df_edge, changed)
+    affected_list = sorted(affected)
+
+    # 不受影响的物品把上一次计算出来的价格当作已知的价格
+    df_previous = snapshot.df_result.filter(
+        ~pl.col("id").is_in(affected_list)
+    ).select(
+        pl.col("id").cast(df_price.schema["id"]),
+        pl.col("price").alias("price_previous"),
+    )
+    df_price_sub = (
+        df_price.join(df_previous, on="id", how="left", coalesce=True)
+        .with_columns(
+            pl.when(pl.col("id").is_in(affected_list))
+            .then(pl.col("price").cast(pl.Float64))
+            .otherwise(pl.col("price_previous"))
+            .alias("price")
+        )
+        .drop("price_previous")
+    )
+    result = propagate_prices(
+        df_price=df_price_sub,
+        df_edge=df_edge.filter(pl.col("id").is_in(affected_list)),
+        apply_markup=apply_markup,
+    )
+
+    # 不受影响的, 上一次就无法计算的物品, 这一次也一样无法计算
+    known = set(
+        df_price.filter(pl.col("price").is_not_null())["id"].to_list()
+    )
+    resolved = set(result.df_price["id"].to_list())
+    result.unresolvable = sorted(
+        set(df_edge["id"].to_list()).difference(known, resolved)
+    )
+    ids = set(df_price["id"].to_list())
+    result.recomputed = [id for id in affected_list if id in ids]
+    return result
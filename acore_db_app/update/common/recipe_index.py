@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+配方数据的正向和反向索引.
+
+配方数据本身只有 "物品 -> 材料" 的映射, 要回答 "哪些配方用到了某个材料", 或者
+"某个材料的价格变了会影响哪些物品" 这样的问题就需要遍历所有配方. :class:`RecipeIndex`
+预先建立了正向 (物品 -> 材料) 和反向 (材料 -> 物品) 两个索引, 并和配方数据一起
+保存在 ``recipe-index.arrow`` 文件中. 文件中每个物品一行, 两个索引都是 list column,
+读取时不需要再 group by.
+"""
+
+import typing as T
+import dataclasses
+from pathlib import Path
+
+import polars as pl
+
+from .craft_spell_recipe import (
+    Recipe,
+    to_long_dataframe,
+    get_recipe_arrow_path,
+    write_ipc_atomic,
+    _memoize,
+)
+
+# recipe-index.arrow 的 schema
+INDEX_SCHEMA = {
+    "id": pl.Int64,
+    "reagent_id": pl.List(pl.Int64),
+    "reagent_count": pl.List(pl.Int64),
+    "product_id": pl.List(pl.Int64),
+}
+
+
+def to_index_dataframe(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    把 :func:`~acore_db_app.update.common.craft_spell_recipe.extract_recipe_reagent`
+    格式的长表转换为索引表, 每个物品一行, 列为:
+
+    - ``id``: 物品 ID.
+    - ``reagent_id``, ``reagent_count``: 制造这个物品所需的材料, 按照配方中的顺序排列.
+        不能制造的物品为 null.
+    - ``product_id``: 用到这个物品作为材料的物品 ID (从小到大排列). 不是材料的物品
+        为 null.
+    """
+    df_forward = df.group_by("id", maintain_order=True).agg(
+        pl.col("reagent_id"),
+        pl.col("reagent_count"),
+    )
+    df_reverse = df.group_by("reagent_id").agg(
+        pl.col("id").unique().sort().alias("product_id")
+    )
+    return (
+        df_forward.join(
+            df_reverse.rename({"reagent_id": "id"}),
+            on="id",
+            how="full",
+            coalesce=True,
+        )
+        .sort("id")
+        .select([pl.col(col).cast(dtype) for col, dtype in INDEX_SCHEMA.items()])
+    )
+
+
+@dataclasses.dataclass
+class RecipeIndex:
+    """
+    配方的正向和反向索引.
+
+    :param forward: 物品 ID -> {材料 ID: 材料数量}, 按照配方中的顺序排列.
+    :param reverse: 材料 ID -> 用到这个材料的物品 ID 的列表 (从小到大排列).
+    """
+
+    forward: T.Dict[int, T.Dict[int, int]] = dataclasses.field()
+    reverse: T.Dict[int, T.List[int]] = dataclasses.field()
+
+    @classmethod
+    def from_index_dataframe(cls, df: pl.DataFrame) -> "RecipeIndex":
+        """
+        从 :func:`to_index_dataframe` 格式的索引表创建索引.
+        """
+        ids = df["id"].to_list()
+        forward = {
+            id: dict(zip(reagent_ids, reagent_counts))
+            for id, reagent_ids, reagent_counts in zip(
+                ids, df["reagent_id"].to_list(), df["reagent_count"].to_list()
+            )
+            if reagent_ids is not None
+        }
+        reverse = {
+            id: product_ids
+            for id, product_ids in zip(ids, df["product_id"].to_list())
+            if product_ids is not None
+        }
+        return cls(forward=forward, reverse=reverse)
+
+    @classmethod
+    def from_reagent_dataframe(cls, df: pl.DataFrame) -> "RecipeIndex":
+        """
+        从 :func:`~acore_db_app.update.common.craft_spell_recipe.extract_recipe_reagent`
+        格式的长表创建索引.
+        """
+        return cls.from_index_dataframe(to_index_dataframe(df))
+
+    @classmethod
+    def from_recipes(cls, recipes: T.List[Recipe]) -> "RecipeIndex":
+        return cls.from_reagent_dataframe(Recipe.to_reagent_dataframe(recipes))
+
+    def to_dataframe(self) -> pl.DataFrame:
+        """
+        把索引转换为 :func:`to_index_dataframe` 格式的索引表, 用于持久化.
+        """
+        ids = sorted(set(self.forward) | set(self.reverse))
+        return pl.DataFrame(
+            {
+                "id": ids,
+                "reagent_id": [
+                    list(self.forward[id]) if id in self.forward else None
+                    for id in ids
+                ],
+                "reagent_count": [
+                    list(self.forward[id].values()) if id in self.forward else None
+                    for id in ids
+                ],
+                "product_id": [self.reverse.get(id) for id in ids],
+            },
+            schema=INDEX_SCHEMA,
+        )
+
+    def dump(self, path_arrow: Path):
+        """
+        Dump the index to an uncompressed Arrow IPC file.
+        """
+        write_ipc_atomic(self.to_dataframe(), path_arrow)
+
+    @classmethod
+    def load(cls, path_arrow: Path) -> "RecipeIndex":
+        """
+        Load the index from an Arrow IPC file created by :meth:`dump`.
+        """
+        return cls.from_index_dataframe(pl.read_ipc(str(path_arrow), memory_map=True))
+
+    def get_reagents(self, id: int) -> T.Dict[int, int]:
+        """
+        返回制造物品 ``id`` 所需的材料, {材料 ID: 材料数量}. 不能制造的物品返回空字典.
+        返回的是副本, 调用者修改返回值不会影响索引.
+        """
+        return dict(self.forward.get(id, {}))
+
+    def get_products(self, reagent_id: int) -> T.List[int]:
+        """
+        返回直接用到材料 ``reagent_id`` 的所有物品 ID. 返回的是副本.
+        """
+        return list(self.reverse.get(reagent_id, []))
+
+    def get_affected_products(self, reagent_ids: T.Iterable[int]) -> T.Set[int]:
+        """
+        返回价格会受到 ``reagent_ids`` 影响的所有物品 ID, 包括间接用到这些材料的物品.
+        例如 A 是 B 的材料, B 是 C 的材料, 那么 A 的价格变了会影响 B 和 C.
+        """
+        affected = set()
+        stack = list(reagent_ids)
+        while stack:
+            for id in self.reverse.get(stack.pop(), []):
+                if id not in affected:
+                    affected.add(id)
+                    stack.append(id)
+        return affected
+
+
+def get_recipe_index() -> RecipeIndex:
+    """
+    获得 :func:`~acore_db_app.update.common.craft_spell_recipe.get_dataframe` 中的配方
+    数据的索引. 索引保存在 ``recipe.arrow`` 旁边的 ``recipe-index.arrow`` 文件中,
+    如果不存在或者比 ``recipe.arrow`` 旧, 则重新创建.
+
+    和 ``get_dataframe`` 一样, 同一个进程中的重复调用会直接返回缓存的索引, 它是共享的,
+    请不要直接修改 ``forward`` 和 ``reverse`` 属性.
+    """
+    path_recipe_arrow = get_recipe_arrow_path()
+    path_index_arrow = path_recipe_arrow.with_name("recipe-index.arrow")
+    if not (
+        path_index_arrow.exists()
+        and path_index_arrow.stat().st_mtime >= path_recipe_arrow.stat().st_mtime
+    ):
+        df = to_long_dataframe(Recipe.load_dataframe(path_recipe_arrow))
+        RecipeIndex.from_reagent_dataframe(df).dump(path_index_arrow)
+    return _memoize("get_recipe_index", path_index_arrow, RecipeIndex.load)
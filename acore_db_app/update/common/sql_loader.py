@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+把 SQL 查询的结果流式地转换为 Arrow 格式, 写入 Parquet 文件或者直接读取为 Polars DataFrame.
+
+查询使用 server side cursor (``stream_results``), 每次只从数据库取 ``chunk_size`` 行,
+转换为一个 :class:`pyarrow.RecordBatch` 后写入 Parquet 文件, 所以无论表有多大, 内存中
+最多只有一个 chunk 的数据. 每个 column 的 Arrow 类型根据 SQLAlchemy 的 column 类型
+确定, 而不是根据数据推断, 这样每个 chunk 的 schema 都是一样的.
+"""
+
+import typing as T
+import decimal
+import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import polars as pl
+import sqlalchemy as sa
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# SQLAlchemy column 的 python_type 到 Arrow 类型的映射
+PYTHON_TYPE_TO_ARROW_TYPE: T.Dict[type, pa.DataType] = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    decimal.Decimal: pa.float64(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    datetime.datetime: pa.timestamp("us"),
+    datetime.date: pa.date32(),
+    datetime.time: pa.time64("us"),
+}
+
+
+def get_arrow_type(sa_type: sa.types.TypeEngine) -> pa.DataType:
+    """
+    根据 SQLAlchemy 的 column 类型获得对应的 Arrow 类型, 无法识别的类型当作字符串.
+    """
+    try:
+        python_type = sa_type.python_type
+    except NotImplementedError:  # pragma: no cover
+        return pa.string()
+    return PYTHON_TYPE_TO_ARROW_TYPE.get(python_type, pa.string())
+
+
+def get_arrow_schema(stmt: sa.Select) -> pa.Schema:
+    """
+    根据 SELECT 语句中的 column 的类型获得 Arrow schema.
+    """
+    return pa.schema(
+        [
+            pa.field(column.name, get_arrow_type(column.type))
+            for column in stmt.selected_columns
+        ]
+    )
+
+
+def _to_arrow_array(values: T.List[T.Any], arrow_type: pa.DataType) -> pa.Array:
+    if pa.types.is_floating(arrow_type):
+        # Decimal 不能直接转换为 double
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_string(arrow_type):
+        values = [None if v is None else str(v) for v in values]
+    return pa.array(values, type=arrow_type)
+
+
+def iter_record_batches(
+    conn: sa.Connection,
+    stmt: sa.Select,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    schema: T.Optional[pa.Schema] = None,
+) -> T.Iterator[pa.RecordBatch]:
+    """
+    用 server side cursor 执行查询, 每 ``chunk_size`` 行 yield 一个 RecordBatch.
+
+    :param schema: 默认由 :func:`get_arrow_schema` 生成.
+    """
+    if schema is None:
+        schema = get_arrow_schema(stmt)
+    result = conn.execution_options(
+        stream_results=True,
+        yield_per=chunk_size,
+    ).execute(stmt)
+    for rows in result.partitions(chunk_size):
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [
+                _to_arrow_array(list(values), field.type)
+                for values, field in zip(columns, schema)
+            ],
+            schema=schema,
+        )
+
+
+def write_parquet(
+    conn: sa.Connection,
+    stmt: sa.Select,
+    path: Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    把查询结果流式地写入 Parquet 文件. 先写入临时文件再重命名, 中断时不会留下不完整的文件.
+
+    :return: 写入的行数.
+    """
+    schema = get_arrow_schema(stmt)
+    path_part = path.with_name(path.name + ".part")
+    n_row = 0
+    with pq.ParquetWriter(str(path_part), schema) as writer:
+        for batch in iter_record_batches(
+            conn=conn,
+            stmt=stmt,
+            chunk_size=chunk_size,
+            schema=schema,
+        ):
+            writer.write_batch(batch)
+            n_row += batch.num_rows
+    path_part.replace(path)
+    return n_row
+
+
+def read_dataframe(
+    conn: sa.Connection,
+    stmt: sa.Select,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> pl.DataFrame:
+    """
+    把查询结果直接读取为 Polars DataFrame. 数据按 chunk 转换为 Arrow 的 RecordBatch,
+    然后零拷贝地转换为 DataFrame, 不需要先创建 list of dict. column 的类型见
+    :func:`get_arrow_schema`.
+    """
+    schema = get_arrow_schema(stmt)
+    table = pa.Table.from_batches(
+        list(
+            iter_record_batches(
+                conn=conn,
+                stmt=stmt,
+                chunk_size=chunk_size,
+                schema=schema,
+            )
+        ),
+        schema=schema,
+    )
+    return pl.from_arrow(table)
@@ -17,6 +17,9 @@ from pathlib_mate import Path
 from acore_df.api import Lookup
 
 from ..common.api import craft_spell_recipe
+from ..common import sql_loader
+from ..common import recipe_graph
+from ..common import price_writer
 from ...logger import logger
 
 if T.TYPE_CHECKING:  # pragma: no cover
@@ -38,6 +41,10 @@ class CpiWorkflow:
     def path_item_template_backup_json_gz(self) -> Path:
         return self.dir_workspace.joinpath("item_template_backup.json.gz")
 
+    @property
+    def path_item_template_backup_parquet(self) -> Path:
+        return self.dir_workspace.joinpath("item_template_backup.parquet")
+
     @property
     def path_lookup_table_tsv(self) -> Path:
         return self.dir_workspace.joinpath("lookup_table.tsv")
@@ -54,6 +61,70 @@ class CpiWorkflow:
     def final_price_table_tsv(self) -> Path:
         return self.dir_workspace.joinpath("final-price-table.tsv")
 
+    @property
+    def dir_price_snapshot(self) -> Path:
+        return self.dir_workspace.joinpath("price-snapshot")
+
+    @property
+    def path_price_patch_sql(self) -> Path:
+        return self.dir_workspace.joinpath("item-price-patch.sql")
+
+    @property
+    def path_price_rollback_sql(self) -> Path:
+        return self.dir_workspace.joinpath("item-price-rollback.sql")
+
+    def select_item_template(
+        self,
+        columns: T.Optional[T.List[str]] = None,
+    ) -> sa.Select:
+        """
+        生成查询 ItemTemplate 表 (以及中文名字 ``name_cn``) 的 SQL 语句.
+
+        :param columns: 只查询这些 column, 默认查询所有 column.
+        """
+        t_item_template = self.orm.t_item_template
+        t_item_template_locale = self.orm.t_item_template_locale
+        name_cn = t_item_template_locale.c.Name.label("name_cn")
+        if columns is None:
+            selected = [t_item_template, name_cn]
+        else:
+            selected = [
+                name_cn if column == "name_cn" else t_item_template.c[column]
+                for column in columns
+            ]
+        return (
+            sa.select(*selected)
+            .join(
+                t_item_template_locale,
+                onclause=t_item_template.c.entry == t_item_template_locale.c.ID,
+            )
+            .where(t_item_template_locale.c.locale == "zhCN")
+        )
+
+    def load_item_template(
+        self,
+        columns: T.List[str],
+        from_db: bool = False,
+    ) -> pl.DataFrame:
+        """
+        读取 ItemTemplate 表的指定 column.
+
+        :param from_db: 如果为 True, 则直接从数据库读取, 否则从
+            :meth:`backup_item_template` 生成的 Parquet 备份中读取.
+        """
+        if from_db:
+            logger.info(f"Load data from item_template table ...")
+            with self.orm.engine.connect() as conn:
+                return sql_loader.read_dataframe(
+                    conn=conn,
+                    stmt=self.select_item_template(columns),
+                )
+        logger.info(f"Load data from {self.path_item_template_backup_parquet} ...")
+        return pl.read_parquet(
+            str(self.path_item_template_backup_parquet),
+            columns=columns,
+        )
+
     @logger.emoji_block(
         msg="{func_name}",
         emoji="📄",
@@ -61,44 +132,56 @@ class CpiWorkflow:
     def backup_item_template(
         self,
         _limit: T.Optional[int] = None,
-    ) -> T.List[T.Dict[str, T.Any]]:
+        chunk_size: int = sql_loader.DEFAULT_CHUNK_SIZE,
+        export_json_gz: bool = False,
+    ) -> Path:
         """
-        将数据库中的 ItemTemplate 表的数据导出并备份到 json 文件中.
+        将数据库中的 ItemTemplate 表的数据导出并备份到 Parquet 文件中. 查询结果是按照
+        ``chunk_size`` 分块流式写入的, 内存中最多只有一个 chunk 的数据.
+
+        :param export_json_gz: 是否同时导出一份 json.gz 格式 (list of dict) 的备份.
         """
         engine = self.orm.engine
         with engine.connect() as conn:
-            t_item_template = self.orm.t_item_template
-            t_item_template_locale = self.orm.t_item_template_locale
-            sql_stmt = (
-                sa.select(
-                    t_item_template, t_item_template_locale.c.Name.label("name_cn")
-                )
-                .join(
-                    t_item_template_locale,
-                    onclause=t_item_template.c.entry == t_item_template_locale.c.ID,
-                )
-                .where(t_item_template_locale.c.locale == "zhCN")
+            sql_stmt = self.select_item_template()
+            if _limit is not None:
+                sql_stmt = sql_stmt.limit(_limit)
+            logger.info(
+                f"Read data from item_template table "
+                f"and dump to {self.path_item_template_backup_parquet} ..."
+            )
+            n_row = sql_loader.write_parquet(
+                conn=conn,
+                stmt=sql_stmt,
+                path=self.path_item_template_backup_parquet,
+                chunk_size=chunk_size,
             )
-            logger.info("Read data from item_template table ...")
-            item_template_records = [row._asdict() for row in conn.execute(sql_stmt)]
-            logger.info(f"Done, got {len(item_template_records)} records.")
+            logger.info(f"Done, got {n_row} records.")
+            logger.info(f"See: file://{self.path_item_template_backup_parquet}")
 
+        if export_json_gz:
             logger.info(f"Dump data to {self.path_item_template_backup_json_gz} ...")
+            item_template_records = pl.read_parquet(
+                str(self.path_item_template_backup_parquet)
+            ).to_dicts()
             self.path_item_template_backup_json_gz.write_bytes(
                 gzip.compress(
-                    json.dumps(item_template_records, ensure_ascii=False).encode(
-                        "utf-8"
-                    )
+                    json.dumps(
+                        item_template_records, ensure_ascii=False, default=str
+                    ).encode("utf-8")
                 )
             )
             logger.info(f"Done, see: file://{self.path_item_template_backup_json_gz}")
-        return item_template_records
+        return self.path_item_template_backup_parquet
 
     @logger.emoji_block(
         msg="{func_name}",
         emoji="📄",
     )
-    def generate_base_price_table(self) -> pl.DataFrame:
+    def generate_base_price_table(
+        self,
+        from_db: bool = False,
+    ) -> pl.DataFrame:
         """
         生成一个包含所有物品列表, 但是没有价格的基础 price table. 然后我才能在这个表中
         填入物品价值. 在 price table 中的物品都是我认为 "可以" 从 NPC 处购买的物品. 包括:
@@ -109,19 +192,9 @@ class CpiWorkflow:
 
         生成的表结构可以参考: https://docs.google.com/spreadsheets/d/1e4I2-d4JyVbsvOcdePruqev-rkyYYMUPrwkI_fieIYw/edit?gid=2104698923#gid=2104698923
         """
-        logger.info(f"Load data from {self.path_item_template_backup_json_gz} ...")
-        records = json.loads(
-            gzip.decompress(self.path_item_template_backup_json_gz.read_bytes()).decode(
-                "utf-8"
-            )
-        )
-        logger.info(f"total records = {len(records)}")
-
-        logger.info(f"Transform data ...")
-        df = pl.DataFrame(records)
-
-        df = df.select(
-            [
+        df = self.load_item_template(
+            from_db=from_db,
+            columns=[
                 "entry",
                 "name_cn",
                 "class",
@@ -130,8 +203,11 @@ class CpiWorkflow:
                 "bonding",
                 "ItemLevel",
                 "RequiredLevel",
-            ]
+            ],
         )
+        logger.info(f"total records = {df.shape[0]}")
+
+        logger.info(f"Transform data ...")
         df = df.rename(
             mapping={
                 "entry": "编号",
@@ -405,13 +481,22 @@ class CpiWorkflow:
         msg="{func_name}",
         emoji="📄",
     )
-    def generate_final_price_table(self):
+    def generate_final_price_table(
+        self,
+        apply_markup: bool = False,
+        incremental: bool = False,
+    ):
         """
         生成包含所有物品的单价的 final price table. 这个表是根据 base price table
         计算得来. 在 base price table 中只有原子类的物品的单价 (原子类物品就是无法通过
         其他物品合成的物品). 在 final price table 中, 我们会尽可能的计算出所有物品的
         单价.
 
+        :param apply_markup: 是否把计算出来的单价乘以 ``增值`` 列, 默认不乘.
+        :param incremental: 是否只重新计算和上一次运行相比, 单价, 增值或者配方有变化的
+            物品以及用它们做材料的物品. 每次运行都会把输入和结果保存到
+            :attr:`dir_price_snapshot`, 如果没有上一次的结果则全部重新计算.
+
         生成的表结构可以参考: https://docs.google.com/spreadsheets/d/1e4I2-d4JyVbsvOcdePruqev-rkyYYMUPrwkI_fieIYw/edit?gid=1949060708#gid=1949060708
         """
         # 从 price table 中读取所需的数据
@@ -452,85 +537,158 @@ class CpiWorkflow:
                 "reagent_count_6": pl.Float32,
             },
         )
-        # 建立一个内存中的 id -> row 的映射
-        mapping = {row["编号"]: row for row in df.to_dicts()}
-
         logger.info(f"extract reagents ...")
-        def extract_reagents(row: T.Dict[str, T.Any]) -> T.Dict[int, int]:
-            """
-            从 row 中把多个 column 的值合并成一个 reagents 字段. reagents 字段是一个字典,
-            key 是 reagent_id, value 是 reagent_count.
-            """
-            reagents = {}
-            for i in range(1, 1 + 6):
-                id = row[f"reagent_id_{i}"]
-                if id:
-                    reagents[id] = row[f"reagent_count_{i}"]
-            return reagents
-
-        # 先获得所有 item 的 reagents
-        for id, row in mapping.items():
-            reagents = extract_reagents(row)
-            mapping[id]["reagents"] = reagents
-
-        logger.info(f"resolve price ...")
-        def resolve_price():
-            """
-            这个函数会遍历所有 item, 尝试计算出单价. 由于很可能 item 配方中的 reagent
-            的单价还没有计算出来, 要正确计算就需要用到递归编程. 这里我们偷懒了, 就用多次
-            循环来模拟递归, 直到再也无法找到任何一个新的 item 能计算出单价为止.
-            """
-            counter = 0
-            for id, row in mapping.items():
-                price = row["单价"]
-                if price == -1:
-                    reagents = row["reagents"]
-                    if reagents:
-                        total_price = 0
-                        found_total_price = True
-                        for reg_id, reg_count in reagents.items():
-                            try:
-                                reg_price = mapping[reg_id]["单价"]
-                            except KeyError:
-                                found_total_price = False
-                                break
-                            if reg_price == -1:
-                                found_total_price = False
-                                break
-                            else:
-                                total_price += reg_price * reg_count
-                        if found_total_price:
-                            unit_price = total_price / row["product_count"]
-                            mapping[id]["单价"] = unit_price
-                            counter += 1
-            return counter
-
-        # 循环十次, 直到没有新物品既可
-        for ith in range(1, 1 + 10):
-            logger.info(f"--- {ith} iteration ---")
-            counter = resolve_price()
-            logger.info(f"resolved {counter} items")
-            if counter == 0:
-                break
-
-        # 我们不需要 reagents 列了
-        for id, row in mapping.items():
-            del row["reagents"]
+        # 把多个 reagent column 转换成每行一个材料的长表
+        df_edge = pl.concat(
+            [
+                df.select(
+                    pl.col("编号").alias("id"),
+                    "product_count",
+                    pl.col(f"reagent_id_{i}").alias("reagent_id"),
+                    pl.col(f"reagent_count_{i}").alias("reagent_count"),
+                )
+                for i in range(1, 1 + 6)
+            ]
+        ).filter(pl.col("reagent_id").is_not_null() & (pl.col("reagent_id") != 0))
+        df_price = df.select(
+            pl.col("编号").alias("id"),
+            # -1 表示价格未知
+            pl.when(pl.col("单价") == -1)
+            .then(None)
+            .otherwise(pl.col("单价"))
+            .alias("price"),
+            pl.col("增值").alias("markup"),
+        )
+
+        snapshot = None
+        if incremental:
+            snapshot = recipe_graph.PriceSnapshot.load(self.dir_price_snapshot)
+            if snapshot is None:
+                logger.info(f"no previous run found, resolve all price ...")
+        if snapshot is None:
+            logger.info(f"resolve price ...")
+            result = recipe_graph.propagate_prices(
+                df_price=df_price,
+                df_edge=df_edge,
+                apply_markup=apply_markup,
+            )
+        else:
+            logger.info(f"resolve price of changed items ...")
+            result = recipe_graph.propagate_prices_incremental(
+                snapshot=snapshot,
+                df_price=df_price,
+                df_edge=df_edge,
+                apply_markup=apply_markup,
+            )
+            if result.recomputed is not None:
+                logger.info(f"recomputed {len(result.recomputed)} items")
+        logger.info(
+            f"got price of {result.df_price.shape[0]} items, "
+            f"{len(result.levels)} levels of recipes"
+        )
+        recipe_graph.PriceSnapshot(
+            df_price=df_price,
+            df_edge=df_edge,
+            df_result=result.df_price,
+            apply_markup=apply_markup,
+        ).dump(self.dir_price_snapshot)
+        for cycle in result.cycles:
+            logger.info(f"found cyclic recipes: {cycle}")
+        logger.info(
+            f"cannot resolve price of {len(result.unresolvable)} items: "
+            f"{result.unresolvable}"
+        )
 
         # 重新排列一下 column 准备输出
-        df = pl.DataFrame(list(mapping.values()), infer_schema_length=99999)
-        df = df.select(
-            [
+        df = (
+            df.select("编号", "名字", "增值", "可买")
+            .join(
+                result.df_price,
+                left_on="编号",
+                right_on="id",
+                how="inner",
+            )
+            .select(
                 "编号",
                 "名字",
-                "单价",
+                (pl.col("price") * 10000).cast(int).alias("单价"),
                 "增值",
                 "可买",
-            ]
+            )
         )
-        df = df.filter(pl.col("单价") != -1)
-        df = df.with_columns((pl.col("单价") * 10000).cast(int))
 
         logger.info(f"Dump data to {self.final_price_table_tsv} ...")
         df.write_csv(str(self.final_price_table_tsv), separator="\t")
         logger.info(f"Done, see: file://{self.final_price_table_tsv}")
+
+    @logger.emoji_block(
+        msg="{func_name}",
+        emoji="📄",
+    )
+    def write_back_prices(
+        self,
+        sell_price_ratio: float = 0.25,
+        chunk_size: int = price_writer.DEFAULT_CHUNK_SIZE,
+        dry_run: bool = True,
+    ) -> int:
+        """
+        把 final price table 中的单价写回 ItemTemplate 表. ``BuyPrice`` 就是单价,
+        ``SellPrice`` 是单价乘以 ``sell_price_ratio`` (向下取整). 只有价格有变化的物品
+        才会被更新, 每 ``chunk_size`` 个物品是一个事务. 详见
+        :mod:`~acore_db_app.update.common.price_writer`.
+
+        无论是否 ``dry_run``, 都会生成 :attr:`path_price_patch_sql` 和用于回滚的
+        :attr:`path_price_rollback_sql`, 可以先 review 再用 ``dry_run=False`` 写入.
+
+        :return: 被更新的物品数量, ``dry_run`` 时返回有变化的物品数量.
+        """
+        logger.info(f"Load data from {self.final_price_table_tsv} ...")
+        df_new = pl.read_csv(
+            str(self.final_price_table_tsv),
+            separator="\t",
+            columns=["编号", "单价"],
+            schema_overrides={"编号": pl.Int64, "单价": pl.Int64},
+        ).select(
+            pl.col("编号").alias("entry"),
+            pl.col("单价").alias("BuyPrice"),
+            (pl.col("单价") * sell_price_ratio)
+            .floor()
+            .cast(pl.Int64)
+            .alias("SellPrice"),
+        )
+
+        t_item_template = self.orm.t_item_template
+        with self.orm.engine.connect() as conn:
+            logger.info(f"Load current price from item_template table ...")
+            df_changed = price_writer.diff_prices(
+                df_current=price_writer.read_prices(conn, t_item_template),
+                df_new=df_new,
+            )
+            logger.info(f"price of {df_changed.shape[0]} items changed")
+
+            for path, rollback in [
+                (self.path_price_patch_sql, False),
+                (self.path_price_rollback_sql, True),
+            ]:
+                path.write_text(
+                    price_writer.render_patch(
+                        df_changed=df_changed,
+                        table=t_item_template,
+                        chunk_size=chunk_size,
+                        rollback=rollback,
+                    )
+                )
+                logger.info(f"See: file://{path}")
+
+            if dry_run:
+                return df_changed.shape[0]
+
+            logger.info(f"Write price back to item_template table ...")
+            n_row = price_writer.write_back(
+                conn=conn,
+                table=t_item_template,
+                df_changed=df_changed,
+                chunk_size=chunk_size,
+            )
+            logger.info(f"Done, updated {n_row} items.")
+            return n_row
@@ -10,8 +10,10 @@ from acore_db_app.update.common.craft_spell_recipe import (
 # --- first time creating the recipe.json.gz file ---
 dir_here = Path(__file__).absolute().parent
 path_recipe_json_gz = dir_here.joinpath("recipe.json.gz")
+path_recipe_arrow = dir_here.joinpath("recipe.arrow")
 recipe_list = extract_recipe()
 Recipe.dump_many(recipe_list, path_recipe_json_gz)
+Recipe.dump_ipc(recipe_list, path_recipe_arrow)
 df = Recipe.to_dataframe(recipe_list)
 print(df)
 
@@ -20,3 +22,8 @@ print(df)
 # recipe_list = Recipe.load_many(path_recipe_json_gz)
 # df = Recipe.to_dataframe(recipe_list)
 # print(df)
+
+# --- reuse existing recipe.arrow file ---
+# path_recipe_arrow = download_file("recipe.arrow")
+# df = Recipe.load_dataframe(path_recipe_arrow)
+# print(df)
@@ -17,3 +17,4 @@ wf = CpiWorkflow(orm=orm, dir_workspace=Path.dir_here(__file__))
 # wf.backup_item_template()
 # wf.generate_base_price_table()
 # wf.generate_final_price_table()
+# wf.write_back_prices()
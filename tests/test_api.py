@@ -23,6 +23,16 @@ def test():
 
     _ = api.sdk
     _ = api.sdk.quest.get_latest_n_request
+    _ = api.sdk.quest.iter_latest_n_request_across_instances
+    _ = api.sdk.quest.iter_latest_n_request_for_characters
+    _ = api.sdk.transport.AdaptivePoller
+    _ = api.sdk.transport.BaseTransport
+    _ = api.sdk.transport.SsmTransport
+    _ = api.sdk.transport.SubprocessTransport
+    _ = api.sdk.transport.DirectDbTransport
+    _ = api.sdk.transport.select_transport
+    _ = api.sdk.transport.run_cli_on_instances
+    _ = api.sdk.coalesce.RequestCache
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+
+from acore_db_app.tests.disk_cache import use_tmp_cache
+from acore_db_app.cli.batch import run_batch
+from acore_db_app.cli.chunk import (
+    group_chunks,
+    join_chunks,
+    parse_more,
+    emit_remaining,
+)
+
+
+def test_run_batch():
+    def fetch(char: str, locale: str, n: int):
+        if char == "bad":
+            raise ValueError("character not found")
+        return [{"char": char, "locale": locale}] * n
+
+    lines = [
+        '{"char": "alice", "locale": "zhCN", "n": 2}\n',
+        "\n",
+        '{"char": "bad"}\n',
+        "not json\n",
+        '{"char": "bob"}\n',
+    ]
+    stream = io.StringIO()
+    run_batch(lines=lines, fetch=fetch, stream=stream)
+    results = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    assert len(results) == 4
+    assert results[0]["ok"] is True
+    assert len(results[0]["data"]) == 2
+    assert results[1]["ok"] is False
+    assert "character not found" in results[1]["error"]
+    assert results[2]["ok"] is False
+    assert results[3] == {
+        "char": "bob",
+        "locale": "enUS",
+        "n": 3,
+        "ok": True,
+        "data": [{"char": "bob", "locale": "enUS"}] * 3,
+    }
+
+
+def test_run_batch_gzip():
+    stream = io.StringIO()
+    outputs_before_fetch = list()
+
+    def fetch(char: str, locale: str, n: int):
+        outputs_before_fetch.append(len(group_chunks(stream.getvalue())))
+        return [{"char": char}] * n
+
+    lines = [
+        '{"char": "alice", "n": 2}\n',
+        '{"char": "bob"}\n',
+        # the same request twice gives the same payload
+        '{"char": "bob"}\n',
+    ]
+    run_batch(lines=lines, fetch=fetch, fmt="gzip", stream=stream)
+    # each result is written as soon as it is done
+    assert outputs_before_fetch == [0, 1, 2]
+
+    results = [join_chunks(chunks) for chunks in group_chunks(stream.getvalue())]
+    assert [result["char"] for result in results] == ["alice", "bob", "bob"]
+    assert results[0]["data"] == [{"char": "alice"}] * 2
+
+
+def test_run_batch_gzip_max_size(tmp_path, monkeypatch):
+    use_tmp_cache(monkeypatch, tmp_path)
+
+    def fetch(char: str, locale: str, n: int):
+        # about 30 KB of chunks per result
+        return [{"char": char, "i": i, "noise": str(i * 7919)} for i in range(n)]
+
+    lines = [f'{{"char": "char{i}", "n": 3000}}\n' for i in range(5)]
+    stream = io.StringIO()
+    run_batch(lines=lines, fetch=fetch, fmt="gzip", stream=stream, max_size=24000)
+    stdout = stream.getvalue()
+    # the whole run shares one output budget
+    assert len(stdout) <= 24000
+    key, start = parse_more(stdout)
+
+    texts = [stdout]
+    while key is not None:
+        stream = io.StringIO()
+        emit_remaining(key, start, stream=stream)
+        assert len(stream.getvalue()) <= 24000
+        texts.append(stream.getvalue())
+        key, start = parse_more(stream.getvalue()) or (None, None)
+    assert len(texts) > 2
+
+    results = [join_chunks(chunks) for chunks in group_chunks("\n".join(texts))]
+    assert [result["char"] for result in results] == [f"char{i}" for i in range(5)]
+    assert results[4]["data"] == fetch("char4", "enUS", 3000)
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.cli.batch", preview=False)
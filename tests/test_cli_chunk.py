@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+from acore_db_app.tests.disk_cache import use_tmp_cache
+from acore_db_app.cli.chunk import (
+    Chunk,
+    split_chunks,
+    parse_chunks,
+    parse_more,
+    first_missing_index,
+    join_chunks,
+    emit,
+    emit_remaining,
+)
+
+
+def test_split_and_join(tmp_path, monkeypatch):
+    use_tmp_cache(monkeypatch, tmp_path)
+    obj = [{"quest_id": i, "quest_title": f"任务 {i}"} for i in range(20000)]
+    chunks = split_chunks(obj)
+    assert len(chunks) > 12
+
+    # only part of the chunks fit into one output
+    stream = io.StringIO()
+    emit(obj, fmt="gzip", stream=stream)
+    assert len(stream.getvalue()) <= 24000
+    parsed = parse_chunks(stream.getvalue())
+    next_index = first_missing_index(parsed)
+    assert 0 < next_index < len(chunks)
+    with pytest.raises(ValueError):
+        join_chunks(parsed)
+    key, start = parse_more(stream.getvalue())
+    assert start == 0
+
+    # fetch the remaining chunks, a few at a time
+    while True:
+        stream = io.StringIO()
+        emit_remaining(key, start, stream=stream, max_size=10000)
+        assert len(stream.getvalue()) <= 10000
+        parsed.update(parse_chunks(stream.getvalue()))
+        more = parse_more(stream.getvalue())
+        if more is None:
+            break
+        assert more[0] == key
+        assert more[1] > start
+        start = more[1]
+    assert first_missing_index(parsed) is None
+    assert join_chunks(parsed) == obj
+
+    # small output has no acdb-more line
+    stream = io.StringIO()
+    emit({"a": 1}, fmt="gzip", stream=stream)
+    assert parse_more(stream.getvalue()) is None
+    assert join_chunks(parse_chunks(stream.getvalue())) == {"a": 1}
+
+    with pytest.raises(KeyError):
+        emit_remaining("k0000000000000000", 0, stream=io.StringIO())
+
+
+def test_truncated_line():
+    chunk = split_chunks({"a": 1})[0]
+    line = chunk.to_line()
+    assert Chunk.from_line(line) == chunk
+    assert Chunk.from_line(line[:-1]) is None
+    assert Chunk.from_line("hello world") is None
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.cli.chunk", preview=False)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from acore_db_app.cli.daemon import (
+    HAS_UNIX_SOCKET,
+    DaemonError,
+    serve,
+    connect,
+)
+
+
+@pytest.mark.skipif(not HAS_UNIX_SOCKET, reason="Unix socket is not available")
+def test_serve_and_connect(tmp_path):
+    path_socket = tmp_path / "acoredb.sock"
+    assert connect(path_socket=path_socket) is None
+
+    ready = threading.Event()
+    thread = threading.Thread(
+        target=serve,
+        kwargs=dict(path_socket=path_socket, ready=ready),
+        daemon=True,
+    )
+    thread.start()
+    assert ready.wait(timeout=5)
+
+    with connect(path_socket=path_socket) as client:
+        # one connection can serve many requests
+        assert client.call("ping") == "pong"
+        assert client.call("ping") == "pong"
+        with pytest.raises(DaemonError):
+            client.call("unknown_command")
+
+    # a second daemon on the same socket is refused
+    with pytest.raises(DaemonError):
+        serve(path_socket=path_socket)
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.cli.daemon", preview=False)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from acore_db_app.cli.profile import (
+    ImportTime,
+    parse_importtime,
+    measure_import_time,
+    profile_startup,
+)
+
+SAMPLE = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:        50 |         50 |     marshal
+import time:       300 |        470 | encodings
+some warning printed by a module
+import time: not a number | 12 | broken
+import time:        10 |         10
+import time:       304 |     328835 | acore_db_app.cli.main
+"""
+
+
+def test_parse_importtime():
+    assert parse_importtime(SAMPLE) == [
+        ImportTime(module="_io", self_us=120, cumulative_us=120, depth=1),
+        ImportTime(module="marshal", self_us=50, cumulative_us=50, depth=2),
+        ImportTime(module="encodings", self_us=300, cumulative_us=470, depth=0),
+        ImportTime(
+            module="acore_db_app.cli.main",
+            self_us=304,
+            cumulative_us=328835,
+            depth=0,
+        ),
+    ]
+    assert parse_importtime("") == []
+
+
+def test_measure_import_time(capsys):
+    import_time_list = measure_import_time("json")
+    assert "json" in [import_time.module for import_time in import_time_list]
+    with pytest.raises(RuntimeError):
+        measure_import_time("this_module_does_not_exist")
+
+    profile_startup(modules=["json"], top=3)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("--- import json:")
+    assert len(lines) <= 5
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.cli.profile", preview=False)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+
+import pytest
+import sqlalchemy as sa
+
+from acore_db_app import orm as orm_module
+from acore_db_app.orm import Orm
+from acore_db_app.tests.sqlite import SCHEMAS, make_sqlite_engine
+from acore_db_app.tests.disk_cache import use_tmp_cache
+from acore_db_app.cli.warmup import (
+    REQUIRED_TABLES,
+    StageFailedError,
+    _stage,
+    _validate_metadata,
+    _get_world_data_queries,
+    warmup,
+)
+
+
+def make_engine(tables) -> sa.Engine:
+    engine = make_sqlite_engine(schemas=SCHEMAS)
+    with engine.begin() as conn:
+        for table in tables:
+            conn.exec_driver_sql(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY)")
+    return engine
+
+
+def test_validate_metadata(tmp_path, monkeypatch):
+    path_metadata_cache = tmp_path / "metadata.pickle"
+    monkeypatch.setattr(orm_module, "path_metadata_cache", path_metadata_cache)
+    # a stale cache without any table
+    path_metadata_cache.write_bytes(pickle.dumps(sa.MetaData()))
+
+    orm = Orm(engine=make_engine(REQUIRED_TABLES))
+    _validate_metadata(orm)
+    assert set(REQUIRED_TABLES).issubset(orm._metadata.tables)
+    # the cache is refreshed
+    metadata = pickle.loads(path_metadata_cache.read_bytes())
+    assert set(REQUIRED_TABLES).issubset(metadata.tables)
+
+    path_metadata_cache.write_bytes(pickle.dumps(sa.MetaData()))
+    orm = Orm(engine=make_engine(REQUIRED_TABLES[1:]))
+    with pytest.raises(KeyError, match=REQUIRED_TABLES[0]):
+        _validate_metadata(orm)
+
+
+def test_get_world_data_queries():
+    metadata = sa.MetaData()
+    orm = Orm.__new__(Orm)
+    orm._metadata = metadata
+    for name, columns in [
+        ("quest_template", ["ID", "LogTitle"]),
+        ("quest_template_locale", ["ID", "locale", "Title"]),
+        ("creature_queststarter", ["id", "quest"]),
+        ("creature_questender", ["id", "quest"]),
+        (
+            "creature",
+            ["guid", "id1", "map", "position_x", "position_y", "position_z"],
+        ),
+    ]:
+        sa.Table(
+            name,
+            metadata,
+            *[sa.Column(column, sa.Integer) for column in columns],
+            schema="acore_world",
+        )
+    sqls = [str(stmt) for stmt in _get_world_data_queries(orm)]
+    assert len(sqls) == 4
+    assert "count" not in " ".join(sqls).lower()
+    assert "creature_1.id1 = acore_world.creature_queststarter.id" in sqls[2]
+    assert "creature_1.id1 = acore_world.creature_questender.id" in sqls[3]
+
+
+def test_stage(capsys):
+    timings = list()
+    with _stage("good", timings):
+        pass
+    with pytest.raises(StageFailedError):
+        with _stage("bad", timings):
+            raise ValueError("boom")
+    assert [timing.name for timing in timings] == ["good", "bad"]
+    assert timings[0].ok is True
+    assert timings[1].ok is False
+    assert timings[1].error == "ValueError: boom"
+    assert all(timing.elapsed >= 0 for timing in timings)
+    out = capsys.readouterr().out
+    assert "FAILED ValueError: boom" in out
+
+
+def test_warmup_stops_at_failed_stage(capsys, tmp_path, monkeypatch):
+    from acore_db_app import orm_getter
+
+    cache = use_tmp_cache(monkeypatch, tmp_path / "cache")
+
+    def get_db_info():
+        raise ConnectionError("not on EC2")
+
+    monkeypatch.setattr(orm_getter, "_get_db_info_from_ec2_inside", get_db_info)
+    with pytest.raises(StageFailedError, match="db credential"):
+        warmup()
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines[:2]] == ["import", "disk"]
+    assert lines[2].startswith("db credential")
+    assert "FAILED ConnectionError: not on EC2" in lines[2]
+    assert lines[-1].startswith("total")
+    assert tmp_path.joinpath("cache", "cache.db").exists()
+    cache.close()
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.cli.warmup", preview=False)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import concurrent.futures
+
+import pytest
+
+from acore_db_app.sdk.coalesce import RequestCache
+
+
+def test_cache_and_ttl():
+    cache = RequestCache(ttl=0.2)
+    calls = []
+
+    def func():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_call("a", func) == 1
+    assert cache.get_or_call("a", func) == 1
+    assert cache.get_or_call("b", func) == 2
+    time.sleep(0.3)
+    assert cache.get_or_call("a", func) == 3
+
+
+def test_coalesce_in_flight():
+    cache = RequestCache(ttl=0)
+    calls = []
+    started = threading.Event()
+
+    def func():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "result"
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(cache.get_or_call, "a", func)]
+        started.wait()
+        futures.extend(executor.submit(cache.get_or_call, "a", func) for _ in range(4))
+        assert [future.result() for future in futures] == ["result"] * 5
+    assert len(calls) == 1
+
+    # ttl = 0 never caches finished results
+    assert cache.get_or_call("a", func) == "result"
+    assert len(calls) == 2
+
+
+def test_error_is_not_cached():
+    cache = RequestCache(ttl=10)
+
+    def func():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        cache.get_or_call("a", func)
+    assert cache.get_or_call("a", lambda: "ok") == "ok"
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.sdk.coalesce", preview=False)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+import io
+import sys
+import json
+import time
+import shlex
+import types
+import dataclasses
+
+import pytest
+
+from acore_db_app.app.quest import EnrichedQuestData
+from acore_db_app.tests.disk_cache import use_tmp_cache
+from acore_db_app.cli.batch import run_batch
+from acore_db_app.cli.chunk import emit, emit_remaining
+from acore_db_app.sdk.transport import (
+    RunCommandError,
+    AdaptivePoller,
+    SsmTransport,
+    SubprocessTransport,
+    run_cli_on_instances,
+    select_transport,
+)
+from acore_db_app.sdk import transport as transport_module
+from acore_db_app.sdk.quest import (
+    get_latest_n_quest_via_transport,
+    get_latest_n_request_batch,
+    iter_latest_n_request_across_instances,
+    iter_latest_n_request_for_characters,
+    request_cache,
+)
+from acore_db_app.tests.fake_ssm import FakeSsmClient
+
+
+def test_adaptive_poller():
+    poller = AdaptivePoller(initial_delay=0.1, backoff=2, max_delay=0.3, timeout=10)
+    delays = poller.iter_delays()
+    assert [next(delays) for _ in range(4)] == [0.1, 0.2, 0.3, 0.3]
+
+    poller = AdaptivePoller(initial_delay=0.1, timeout=0)
+    assert list(poller.iter_delays()) == []
+
+
+def test_ssm_transport():
+    poller = AdaptivePoller(initial_delay=0.01, timeout=5)
+
+    # early exit as soon as the command succeeds
+    ssm_client = FakeSsmClient(latency=0.05)
+    transport = SsmTransport(
+        ssm_client=ssm_client, instance_id="i-1", poller=poller, cli_path="echo"
+    )
+    start = time.perf_counter()
+    assert transport.run_cli("hello") == "hello\n"
+    assert time.perf_counter() - start < 0.5
+
+    # failed command
+    ssm_client = FakeSsmClient(handler=lambda instance_id, command: (1, "", "boom"))
+    transport = SsmTransport(ssm_client=ssm_client, instance_id="i-1", poller=poller)
+    with pytest.raises(RunCommandError):
+        transport.run_cli("hello")
+
+    # overall deadline
+    ssm_client = FakeSsmClient(latency=1)
+    transport = SsmTransport(
+        ssm_client=ssm_client,
+        instance_id="i-1",
+        poller=AdaptivePoller(initial_delay=0.01, timeout=0.1),
+    )
+    with pytest.raises(TimeoutError):
+        transport.run_cli("hello")
+
+
+def test_get_latest_n_quest_via_transport(tmp_path, monkeypatch):
+    """
+    The fake server only prints 10000 characters per command, so the SDK has
+    to fetch the remaining chunks with ``acoredb chunk``.
+    """
+    use_tmp_cache(monkeypatch, tmp_path)
+    data = [
+        dataclasses.asdict(
+            EnrichedQuestData(quest_id=i, quest_title_enUS=f"q{i * 7919}")
+        )
+        for i in range(2000)
+    ]
+
+    def handler(instance_id: str, command: str):
+        args = command.split(" ")
+        stream = io.StringIO()
+        if "chunk" in args:
+            key = args[args.index("--key") + 1]
+            start = int(args[args.index("--start") + 1])
+            emit_remaining(key, start, stream=stream, max_size=10000)
+        else:
+            emit(data, fmt="gzip", stream=stream, max_size=10000)
+        return 0, stream.getvalue(), ""
+
+    ssm_client = FakeSsmClient(handler=handler)
+    transport = SsmTransport(
+        ssm_client=ssm_client,
+        instance_id="i-1",
+        poller=AdaptivePoller(initial_delay=0.01, timeout=5),
+        fmt="gzip",
+    )
+    enriched_quest_data_list = get_latest_n_quest_via_transport(
+        transport=transport,
+        character="mychar",
+        locale="enUS",
+        n=2000,
+    )
+    assert [d.quest_id for d in enriched_quest_data_list] == list(range(2000))
+    assert ssm_client.send_command_count == 3
+
+
+def test_get_latest_n_request_batch(tmp_path, monkeypatch):
+    use_tmp_cache(monkeypatch, tmp_path)
+
+    def fetch(char: str, locale: str, n: int):
+        if char == "bad":
+            raise ValueError("character not found")
+        return [
+            dataclasses.asdict(
+                EnrichedQuestData(quest_id=i, quest_title_enUS=f"{char} {i}")
+            )
+            for i in range(n)
+        ]
+
+    def handler(instance_id: str, command: str):
+        args = shlex.split(command)
+        stream = io.StringIO()
+        if "chunk" in args:
+            key = args[args.index("--key") + 1]
+            start = int(args[args.index("--start") + 1])
+            emit_remaining(key, start, stream=stream, max_size=2000)
+        else:
+            # printf '%s' '${requests}' | acoredb quest batch --fmt gzip
+            assert args[0] == "printf"
+            assert args[3] == "|"
+            assert args[5:] == ["quest", "batch", "--fmt", "gzip"]
+            run_batch(
+                lines=args[2].splitlines(),
+                fetch=fetch,
+                fmt="gzip",
+                stream=stream,
+                max_size=2000,
+            )
+        return 0, stream.getvalue(), ""
+
+    ssm_client = FakeSsmClient(handler=handler)
+    results = get_latest_n_request_batch(
+        bsm=types.SimpleNamespace(ssm_client=ssm_client),
+        instance_id="i-1",
+        characters=["alice", "bad", "bob"],
+        locale="enUS",
+        n=100,
+        poller=AdaptivePoller(initial_delay=0.01, timeout=5),
+    )
+    assert ssm_client.send_command_count > 1
+    assert [result.character for result in results] == ["alice", "bad", "bob"]
+    assert [result.ok for result in results] == [True, False, True]
+    assert "character not found" in str(results[1].error)
+    assert [d.quest_title_enUS for d in results[2].data[:2]] == ["bob 0", "bob 1"]
+
+
+def test_subprocess_transport():
+    transport = SubprocessTransport()
+    assert transport.run_cli("hello").strip() == "Hello acore db app user!"
+
+    transport = SubprocessTransport(
+        cli=[sys.executable, "-c", "import sys; print(sys.stdin.read().upper())"]
+    )
+    assert transport.run_cli("", input="hello").strip() == "HELLO"
+
+    transport = SubprocessTransport(
+        cli=[sys.executable, "-c", "import sys; print(' '.join(sys.argv[1:]))"]
+    )
+    assert transport.run_cli("a 'b c'").strip() == "a b c"
+
+    transport = SubprocessTransport(cli=[sys.executable, "-c", "exit(1)"])
+    with pytest.raises(RuntimeError):
+        transport.run_cli("hello")
+
+
+def test_select_transport(tmp_path, monkeypatch):
+    monkeypatch.setattr(transport_module, "get_local_instance_id", lambda: "i-1")
+    path_cli = tmp_path / "acoredb"
+    path_cli.write_text("")
+    bsm = types.SimpleNamespace(ssm_client=FakeSsmClient())
+
+    transport = select_transport(bsm=bsm, instance_id="i-1", local_cli_path=path_cli)
+    assert isinstance(transport, SubprocessTransport)
+    # the local acoredb belongs to another server
+    transport = select_transport(bsm=bsm, instance_id="i-2", local_cli_path=path_cli)
+    assert isinstance(transport, SsmTransport)
+    assert transport.instance_id == "i-2"
+    transport = select_transport(bsm=bsm, instance_id="i-1", local_cli_path=None)
+    assert isinstance(transport, SsmTransport)
+
+
+def _realm_handler(instance_id: str, command: str):
+    # i-2 is the slowest realm, i-3 is broken
+    time.sleep({"i-1": 0.05, "i-2": 0.3, "i-3": 0.1}[instance_id])
+    if instance_id == "i-3":
+        return 1, "", "boom"
+    data = [dataclasses.asdict(EnrichedQuestData(quest_id=1, quest_title_enUS=instance_id))]
+    return 0, json.dumps(data), ""
+
+
+def test_run_cli_on_instances():
+    ssm_client = FakeSsmClient(handler=_realm_handler)
+    results = list(
+        run_cli_on_instances(
+            ssm_client=ssm_client,
+            instance_ids=["i-2", "i-3", "i-1"],
+            args="hello",
+            poller=AdaptivePoller(initial_delay=0.01, max_delay=0.05, timeout=5),
+        )
+    )
+    # results are yielded in completion order, with a single send_command
+    assert [instance_id for instance_id, _ in results] == ["i-1", "i-3", "i-2"]
+    assert isinstance(results[1][1], RunCommandError)
+    assert ssm_client.send_command_count == 1
+
+
+def test_iter_latest_n_request_across_instances():
+    bsm = types.SimpleNamespace(ssm_client=FakeSsmClient(handler=_realm_handler))
+    start = time.perf_counter()
+    results = list(
+        iter_latest_n_request_across_instances(
+            bsm=bsm,
+            instance_ids=["i-1", "i-2", "i-3"],
+            character="mychar",
+            locale="enUS",
+            n=1,
+            poller=AdaptivePoller(initial_delay=0.01, max_delay=0.05, timeout=5),
+        )
+    )
+    # total latency is bounded by the slowest realm, not the sum
+    assert time.perf_counter() - start < 0.45 + 0.3
+    by_id = {result.instance_id: result for result in results}
+    assert by_id["i-1"].data[0].quest_title_enUS == "i-1"
+    assert by_id["i-2"].data[0].quest_title_enUS == "i-2"
+    assert by_id["i-3"].ok is False
+
+
+def test_iter_latest_n_request_for_characters():
+    def handler(instance_id: str, command: str):
+        time.sleep(0.1)
+        args = command.split(" ")
+        char = args[args.index("--char") + 1]
+        if char == "bad":
+            return 1, "", "no such character"
+        data = [dataclasses.asdict(EnrichedQuestData(quest_id=1, quest_title_enUS=char))]
+        return 0, json.dumps(data), ""
+
+    request_cache.clear()
+    bsm = types.SimpleNamespace(ssm_client=FakeSsmClient(handler=handler))
+    start = time.perf_counter()
+    results = list(
+        iter_latest_n_request_for_characters(
+            bsm=bsm,
+            instance_id="i-1",
+            characters=["a", "b", "c", "bad"],
+            locale="enUS",
+            n=1,
+            max_workers=4,
+            poller=AdaptivePoller(initial_delay=0.01, max_delay=0.05, timeout=5),
+        )
+    )
+    assert time.perf_counter() - start < 0.4 * 4
+    by_char = {result.character: result for result in results}
+    assert by_char["b"].data[0].quest_title_enUS == "b"
+    assert isinstance(by_char["bad"].error, RunCommandError)
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.sdk.transport", preview=False)
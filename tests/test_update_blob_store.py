@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import concurrent.futures
+from pathlib import Path
+
+from acore_db_app.update.common import blob_store as blob_store_module
+from acore_db_app.update.common.blob_store import BlobStore, sha256_file
+
+
+def add_file(blob_store: BlobStore, version: str, file_name: str, content: bytes):
+    path = blob_store.get_version_dir(version).joinpath(file_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    blob_store.record(version, file_name, blob_store.add(path))
+    return path
+
+
+def test_blob_store(tmp_path: Path):
+    blob_store = BlobStore(dir_root=tmp_path)
+    path_1 = add_file(blob_store, "0.1.1", "a.txt", b"a" * 100)
+    path_2 = add_file(blob_store, "0.1.2", "a.txt", b"a" * 100)
+    path_3 = add_file(blob_store, "0.1.3", "b.txt", b"b" * 1000)
+    sha256 = sha256_file(path_1)
+    assert blob_store.get_blob_path(sha256).stat().st_nlink == 3
+    assert path_2.stat().st_ino == path_1.stat().st_ino
+    assert blob_store.read_manifest("0.1.1") == {"a.txt": sha256}
+    assert blob_store.read_manifest("0.1.9") == {}
+    assert blob_store.link(sha256, tmp_path.joinpath("0.1.4", "a.txt")) is True
+    assert blob_store.link("0" * 64, tmp_path.joinpath("0.1.4", "c.txt")) is False
+
+    # the oldest versions are evicted first
+    for ith, version in enumerate(["0.1.1", "0.1.2", "0.1.3"]):
+        os.utime(blob_store.get_manifest_path(version), (ith, ith))
+    os.utime(blob_store.get_version_dir("0.1.4"), (3, 3))
+    blob_store.touch("0.1.1")
+    total_size = blob_store.get_total_size()
+    assert 1100 < total_size < 1500
+    # removing 0.1.2 only frees its manifest, a.txt is still used by 0.1.1
+    removed = blob_store.evict(max_bytes=total_size - 1, keep=["0.1.4"])
+    assert [p.name for p in removed] == ["0.1.2"]
+
+    removed = blob_store.evict(max_bytes=500, keep=["0.1.4"])
+    assert [p.name for p in removed] == ["0.1.3"]
+    assert path_3.exists() is False
+    assert len(list(blob_store.dir_blobs.glob("*/*"))) == 1
+
+    removed = blob_store.evict(max_age=3600)
+    assert [p.name for p in removed] == ["0.1.4"]
+    removed = blob_store.evict(max_age=0)
+    assert [p.name for p in removed] == ["0.1.1"]
+    assert list(blob_store.dir_blobs.glob("*/*")) == []
+    assert blob_store.get_total_size() == 0
+
+
+def test_evict_without_hard_link(tmp_path: Path, monkeypatch):
+    def link(src, dst):
+        raise OSError("hard links are not supported")
+
+    # the blobs are copied, so every blob has exactly one link
+    monkeypatch.setattr(blob_store_module.os, "link", link)
+    blob_store = BlobStore(dir_root=tmp_path)
+    path_1 = add_file(blob_store, "0.1.1", "a.txt", b"a" * 100)
+    add_file(blob_store, "0.1.2", "a.txt", b"a" * 100)
+    add_file(blob_store, "0.1.2", "b.txt", b"b" * 100)
+    sha256_a = sha256_file(path_1)
+    assert blob_store.get_blob_path(sha256_a).stat().st_nlink == 1
+
+    # blobs referenced by a manifest are kept
+    assert blob_store.remove_orphan_blobs() == []
+    os.utime(blob_store.get_manifest_path("0.1.1"), (1, 1))
+    os.utime(blob_store.get_manifest_path("0.1.2"), (2, 2))
+    removed = blob_store.evict(max_age=3600, keep=["0.1.1"])
+    assert [p.name for p in removed] == ["0.1.2"]
+    assert [p.name for p in blob_store.dir_blobs.glob("*/*")] == [sha256_a]
+    assert blob_store.link(sha256_a, tmp_path.joinpath("0.1.3", "a.txt")) is True
+
+
+def test_record_concurrently(tmp_path: Path):
+    blob_store = BlobStore(dir_root=tmp_path)
+    file_names = [f"{i}.txt" for i in range(50)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        for file_name in file_names:
+            executor.submit(blob_store.record, "0.1.1", file_name, file_name)
+    assert blob_store.read_manifest("0.1.1") == {name: name for name in file_names}
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.blob_store", preview=False)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import struct
+import typing as T
+from pathlib import Path
+from urllib.error import HTTPError
+
+import polars as pl
+import pytest
+
+from acore_db_app.update.common import craft_spell_recipe
+from acore_db_app.update.common.craft_spell_recipe import (
+    Reagent,
+    Recipe,
+    SPELL_SCHEMA,
+    scan_spell_csv,
+    extract_recipe,
+)
+
+N_COLUMN = 234
+
+
+def make_spell_row(
+    spell_id: int,
+    product_id: int,
+    reagents: T.List[T.Tuple[int, int]],
+    effect: int = 24,
+    die_sides: int = 1,
+    base_points: int = 0,
+    item_type_1: str = "0x0",
+) -> T.Dict[str, T.Any]:
+    row = {str(i): 0 for i in range(1, 1 + N_COLUMN)}
+    row.update({"109": "0x0", "110": "0x0"})
+    row["1"] = spell_id
+    row["72"] = effect
+    row["75"] = die_sides
+    row["81"] = base_points
+    row["108"] = product_id
+    row["109"] = item_type_1
+    for ith, (reagent_id, reagent_count) in enumerate(reagents):
+        row[str(53 + ith)] = reagent_id
+        row[str(61 + ith)] = reagent_count
+    return row
+
+
+def make_spell_csv_gz(path: Path) -> Path:
+    rows = [
+        # a normal recipe, reagent slots can have holes
+        make_spell_row(1, 1001, [(10, 2), (0, 0), (11, 1)], base_points=4),
+        # not a create item spell
+        make_spell_row(2, 1002, [(10, 1)], effect=53),
+        # random product count
+        make_spell_row(3, 1003, [(10, 1)], die_sides=3),
+        # more than one product
+        make_spell_row(4, 1004, [(10, 1)], item_type_1="0x1"),
+        # no reagent
+        make_spell_row(5, 1005, []),
+        # too many reagents
+        make_spell_row(6, 1006, [(i, 1) for i in range(20, 27)]),
+        # two recipes for the same item
+        make_spell_row(7, 1007, [(10, 1)]),
+        make_spell_row(8, 1007, [(11, 1)]),
+        # six reagents is fine
+        make_spell_row(9, 1009, [(i, i) for i in range(30, 36)]),
+    ]
+    df = pl.DataFrame(rows)
+    df.columns = [f"col{i}" for i in range(1, 1 + N_COLUMN)]
+    path.write_bytes(gzip.compress(df.write_csv().encode("utf-8")))
+    return path
+
+
+def make_spell_dbc(path: Path) -> Path:
+    df = pl.read_csv(gzip.decompress(make_spell_csv_gz(path).read_bytes()))
+    df = df.with_columns(
+        pl.col("col109", "col110").str.strip_prefix("0x").str.to_integer(base=16)
+    )
+    records = df.cast(pl.Int32).to_numpy().astype("<i4").tobytes()
+    string_block = b"\0hello\0"
+    header = b"WDBC" + struct.pack(
+        "<4I", df.shape[0], df.shape[1], df.shape[1] * 4, len(string_block)
+    )
+    path.write_bytes(header + records + string_block)
+    return path
+
+
+def test_extract_recipe(tmp_path: Path):
+    path = make_spell_csv_gz(tmp_path.joinpath("Spell.csv.gz"))
+
+    lf = scan_spell_csv(path)
+    assert lf.limit(0).collect().schema == SPELL_SCHEMA
+    assert tmp_path.joinpath("Spell.csv").exists()
+
+    recipes = extract_recipe(path)
+    assert recipes == [
+        Recipe(id=1001, count=5, reagents=[Reagent(10, 2), Reagent(11, 1)]),
+        Recipe(id=1009, count=1, reagents=[Reagent(i, i) for i in range(30, 36)]),
+    ]
+
+    path = make_spell_dbc(tmp_path.joinpath("Spell.dbc"))
+    assert extract_recipe(path_spell_dbc=path) == recipes
+
+
+def test_recipe_to_dataframe():
+    recipes = [
+        Recipe(id=1001, count=5, reagents=[Reagent(10, 2), Reagent(11, 1)]),
+        Recipe(id=1002, count=1, reagents=[Reagent(i, 1) for i in range(20, 27)]),
+    ]
+    df = Recipe.to_dataframe(recipes)
+    assert df.columns[-2:] == ["reagent_id_7", "reagent_count_7"]
+    assert df.row(0) == (1001, 5, 10, 2, 11, 1) + (None,) * 10
+    assert df.row(1)[-2:] == (26, 1)
+    with pytest.raises(ValueError):
+        Recipe.to_dataframe(recipes, n_reagent=6)
+
+    df = Recipe.to_dataframe([])
+    assert df.shape == (0, 14)
+
+
+def test_recipe_ipc(tmp_path: Path, monkeypatch):
+    recipes = [
+        Recipe(id=1001, count=5, reagents=[Reagent(10, 2), Reagent(11, 1)]),
+        Recipe(id=1002, count=1, reagents=[Reagent(1001, 3)]),
+    ]
+    path_arrow = tmp_path.joinpath("recipe.arrow")
+    Recipe.dump_ipc(recipes, path_arrow)
+    assert Recipe.load_dataframe(path_arrow).equals(Recipe.to_dataframe(recipes))
+
+    # older releases only have recipe.json.gz
+    path_arrow.unlink()
+    path_json_gz = tmp_path.joinpath("recipe.json.gz")
+    Recipe.dump_many(recipes, path_json_gz)
+
+    def download_file(file_name: str) -> Path:
+        if file_name == "recipe.arrow":
+            raise HTTPError(file_name, 404, "Not Found", None, None)
+        return tmp_path.joinpath(file_name)
+
+    monkeypatch.setattr(craft_spell_recipe, "download_file", download_file)
+    craft_spell_recipe.clear_cache()
+    assert craft_spell_recipe.get_dataframe().equals(Recipe.to_dataframe(recipes))
+    assert path_arrow.exists()
+
+    # memoized until the file changes
+    assert craft_spell_recipe.get_recipe_list() == recipes
+    Recipe.dump_many(recipes[:1], path_json_gz)
+    Recipe.dump_ipc(recipes[:1], path_arrow)
+    os.utime(path_json_gz, ns=(0, 0))
+    os.utime(path_arrow, ns=(0, 0))
+    df = craft_spell_recipe.get_dataframe()
+    assert df.shape[0] == 1
+    recipe_list = craft_spell_recipe.get_recipe_list()
+    assert recipe_list == recipes[:1]
+    # mutating the returned recipes does not corrupt the cache
+    recipe_list[0].count = 999
+    recipe_list[0].reagents[0].count = 999
+    recipe_list[0].reagents.clear()
+    assert craft_spell_recipe.get_recipe_list() == recipes[:1]
+    df.columns = [f"col{i}" for i in range(len(df.columns))]
+    assert craft_spell_recipe.get_dataframe().columns[0] == "id"
+    craft_spell_recipe.clear_cache()
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(
+        __file__, "acore_db_app.update.common.craft_spell_recipe", preview=False
+    )
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import struct
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from acore_db_app.update.common.dbc import DbcFormatError, DbcFile
+
+
+def test_dbc_file(tmp_path: Path):
+    records = np.array([[1, 0, 7], [2, 7, -1]], dtype="<i4")
+    string_block = b"\0hello\0world\0"
+    header = b"WDBC" + struct.pack("<4I", 2, 3, 12, len(string_block))
+    path = tmp_path.joinpath("Test.dbc")
+    path.write_bytes(header + records.tobytes() + string_block)
+
+    dbc_file = DbcFile.open(path)
+    assert (dbc_file.record_count, dbc_file.field_count) == (2, 3)
+    assert dbc_file.column(0).tolist() == [1, 2]
+    assert dbc_file.column(2).tolist() == [7, -1]
+    assert dbc_file.column(2, dtype="<u4").tolist() == [7, 2**32 - 1]
+    assert [dbc_file.string(offset) for offset in dbc_file.column(1)] == [
+        "",
+        "world",
+    ]
+    df = dbc_file.to_dataframe({"id": 0, "value": 2})
+    assert df.to_dicts() == [{"id": 1, "value": 7}, {"id": 2, "value": -1}]
+    with pytest.raises(IndexError):
+        dbc_file.column(3)
+
+    path.write_bytes(b"WDB2" + header[4:])
+    with pytest.raises(DbcFormatError):
+        DbcFile.open(path)
+    path.write_bytes(header + records.tobytes())
+    with pytest.raises(DbcFormatError):
+        DbcFile.open(path)
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.dbc", preview=False)
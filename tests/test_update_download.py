@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import threading
+import typing as T
+import http.server
+from pathlib import Path
+from urllib.error import HTTPError
+
+import pytest
+
+from acore_db_app.update.common import download as download_module
+from acore_db_app.update.common.download import (
+    ChecksumError,
+    download,
+    download_file,
+    download_and_decompress_file,
+    make_manifest,
+    parse_manifest,
+    prefetch,
+)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve ``files`` with HTTP Range support. ``truncate`` makes the next
+    response for a file stop after that many bytes, to simulate a crash.
+    """
+
+    files: T.Dict[str, bytes] = {}
+    truncate: T.Dict[str, int] = {}
+    ranges: T.List[T.Optional[str]] = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        name = self.path.split("/")[-1]
+        if name not in self.files:
+            self.send_error(404)
+            return
+        content = self.files[name]
+        range_header = self.headers.get("Range")
+        self.ranges.append(range_header)
+        start = 0
+        if range_header:
+            start = int(range_header[len("bytes=") : -1])
+            if start >= len(content):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+            )
+        else:
+            self.send_response(200)
+        body = content[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if name in self.truncate:
+            self.wfile.write(body[: self.truncate.pop(name)])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    Handler.files, Handler.truncate, Handler.ranges = {}, {}, []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def release(server, tmp_path: Path, monkeypatch):
+    """
+    Download releases from the test ``server`` into ``tmp_path``.
+    """
+    monkeypatch.setattr(download_module, "dir_tmp", tmp_path)
+    monkeypatch.setattr(
+        download_module,
+        "get_download_url",
+        lambda file_name, version: f"{server}/{version}/{file_name}",
+    )
+    return server
+
+
+def test_download_resume(server, tmp_path: Path):
+    content = bytes(range(256)) * 1000
+    sha256 = hashlib.sha256(content).hexdigest()
+    Handler.files["a.bin"] = content
+    Handler.truncate["a.bin"] = 1000
+    path = tmp_path.joinpath("a.bin")
+
+    # the crashed download never reaches the final path
+    with pytest.raises(ConnectionError):
+        download(f"{server}/a.bin", path, sha256=sha256, chunk_size=100)
+    assert path.exists() is False
+    assert tmp_path.joinpath("a.bin.part").stat().st_size == 1000
+
+    download(f"{server}/a.bin", path, sha256=sha256)
+    assert path.read_bytes() == content
+    assert Handler.ranges[-1] == "bytes=1000-"
+    assert tmp_path.joinpath("a.bin.part").exists() is False
+
+    # the .part file is already complete
+    path.rename(tmp_path.joinpath("a.bin.part"))
+    download(f"{server}/a.bin", path, sha256=sha256)
+    assert path.read_bytes() == content
+
+
+def test_download_checksum(server, tmp_path: Path):
+    Handler.files["a.bin"] = b"hello"
+    path = tmp_path.joinpath("a.bin")
+    with pytest.raises(ChecksumError):
+        download(f"{server}/a.bin", path, sha256="0" * 64)
+    assert path.exists() is False
+    assert tmp_path.joinpath("a.bin.part").exists() is False
+
+    with pytest.raises(HTTPError):
+        download(f"{server}/b.bin", tmp_path.joinpath("b.bin"))
+
+
+def test_download_file(release, tmp_path: Path):
+    path_a = tmp_path.joinpath("a.txt")
+    path_a.write_bytes(b"a")
+    manifest = make_manifest([path_a])
+    assert parse_manifest(manifest) == {"a.txt": hashlib.sha256(b"a").hexdigest()}
+
+    # release without manifest
+    Handler.files["b.txt"] = b"b"
+    assert download_file("b.txt", version="0.1.1").read_bytes() == b"b"
+
+    # release with manifest
+    Handler.files["sha256sums.txt"] = manifest.encode("utf-8")
+    Handler.files["a.txt"] = b"corrupted"
+    with pytest.raises(ChecksumError):
+        download_file("a.txt", version="0.1.2")
+    Handler.files["a.txt"] = b"a"
+    assert download_file("a.txt", version="0.1.2").read_bytes() == b"a"
+
+
+def test_prefetch(release, tmp_path: Path):
+    Handler.files.update({"a.txt": b"a", "b.txt": b"b"})
+    results = prefetch(version="0.1.1", file_names=["a.txt", "b.txt", "c.txt"])
+    assert results["a.txt"].read_bytes() == b"a"
+    assert results["b.txt"].read_bytes() == b"b"
+    assert isinstance(results["c.txt"], HTTPError)
+
+    # recipe.arrow is optional, older releases do not have it
+    Handler.files.update({name: b"x" for name in ["Spell.csv.gz", "recipe.json.gz"]})
+    Handler.files["final-price-table.tsv"] = b"x"
+    results = prefetch(version="0.1.2")
+    assert results.pop("recipe.arrow") is None
+    assert all(isinstance(path, Path) for path in results.values())
+
+
+def test_download_file_dedup(release, tmp_path: Path):
+    path_a = tmp_path.joinpath("a.txt")
+    path_a.write_bytes(b"a")
+    Handler.files["sha256sums.txt"] = make_manifest([path_a]).encode("utf-8")
+    Handler.files["a.txt"] = b"a"
+
+    path_1 = download_file("a.txt", version="0.1.1")
+    n_request = len(Handler.ranges)
+    # the same content in another release is linked, not downloaded again
+    path_2 = download_file("a.txt", version="0.1.2")
+    assert Handler.ranges.count(None) == n_request + 1  # only the manifest
+    assert path_2.read_bytes() == b"a"
+    assert path_1.stat().st_ino == path_2.stat().st_ino
+    assert download_module.get_blob_store().read_manifest("0.1.2") == {
+        "a.txt": hashlib.sha256(b"a").hexdigest()
+    }
+
+
+def test_download_and_decompress_file(release, tmp_path: Path):
+    Handler.files["a.csv.gz"] = gzip.compress(b"a,b\n1,2\n")
+    path = download_and_decompress_file("a.csv.gz", version="0.1.1")
+    assert path == tmp_path.joinpath("0.1.1", "a.csv")
+    assert path.read_bytes() == b"a,b\n1,2\n"
+    blob_store = download_module.get_blob_store()
+    assert blob_store.read_manifest("0.1.1") == {
+        "a.csv.gz": hashlib.sha256(Handler.files["a.csv.gz"]).hexdigest(),
+        "a.csv": hashlib.sha256(b"a,b\n1,2\n").hexdigest(),
+    }
+    assert list(tmp_path.joinpath("0.1.1").glob("*.part")) == []
+
+    # already decompressed
+    del Handler.files["a.csv.gz"]
+    assert download_and_decompress_file("a.csv.gz", version="0.1.1") == path
+
+
+def test_download_file_evict(release, tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(download_module, "MAX_CACHE_BYTES", 1500)
+    Handler.files["a.txt"] = b"a" * 1000
+    download_file("a.txt", version="0.1.1")
+    Handler.files["a.txt"] = b"b" * 1000
+    download_file("a.txt", version="0.1.2")
+    # the other version is removed, but the current version is always kept
+    assert tmp_path.joinpath("0.1.1").exists() is False
+    assert download_file("a.txt", version="0.1.2").read_bytes() == b"b" * 1000
+    assert download_module.get_blob_store().get_total_size() < 1500
+    assert len(list(tmp_path.joinpath("blobs").glob("*/*"))) == 1
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.download", preview=False)
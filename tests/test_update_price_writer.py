@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import polars as pl
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
+
+from acore_db_app.tests.sqlite import make_sqlite_engine
+from acore_db_app.update.common.price_writer import (
+    read_prices,
+    diff_prices,
+    render_patch,
+    make_temp_table,
+    make_update_statement,
+    make_drop_temp_table_sql,
+    write_back,
+)
+
+metadata = sa.MetaData()
+t_item_template = sa.Table(
+    "item_template",
+    metadata,
+    sa.Column("entry", sa.Integer, primary_key=True),
+    sa.Column("name", sa.String(100)),
+    sa.Column("BuyPrice", sa.BigInteger),
+    sa.Column("SellPrice", sa.Integer),
+)
+
+
+def make_engine() -> sa.Engine:
+    return make_sqlite_engine(
+        metadata=metadata,
+        rows={
+            t_item_template: [
+                dict(entry=i, name=f"item {i}", BuyPrice=i * 100, SellPrice=i * 25)
+                for i in range(1, 11)
+            ]
+        },
+    )
+
+
+def test_write_back():
+    engine = make_engine()
+    df_new = pl.DataFrame(
+        {
+            # 1 and 2 are unchanged, 99 does not exist
+            "entry": [1, 2, 3, 4, 5, 99],
+            "BuyPrice": [100, 200, 3000, 400, 5000, 1],
+            "SellPrice": [25, 50, 750, 1, 1250, 1],
+        }
+    )
+    with engine.connect() as conn:
+        df_changed = diff_prices(read_prices(conn, t_item_template), df_new)
+        assert df_changed["entry"].to_list() == [3, 4, 5]
+
+        patch = render_patch(df_changed, t_item_template, chunk_size=2)
+        assert patch.count("START TRANSACTION;") == 2
+        assert (
+            "UPDATE item_template SET BuyPrice = 3000, SellPrice = 750 "
+            "WHERE entry = 3; -- BuyPrice 300 -> 3000, SellPrice 75 -> 750"
+        ) in patch
+        rollback = render_patch(df_changed, t_item_template, rollback=True)
+        assert "SET BuyPrice = 400, SellPrice = 100 WHERE entry = 4;" in rollback
+
+        # a temp table left on the pooled connection by a crashed run
+        make_temp_table(t_item_template).create(conn)
+        conn.commit()
+
+        # entry 5 is changed by someone else after the diff
+        conn.execute(
+            t_item_template.update()
+            .where(t_item_template.c.entry == 5)
+            .values(BuyPrice=5000, SellPrice=1250)
+        )
+        conn.commit()
+        assert write_back(conn, t_item_template, df_changed, chunk_size=2) == 2
+
+        df = read_prices(conn, t_item_template).sort("entry")
+        assert df["BuyPrice"].to_list()[:5] == [100, 200, 3000, 400, 5000]
+        assert df["SellPrice"].to_list()[:5] == [25, 50, 750, 1, 1250]
+        assert diff_prices(df, df_new).shape[0] == 0
+
+
+def test_mysql_statements():
+    t_world_item_template = t_item_template.to_metadata(
+        sa.MetaData(), schema="acore_world"
+    )
+    t_tmp = make_temp_table(t_world_item_template)
+    dialect = mysql.dialect()
+
+    sql = str(CreateTable(t_tmp).compile(dialect=dialect))
+    assert sql.strip().startswith(
+        "CREATE TEMPORARY TABLE acore_world.tmp_item_price"
+    )
+
+    sql = str(sa.insert(t_tmp).compile(dialect=dialect))
+    assert sql == (
+        "INSERT INTO acore_world.tmp_item_price (entry, `BuyPrice`, `SellPrice`) "
+        "VALUES (%s, %s, %s)"
+    )
+
+    stmt = make_update_statement(t_world_item_template, t_tmp)
+    sql = str(stmt.compile(dialect=dialect))
+    assert sql == (
+        "UPDATE acore_world.item_template, acore_world.tmp_item_price "
+        "SET item_template.`BuyPrice`=acore_world.tmp_item_price.`BuyPrice`, "
+        "item_template.`SellPrice`=acore_world.tmp_item_price.`SellPrice` "
+        "WHERE acore_world.item_template.entry = acore_world.tmp_item_price.entry "
+        "AND (acore_world.item_template.`BuyPrice` != "
+        "acore_world.tmp_item_price.`BuyPrice` "
+        "OR acore_world.item_template.`SellPrice` != "
+        "acore_world.tmp_item_price.`SellPrice`)"
+    )
+
+    assert make_drop_temp_table_sql(t_tmp, dialect) == (
+        "DROP TEMPORARY TABLE IF EXISTS acore_world.tmp_item_price"
+    )
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.price_writer", preview=False)
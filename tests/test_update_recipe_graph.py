@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import polars as pl
+
+from acore_db_app.update.common.recipe_graph import (
+    find_cycles,
+    propagate_prices,
+    PriceSnapshot,
+    find_dependents,
+    propagate_prices_incremental,
+)
+
+
+def make_graph():
+    # a chain deeper than 10 levels
+    reagents = {i: {i - 1: 2} for i in range(1, 16)}
+    product_counts = {i: 2 for i in range(1, 16)}
+    # 100 has a known price, so its recipe is ignored
+    reagents[100] = {1: 1}
+    product_counts[100] = 1
+    # 101 needs 999, which has no price and no recipe
+    reagents[101] = {0: 1, 999: 1}
+    product_counts[101] = 1
+    # 102 needs 101
+    reagents[102] = {101: 1}
+    product_counts[102] = 1
+    # 201 <-> 202 is a cycle, 203 depends on it, 204 uses itself
+    reagents.update({201: {202: 1}, 202: {201: 1, 0: 1}, 203: {202: 1}, 204: {204: 1}})
+    product_counts.update({201: 1, 202: 1, 203: 1, 204: 1})
+    base_prices = {0: 1.5, 100: 7.0}
+    return base_prices, reagents, product_counts
+
+
+def make_frames(base_prices, reagents, product_counts):
+    ids = sorted(set(reagents).union(base_prices))
+    df_price = pl.DataFrame(
+        {
+            "id": ids,
+            "price": [base_prices.get(id) for id in ids],
+            "markup": [2.0 if id == 1 else None for id in ids],
+        }
+    )
+    df_edge = pl.DataFrame(
+        [
+            (id, product_counts[id], reagent_id, reagent_count)
+            for id, dct in reagents.items()
+            for reagent_id, reagent_count in dct.items()
+        ],
+        schema=["id", "product_count", "reagent_id", "reagent_count"],
+        orient="row",
+    )
+    return df_price, df_edge
+
+
+def test_propagate_prices():
+    base_prices, reagents, product_counts = make_graph()
+    df_price, df_edge = make_frames(base_prices, reagents, product_counts)
+
+    result = propagate_prices(df_price, df_edge)
+    prices = dict(result.df_price.iter_rows())
+    assert prices == {**{i: 1.5 for i in range(16)}, 100: 7.0}
+    # 101 can be sorted, but its price is missing
+    assert result.levels[0] == [1, 101]
+    assert result.levels[1] == [2, 102]
+    assert len(result.levels) == 15
+    assert result.cycles == [[201, 202], [204]]
+    assert result.unresolvable == [101, 102, 201, 202, 203, 204]
+
+    # the markup of 1 is applied and propagated to the items made from it
+    result = propagate_prices(df_price, df_edge, apply_markup=True)
+    prices = dict(result.df_price.iter_rows())
+    assert [prices[i] for i in range(4)] == [1.5, 3.0, 3.0, 3.0]
+    assert prices[100] == 7.0
+
+
+def test_propagate_prices_incremental(tmp_path):
+    base_prices, reagents, product_counts = make_graph()
+    df_price, df_edge = make_frames(base_prices, reagents, product_counts)
+    result = propagate_prices(df_price, df_edge, apply_markup=True)
+    PriceSnapshot(
+        df_price=df_price,
+        df_edge=df_edge,
+        df_result=result.df_price,
+        apply_markup=True,
+    ).dump(tmp_path)
+    snapshot = PriceSnapshot.load(tmp_path)
+    assert PriceSnapshot.load(tmp_path.joinpath("not-exists")) is None
+
+    assert find_dependents(df_edge, [13]) == {13, 14, 15}
+
+    # change the price of 999, so 101 and 102 can be resolved now;
+    # change the recipe of 13, which affects 14 and 15
+    base_prices[999] = 0.5
+    reagents[13] = {12: 4}
+    df_price, df_edge = make_frames(base_prices, reagents, product_counts)
+    expected = propagate_prices(df_price, df_edge, apply_markup=True)
+    result = propagate_prices_incremental(
+        snapshot, df_price, df_edge, apply_markup=True
+    )
+    assert result.recomputed == [13, 14, 15, 101, 102, 999]
+    assert dict(result.df_price.iter_rows()) == dict(expected.df_price.iter_rows())
+    assert result.unresolvable == expected.unresolvable
+
+    # nothing changed
+    snapshot.df_price, snapshot.df_edge = df_price, df_edge
+    snapshot.df_result = expected.df_price
+    result = propagate_prices_incremental(
+        snapshot, df_price, df_edge, apply_markup=True
+    )
+    assert result.recomputed == []
+    assert result.levels == []
+    assert dict(result.df_price.iter_rows()) == dict(expected.df_price.iter_rows())
+
+    # different apply_markup means full recomputation
+    result = propagate_prices_incremental(snapshot, df_price, df_edge)
+    assert result.recomputed is None
+
+
+def test_find_cycles():
+    successors = {1: [2], 2: [3], 3: [1, 4], 4: [5], 5: [4], 6: [1]}
+    assert sorted(find_cycles({1, 2, 3, 4, 5, 6}, successors)) == [
+        [1, 2, 3],
+        [4, 5],
+    ]
+    assert find_cycles({1, 2}, successors) == []
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.recipe_graph", preview=False)
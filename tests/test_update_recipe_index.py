@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+from pathlib import Path
+
+import polars as pl
+
+from acore_db_app.update.common import recipe_index as recipe_index_module
+from acore_db_app.update.common.craft_spell_recipe import (
+    Reagent,
+    Recipe,
+    clear_cache,
+)
+from acore_db_app.update.common.recipe_index import (
+    INDEX_SCHEMA,
+    RecipeIndex,
+    get_recipe_index,
+)
+
+recipes = [
+    # 1 -> 101 -> 201, 1 + 2 -> 102
+    Recipe(id=101, count=1, reagents=[Reagent(1, 2)]),
+    Recipe(id=102, count=1, reagents=[Reagent(1, 1), Reagent(2, 3)]),
+    Recipe(id=201, count=2, reagents=[Reagent(101, 4), Reagent(3, 1)]),
+]
+
+
+def test_recipe_index(tmp_path: Path, monkeypatch):
+    recipe_index = RecipeIndex.from_recipes(recipes)
+    assert recipe_index.get_reagents(102) == {1: 1, 2: 3}
+    assert recipe_index.get_reagents(1) == {}
+    assert recipe_index.get_products(1) == [101, 102]
+    assert recipe_index.get_products(999) == []
+    assert recipe_index.get_affected_products([1]) == {101, 102, 201}
+    assert recipe_index.get_affected_products([3]) == {201}
+
+    path_recipe_arrow = tmp_path.joinpath("recipe.arrow")
+    Recipe.dump_ipc(recipes, path_recipe_arrow)
+    monkeypatch.setattr(
+        recipe_index_module, "get_recipe_arrow_path", lambda: path_recipe_arrow
+    )
+    # the returned values are copies
+    recipe_index.get_reagents(102)[1] = 999
+    recipe_index.get_products(1).append(999)
+    assert recipe_index.get_reagents(102) == {1: 1, 2: 3}
+    assert recipe_index.get_products(1) == [101, 102]
+
+    assert RecipeIndex.from_index_dataframe(recipe_index.to_dataframe()) == recipe_index
+
+    clear_cache()
+    assert get_recipe_index() == recipe_index
+    path_index_arrow = tmp_path.joinpath("recipe-index.arrow")
+    # the reverse index is persisted as a list column, one row per item
+    df = pl.read_ipc(str(path_index_arrow))
+    assert df.schema == INDEX_SCHEMA
+    assert df.row(0) == (1, None, None, [101, 102])
+    assert df.filter(pl.col("id") == 101).row(0) == (101, [1], [2], [201])
+
+    # the loaded index is memoized, and reloaded when the file changes
+    def load(path_arrow):
+        raise AssertionError("should not be called")
+
+    monkeypatch.setattr(RecipeIndex, "load", load)
+    assert get_recipe_index() is get_recipe_index()
+    monkeypatch.undo()
+    monkeypatch.setattr(
+        recipe_index_module, "get_recipe_arrow_path", lambda: path_recipe_arrow
+    )
+    stat = path_index_arrow.stat()
+    RecipeIndex.from_recipes(recipes[:1]).dump(path_index_arrow)
+    os.utime(path_index_arrow, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert get_recipe_index().get_products(1) == [101]
+    clear_cache()
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.recipe_index", preview=False)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlalchemy as sa
+
+from acore_db_app.tests.sqlite import make_sqlite_engine
+from acore_db_app.update.common.sql_loader import read_dataframe, write_parquet
+
+metadata = sa.MetaData()
+t_item = sa.Table(
+    "item",
+    metadata,
+    sa.Column("entry", sa.Integer, primary_key=True),
+    sa.Column("name", sa.String(100)),
+    sa.Column("price", sa.Numeric(10, 2)),
+    sa.Column("weight", sa.Float),
+)
+
+
+def make_engine() -> sa.Engine:
+    return make_sqlite_engine(
+        metadata=metadata,
+        rows={
+            t_item: [
+                dict(
+                    entry=i,
+                    # the first chunk has only nulls
+                    name=None if i < 10 else f"item {i}",
+                    price=None if i < 10 else i / 4,
+                    weight=i * 1.5,
+                )
+                for i in range(25)
+            ]
+        },
+    )
+
+
+def test_write_parquet(tmp_path: Path):
+    engine = make_engine()
+    path = tmp_path.joinpath("item.parquet")
+    with engine.connect() as conn:
+        n_row = write_parquet(conn, sa.select(t_item), path, chunk_size=10)
+    assert n_row == 25
+    parquet_file = pq.ParquetFile(str(path))
+    assert parquet_file.num_row_groups == 3
+    assert parquet_file.schema_arrow == pa.schema(
+        [
+            ("entry", pa.int64()),
+            ("name", pa.string()),
+            ("price", pa.float64()),
+            ("weight", pa.float64()),
+        ]
+    )
+    table = parquet_file.read()
+    assert table.column("name").to_pylist()[9:11] == [None, "item 10"]
+    assert table.column("price").to_pylist()[-1] == 6.0
+    assert tmp_path.joinpath("item.parquet.part").exists() is False
+
+
+def test_read_dataframe():
+    engine = make_engine()
+    stmt = sa.select(t_item.c.entry, t_item.c.name).where(t_item.c.entry >= 5)
+    with engine.connect() as conn:
+        df = read_dataframe(conn, stmt, chunk_size=10)
+        assert df.schema == {"entry": pl.Int64, "name": pl.Utf8}
+        assert df.shape == (20, 2)
+        assert df["name"].null_count() == 5
+
+        df = read_dataframe(conn, stmt.where(t_item.c.entry < 0))
+        assert df.schema == {"entry": pl.Int64, "name": pl.Utf8}
+        assert df.shape == (0, 2)
+
+
+if __name__ == "__main__":
+    from acore_db_app.tests import run_cov_test
+
+    run_cov_test(__file__, "acore_db_app.update.common.sql_loader", preview=False)